@@ -0,0 +1,115 @@
+import { useEffect } from 'react';
+import { useQueryClient } from '@tanstack/react-query';
+import api from '../utils/api';
+import { useScheduleStore } from '../stores/scheduleStore';
+import { Assignment, KidDetails, ShiftEvent } from '../types';
+
+type ShiftUpdate = Pick<ShiftEvent, 'id' | 'ratio_min' | 'is_special' | 'openShift'> & { leads_required: number };
+type ShiftCreated = Pick<
+  ShiftEvent,
+  'id' | 'site' | 'start_time' | 'end_time' | 'ratio_min' | 'difficulty' | 'openShift'
+> & { leads_required: number };
+type KidCreated = KidDetails & { shift_id: string | null; assignment_id: string | null };
+type AssignmentCreated = Pick<Assignment, 'id' | 'staff_id' | 'title'> & {
+  shift_id: string;
+  difficulty_rating: Assignment['difficulty'];
+  kids: KidCreated[];
+};
+
+// Replayed events must not add the same kid twice.
+const withKid = (kids: KidDetails[] = [], kid: KidDetails): KidDetails[] =>
+  kids.some((existing) => existing.id === kid.id) ? kids : [...kids, kid];
+
+// setQueryData skips the query's onSuccess, so the store is refreshed here as well.
+const publish = (shifts: ShiftEvent[]) => {
+  const { setShifts, setAssignments, setKids } = useScheduleStore.getState();
+  setShifts(shifts);
+  const assignments = shifts.flatMap((shift) => shift.assignments ?? []);
+  setAssignments(assignments);
+  setKids(assignments.flatMap((assignment) => assignment.kids ?? []));
+};
+
+export const useChangeStream = (accountId: string) => {
+  const queryClient = useQueryClient();
+
+  useEffect(() => {
+    if (!accountId) {
+      return undefined;
+    }
+    const source = new EventSource(`${api.defaults.baseURL}/accounts/${accountId}/events`);
+    const queryKey = ['shifts', accountId];
+    const apply = (change: (shifts: ShiftEvent[]) => ShiftEvent[]) => {
+      const shifts = queryClient.setQueryData<ShiftEvent[]>(queryKey, (current) => current && change(current));
+      if (shifts) {
+        publish(shifts);
+      }
+    };
+    const on = <T>(name: string, handle: (payload: T) => void) =>
+      source.addEventListener(name, (event) => handle(JSON.parse((event as MessageEvent).data) as T));
+
+    on<ShiftUpdate>('shift.updated', ({ id, leads_required, ...changes }) =>
+      apply((shifts) =>
+        shifts.map((shift) => (shift.id === id ? { ...shift, ...changes, leadsRequired: leads_required } : shift)),
+      ),
+    );
+    on<ShiftCreated>('shift.created', ({ leads_required, ...created }) => {
+      const shift: ShiftEvent = {
+        ...created,
+        account_group_id: accountId,
+        leadsRequired: leads_required,
+        role: 'Staff',
+        is_special: false,
+        assignments: [],
+        kids: [],
+      };
+      apply((shifts) =>
+        shifts.some((existing) => existing.id === shift.id)
+          ? shifts
+          : [...shifts, shift].sort((left, right) => left.start_time.localeCompare(right.start_time)),
+      );
+    });
+    on<AssignmentCreated>('assignment.created', ({ shift_id, difficulty_rating, kids, ...created }) =>
+      apply((shifts) =>
+        shifts.map((shift) =>
+          shift.id !== shift_id || shift.assignments.some((assignment) => assignment.id === created.id)
+            ? shift
+            : {
+                ...shift,
+                assignments: [
+                  ...shift.assignments,
+                  { ...created, site: shift.site, difficulty: difficulty_rating, kids, kidsCount: kids.length },
+                ],
+                kids: kids.filter((kid) => kid.shift_id === shift.id).reduce(withKid, shift.kids),
+                pendingAssignmentId: shift.pendingAssignmentId ?? (created.staff_id ? undefined : created.id),
+              },
+        ),
+      ),
+    );
+    on<KidCreated>('kid.created', (kid) =>
+      apply((shifts) =>
+        shifts.map((shift) => {
+          const onShift = kid.shift_id === shift.id;
+          const onAssignment = shift.assignments.some((assignment) => assignment.id === kid.assignment_id);
+          if (!onShift && !onAssignment) {
+            return shift;
+          }
+          return {
+            ...shift,
+            kids: onShift ? withKid(shift.kids, kid) : shift.kids,
+            assignments: shift.assignments.map((assignment) => {
+              if (assignment.id !== kid.assignment_id) {
+                return assignment;
+              }
+              const assignmentKids = withKid(assignment.kids, kid);
+              return { ...assignment, kids: assignmentKids, kidsCount: assignmentKids.length };
+            }),
+          };
+        }),
+      ),
+    );
+    // Only a reset (the stream fell behind or switched shards) needs a full refetch.
+    source.addEventListener('reset', () => queryClient.invalidateQueries(queryKey));
+
+    return () => source.close();
+  }, [accountId, queryClient]);
+};
@@ -3,19 +3,57 @@ import { useQuery } from '@tanstack/react-query';
 import { useAccountContext } from '../context/AccountContext';
 import api from '../utils/api';
 import { useScheduleStore } from '../stores/scheduleStore';
+import { useChangeStream } from '../hooks/useChangeStream';
 import { useGeofence } from '../hooks/useGeofence';
 import { ShiftEvent } from '../types';
 import { StatusChip } from '../components/StatusChip';
 import { TeamManager } from '../components/TeamManager';
 
-const fetchShifts = (accountId: string) =>
-  api
-    .get<ShiftEvent[]>('/shifts', { params: { account_id: accountId, expand: 'assignments,kids' } })
-    .then((res) => res.data);
+type ShiftPage = { shifts: ShiftEvent[]; next_cursor: string | null };
+
+// The dashboard shows shifts from yesterday through the next two weeks.
+const WINDOW_DAYS_BEFORE = 1;
+const WINDOW_DAYS_AFTER = 14;
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+// Naive UTC timestamps, matching how the API stores shift times.
+const utcTimestamp = (date: Date) => date.toISOString().slice(0, 19);
+
+const dashboardWindow = () => {
+  const today = new Date();
+  today.setUTCHours(0, 0, 0, 0);
+  return {
+    from: utcTimestamp(new Date(today.getTime() - WINDOW_DAYS_BEFORE * DAY_MS)),
+    to: utcTimestamp(new Date(today.getTime() + (WINDOW_DAYS_AFTER + 1) * DAY_MS)),
+  };
+};
+
+// The listing is keyset-paginated; follow next_cursor within the visible window.
+const fetchShifts = async (accountId: string) => {
+  const shifts: ShiftEvent[] = [];
+  const { from, to } = dashboardWindow();
+  let cursor: string | null = null;
+  do {
+    const { data }: { data: ShiftPage } = await api.get<ShiftPage>('/shifts', {
+      params: {
+        account_id: accountId,
+        expand: 'assignments,kids',
+        from,
+        to,
+        limit: 500,
+        cursor: cursor ?? undefined,
+      },
+    });
+    shifts.push(...data.shifts);
+    cursor = data.next_cursor;
+  } while (cursor);
+  return shifts;
+};
 
 export const Dashboard = () => {
   const { selectedAccount } = useAccountContext();
   const { setShifts, setAssignments, setKids } = useScheduleStore();
+  useChangeStream(selectedAccount.id);
 
   const { data: shifts = [], isLoading } = useQuery(['shifts', selectedAccount.id], () => fetchShifts(selectedAccount.id), {
     refetchOnWindowFocus: false,
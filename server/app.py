@@ -1,17 +1,63 @@
 from flask import Flask, jsonify, send_from_directory
 from flask_cors import CORS
 from .config import Config
-from .database import db, migrate
+from .database import REPLICA_BIND, db, migrate, shard_bind
 from .routes import register_routes
+from .services.auth import PasswordPoolBusy
+from .services.changes import register_change_listeners
+from .services.checkins import CheckInBufferFull
+from .services.geofence_index import register_geofence_listeners
+from .services.jobs import jobs_cli
+from .services.outbox import outbox_cli, register_outbox_listeners
+from .services.principals import register_principal_listeners
+from .services.ratios import ratios_cli
+from .services.rollups import register_rollup_listeners, rollups_cli
+from .services.sharding import register_shard_routing, shards_cli
+from .services.sync import register_sync_listeners, sync_cli
+from .utils.read_routing import register_read_routing
 
 
-def create_app():
+def create_app(config_overrides=None):
     app = Flask(__name__, static_folder='static', static_url_path='/static')
     app.config.from_object(Config)
+    # Engines are bound in init_app, so database URLs must be overridden here.
+    app.config.update(config_overrides or {})
+    if app.config.get('SQLALCHEMY_REPLICA_URI'):
+        app.config['SQLALCHEMY_BINDS'] = {
+            **(app.config.get('SQLALCHEMY_BINDS') or {}),
+            REPLICA_BIND: app.config['SQLALCHEMY_REPLICA_URI'],
+        }
+    if app.config.get('SQLALCHEMY_SHARD_URIS'):
+        app.config['SQLALCHEMY_BINDS'] = {
+            **(app.config.get('SQLALCHEMY_BINDS') or {}),
+            **{shard_bind(name): uri for name, uri in app.config['SQLALCHEMY_SHARD_URIS'].items()},
+        }
     db.init_app(app)
     migrate.init_app(app, db)
     CORS(app)
     register_routes(app)
+    register_rollup_listeners()
+    register_outbox_listeners()
+    register_change_listeners()
+    register_sync_listeners()
+    register_principal_listeners()
+    register_geofence_listeners()
+    register_read_routing(app)
+    register_shard_routing(app)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(ratios_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(sync_cli)
+    app.cli.add_command(shards_cli)
+
+    @app.errorhandler(PasswordPoolBusy)
+    def password_pool_busy(error):
+        return jsonify({'error': 'Too many sign-in attempts in progress, retry shortly'}), 503, {'Retry-After': '1'}
+
+    @app.errorhandler(CheckInBufferFull)
+    def checkin_buffer_full(error):
+        return jsonify({'error': 'Check-ins are backed up, retry shortly'}), 503, {'Retry-After': '5'}
 
     @app.route('/')
     def root():
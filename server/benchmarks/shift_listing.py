@@ -0,0 +1,162 @@
+"""Compare the legacy joinedload shift listing with the batch loader.
+
+Run from the repository root::
+
+    python -m server.benchmarks.shift_listing --shifts 10000
+
+Seeds a throwaway SQLite database and reports query count and wall time for
+serializing every shift through each path.
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+
+from ..database import db
+from ..models import AccountGroup, Assignment, Kid, Shift, StaffMember
+from ..services.shift_loader import load_shift_batch, shift_select
+from ..utils.serializers import kid_payload, shift_batch_payload
+
+
+def _seed(shift_count: int, assignments_per_shift: int, kids_per_assignment: int) -> None:
+    account = AccountGroup(name='Benchmark Campus', timezone='UTC')
+    db.session.add(account)
+    db.session.flush()
+    staff_rows = [
+        {'id': f'staff-{index}', 'full_name': f'Staff {index}', 'email': f'staff{index}@bench.local', 'role': 'Staff'}
+        for index in range(50)
+    ]
+    db.session.execute(StaffMember.__table__.insert(), staff_rows)
+
+    base = datetime(2024, 1, 1, 7, 0)
+    shifts, assignments, kids = [], [], []
+    for shift_index in range(shift_count):
+        shift_id = f'shift-{shift_index}'
+        start = base + timedelta(hours=shift_index)
+        shifts.append(
+            {
+                'id': shift_id,
+                'account_group_id': account.id,
+                'site': 'Main Hall',
+                'start_time': start,
+                'end_time': start + timedelta(hours=8),
+                'ratio_min': 2,
+                'leads_required': 1,
+                'is_special': False,
+                'difficulty': 'standard',
+                'open_shift': shift_index % 4 == 0,
+            }
+        )
+        for assignment_index in range(assignments_per_shift):
+            assignment_id = f'{shift_id}-a{assignment_index}'
+            assignments.append(
+                {
+                    'id': assignment_id,
+                    'shift_id': shift_id,
+                    'staff_id': staff_rows[(shift_index + assignment_index) % len(staff_rows)]['id'],
+                    'title': 'Kid assignment',
+                    'difficulty_rating': 2,
+                    'requires_one_on_one': False,
+                }
+            )
+            for kid_index in range(kids_per_assignment):
+                kids.append(
+                    {
+                        'id': f'{assignment_id}-k{kid_index}',
+                        'full_name': f'Kid {kid_index}',
+                        'ratio': '1:3',
+                        'banned_staff': [],
+                        'requires_personal_trainer': False,
+                        'account_group_id': account.id,
+                        'shift_id': shift_id,
+                        'assignment_id': assignment_id,
+                    }
+                )
+    db.session.execute(Shift.__table__.insert(), shifts)
+    db.session.execute(Assignment.__table__.insert(), assignments)
+    db.session.execute(Kid.__table__.insert(), kids)
+    db.session.commit()
+
+
+def _legacy_listing() -> int:
+    shifts = (
+        Shift.query.options(
+            joinedload(Shift.assignments).joinedload(Assignment.staff),
+            joinedload(Shift.assignments).joinedload(Assignment.kids),
+            joinedload(Shift.kids),
+        )
+        .order_by(Shift.start_time)
+        .all()
+    )
+    payload = []
+    for shift in shifts:
+        payload.append(
+            {
+                'id': shift.id,
+                'assignments': [
+                    {
+                        'id': assignment.id,
+                        'staff_role': assignment.staff.role if assignment.staff else None,
+                        'kids': [kid_payload(kid) for kid in assignment.kids],
+                    }
+                    for assignment in shift.assignments
+                ],
+                'kids': [kid_payload(kid) for kid in shift.kids],
+            }
+        )
+    return len(payload)
+
+
+def _batch_listing() -> int:
+    return len(shift_batch_payload(load_shift_batch(shift_select().order_by(Shift.start_time, Shift.id))))
+
+
+def _measure(label: str, func) -> None:
+    statements = []
+
+    def count(*_args, **_kwargs):
+        statements.append(1)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    db.session.expire_all()
+    started = time.perf_counter()
+    try:
+        rows = func()
+    finally:
+        elapsed = time.perf_counter() - started
+        event.remove(engine, 'before_cursor_execute', count)
+    print(f'{label:<10} shifts={rows:<7} queries={len(statements):<4} wall={elapsed:.3f}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shifts', type=int, default=10_000)
+    parser.add_argument('--assignments', type=int, default=3)
+    parser.add_argument('--kids', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # A bare app keeps the benchmark off the configured database; engines
+        # are bound at init_app time, so the URI has to be set beforehand.
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(Path(workdir) / 'bench.db')
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            _seed(args.shifts, args.assignments, args.kids)
+            _measure('joinedload', _legacy_listing)
+            _measure('batch', _batch_listing)
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,58 @@ load_dotenv()
 
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///staffmonitr.db')
+    # Optional read replica for listing and report handlers; writes always use the primary.
+    SQLALCHEMY_REPLICA_URI = os.getenv('DATABASE_REPLICA_URL')
+    REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+    # Optional tenant shards as comma-separated name=url pairs; account groups the
+    # shard map does not place elsewhere stay on DATABASE_URL.
+    SQLALCHEMY_SHARD_URIS = dict(
+        pair.strip().split('=', 1) for pair in os.getenv('DATABASE_SHARD_URLS', '').split(',') if pair.strip()
+    )
+    SHARD_MAP_TTL_SECONDS = float(os.getenv('SHARD_MAP_TTL_SECONDS', '30'))
+    SHARD_MOVE_BATCH_SIZE = int(os.getenv('SHARD_MOVE_BATCH_SIZE', '1000'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JSON_SORT_KEYS = False
     SECRET_KEY = os.getenv('SECRET_KEY', 'staff-monitr-secret')
     MAIL_SENDER = os.getenv('MAIL_SENDER', 'noreply@staffmonitr.local')
     JWT_EXPIRY = timedelta(hours=int(os.getenv('JWT_EXPIRY_HOURS', '8')))
+    PASSWORD_BCRYPT_ROUNDS = int(os.getenv('PASSWORD_BCRYPT_ROUNDS', '12'))
+    PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', '2'))
+    PASSWORD_QUEUE_LIMIT = int(os.getenv('PASSWORD_QUEUE_LIMIT', '1'))
+    AUTH_PRINCIPAL_TTL_SECONDS = float(os.getenv('AUTH_PRINCIPAL_TTL_SECONDS', '30'))
+    AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv('AUTH_PRINCIPAL_CACHE_SIZE', '10000'))
     SSO_DOMAINS = os.getenv('SSO_DOMAINS', 'staffmonitr.local').split(',')
+    GEOFENCE_BATCH_LIMIT = int(os.getenv('GEOFENCE_BATCH_LIMIT', '1000'))
+    GEOFENCE_INDEX_CELL_DEGREES = float(os.getenv('GEOFENCE_INDEX_CELL_DEGREES', '0.05'))
+    GEOFENCE_INDEX_REFRESH_SECONDS = float(os.getenv('GEOFENCE_INDEX_REFRESH_SECONDS', '30'))
+    CHECKIN_FLUSHER_AUTOSTART = os.getenv('CHECKIN_FLUSHER_AUTOSTART', 'true').lower() == 'true'
+    CHECKIN_FLUSH_SIZE = int(os.getenv('CHECKIN_FLUSH_SIZE', '500'))
+    CHECKIN_FLUSH_SECONDS = float(os.getenv('CHECKIN_FLUSH_SECONDS', '1'))
+    CHECKIN_BUFFER_LIMIT = int(os.getenv('CHECKIN_BUFFER_LIMIT', '20000'))
+    CHECKIN_GAP_SECONDS = float(os.getenv('CHECKIN_GAP_SECONDS', '300'))
+    IMPORT_SPOOL_DIR = os.getenv('IMPORT_SPOOL_DIR')
+    IMPORT_RUNNER_AUTOSTART = os.getenv('IMPORT_RUNNER_AUTOSTART', 'true').lower() == 'true'
+    IMPORT_RUNNER_POLL_SECONDS = float(os.getenv('IMPORT_RUNNER_POLL_SECONDS', '5'))
+    MAIL_TRANSPORT = os.getenv('MAIL_TRANSPORT', 'log')
+    MAIL_SMTP_HOST = os.getenv('MAIL_SMTP_HOST', 'localhost')
+    MAIL_SMTP_PORT = int(os.getenv('MAIL_SMTP_PORT', '25'))
+    MAIL_SMTP_USERNAME = os.getenv('MAIL_SMTP_USERNAME')
+    MAIL_SMTP_PASSWORD = os.getenv('MAIL_SMTP_PASSWORD')
+    MAIL_SMTP_STARTTLS = os.getenv('MAIL_SMTP_STARTTLS', 'false').lower() == 'true'
+    NOTIFY_DISPATCHER_AUTOSTART = os.getenv('NOTIFY_DISPATCHER_AUTOSTART', 'true').lower() == 'true'
+    NOTIFY_POLL_SECONDS = float(os.getenv('NOTIFY_POLL_SECONDS', '5'))
+    NOTIFY_COALESCE_SECONDS = float(os.getenv('NOTIFY_COALESCE_SECONDS', '60'))
+    NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '100'))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '6'))
+    NOTIFY_RETRY_BASE_SECONDS = float(os.getenv('NOTIFY_RETRY_BASE_SECONDS', '30'))
+    NOTIFY_RETRY_MAX_SECONDS = float(os.getenv('NOTIFY_RETRY_MAX_SECONDS', '3600'))
+    PUSH_TRANSPORT = os.getenv('PUSH_TRANSPORT', 'log')
+    PUSH_BATCH_SIZE = int(os.getenv('PUSH_BATCH_SIZE', '500'))
+    PUSH_TOKEN_TTL_DAYS = int(os.getenv('PUSH_TOKEN_TTL_DAYS', '60'))
+    SSE_HOLD_SECONDS = float(os.getenv('SSE_HOLD_SECONDS', '15'))
+    SSE_MAX_HELD_STREAMS = int(os.getenv('SSE_MAX_HELD_STREAMS', '2'))
+    SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', '3000'))
+    SSE_REPLAY_LIMIT = int(os.getenv('SSE_REPLAY_LIMIT', '500'))
+    SSE_BATCH_LIMIT = int(os.getenv('SSE_BATCH_LIMIT', '200'))
+    SYNC_OVERLAP_SECONDS = float(os.getenv('SYNC_OVERLAP_SECONDS', '5'))
+    SYNC_TOMBSTONE_DAYS = int(os.getenv('SYNC_TOMBSTONE_DAYS', '30'))
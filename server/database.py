@@ -1,7 +1,87 @@
+from pathlib import Path
+
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_migrate import Migrate
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = 'replica'
+DEFAULT_SHARD = 'default'
+SHARD_BIND_PREFIX = 'shard:'
+# Table.info key marking directory tables, which always live on the default bind.
+DIRECTORY = 'directory'
+# session.info flags: the handler allows replica reads / the session has written /
+# the shard this session's tenant tables are routed to.
+USE_REPLICA = 'use_replica'
+WROTE = 'wrote_primary'
+SHARD = 'shard'
+
+
+def shard_bind(name: str) -> str:
+    return SHARD_BIND_PREFIX + name
+
+
+def current_shard() -> str:
+    """Name of the shard the scoped session is routed to."""
+    return db.session.info.get(SHARD) or DEFAULT_SHARD
+
+
+def _is_directory(mapper) -> bool:
+    if mapper is None:
+        return False
+    table = getattr(inspect(mapper), 'local_table', None)
+    return table is not None and table.info.get(DIRECTORY, False)
+
+
+class RoutingSession(Session):
+    """Sends tenant statements to the session's shard, and plain SELECTs to the
+    read replica while the session allows it.
+
+    Directory tables always use the default bind. On the default shard,
+    anything but plain SELECTs, locking reads, and every statement after the
+    session has written go to the primary, so a request never reads around its
+    own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None or _is_directory(mapper):
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        shard = self.info.get(SHARD)
+        if shard and shard != DEFAULT_SHARD:
+            return self._db.engines[shard_bind(shard)]
+        if (
+            self.info.get(USE_REPLICA)
+            and not self.info.get(WROTE)
+            and not self._flushing
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        ):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate(directory=str(Path(__file__).resolve().parent / 'migrations'))
+
+
+def dialect_insert(table, engine=None):
+    """INSERT construct with ON CONFLICT support for the bound (or given) engine's dialect."""
+    if (engine or db.engine).dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
 
-db = SQLAlchemy()
-migrate = Migrate()
 
-__all__ = ['db', 'migrate']
+__all__ = [
+    'db',
+    'migrate',
+    'dialect_insert',
+    'shard_bind',
+    'current_shard',
+    'RoutingSession',
+    'REPLICA_BIND',
+    'DEFAULT_SHARD',
+]
@@ -0,0 +1,259 @@
+"""Catch up databases created before migrations were tracked
+
+Revision ID: 0001_schema_catchup
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+Databases so far were created with ``db.create_all()``. This revision adds
+what later changes introduced -- report rollups, kid ratio columns, import
+jobs, the notification outbox, push tokens, change events, tombstones,
+check-ins and presence intervals, plus their indexes -- skipping anything
+that already exists, so it applies both to databases created from the
+original schema and to ones created from the current models. On an empty
+database it first creates the original tables, so the chain bootstraps a new
+database on its own.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_schema_catchup'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _timestamps():
+    return [
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    ]
+
+
+# The schema databases were created with before migrations were tracked.
+BASELINE_TABLES = {
+    'account_groups': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('name', sa.String(120), nullable=False),
+        sa.Column('timezone', sa.String(40), nullable=False),
+        sa.Column('brand_primary', sa.String(32), nullable=False),
+        sa.Column('logo_url', sa.String(255)),
+        sa.Column('geofence_lat', sa.Float(), nullable=False),
+        sa.Column('geofence_lon', sa.Float(), nullable=False),
+        sa.Column('geofence_radius', sa.Integer(), nullable=False),
+        sa.Column('active', sa.Boolean()),
+        *_timestamps(),
+    ],
+    'staff_members': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('full_name', sa.String(120), nullable=False),
+        sa.Column('email', sa.String(160), nullable=False, unique=True),
+        sa.Column('password_hash', sa.String(128)),
+        sa.Column('role', sa.String(64), nullable=False),
+        sa.Column('status', sa.String(32), nullable=False),
+        sa.Column('invited_at', sa.DateTime()),
+        sa.Column('invite_expires_at', sa.DateTime()),
+        *_timestamps(),
+    ],
+    'staff_account_association': lambda: [
+        sa.Column('staff_id', sa.String(36), sa.ForeignKey('staff_members.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id', ondelete='CASCADE'), primary_key=True),
+    ],
+    'shifts': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id'), nullable=False),
+        sa.Column('site', sa.String(120), nullable=False),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('end_time', sa.DateTime(), nullable=False),
+        sa.Column('ratio_min', sa.Integer()),
+        sa.Column('leads_required', sa.Integer()),
+        sa.Column('is_special', sa.Boolean()),
+        sa.Column('difficulty', sa.String(32)),
+        sa.Column('open_shift', sa.Boolean()),
+        *_timestamps(),
+    ],
+    'assignments': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('shift_id', sa.String(36), sa.ForeignKey('shifts.id'), nullable=False),
+        sa.Column('staff_id', sa.String(36), sa.ForeignKey('staff_members.id')),
+        sa.Column('title', sa.String(120), nullable=False),
+        sa.Column('difficulty_rating', sa.Integer()),
+        sa.Column('instructions', sa.Text()),
+        sa.Column('requires_one_on_one', sa.Boolean()),
+        *_timestamps(),
+    ],
+    'kids': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('full_name', sa.String(120), nullable=False),
+        sa.Column('ratio', sa.String(10), nullable=False),
+        sa.Column('special_instructions', sa.Text()),
+        sa.Column('banned_staff', sa.JSON()),
+        sa.Column('requires_personal_trainer', sa.Boolean()),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id'), nullable=False),
+        sa.Column('shift_id', sa.String(36), sa.ForeignKey('shifts.id')),
+        sa.Column('assignment_id', sa.String(36), sa.ForeignKey('assignments.id')),
+        *_timestamps(),
+    ],
+    'invitations': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('email', sa.String(160), nullable=False),
+        sa.Column('token', sa.String(64), nullable=False, unique=True),
+        sa.Column('role', sa.String(64), nullable=False),
+        sa.Column('expires_at', sa.DateTime()),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id')),
+        *_timestamps(),
+    ],
+    'open_shift_requests': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('staff_id', sa.String(36), sa.ForeignKey('staff_members.id')),
+        sa.Column('shift_id', sa.String(36), sa.ForeignKey('shifts.id')),
+        sa.Column('status', sa.String(32)),
+        sa.Column('requested_at', sa.DateTime()),
+        *_timestamps(),
+    ],
+}
+
+TABLES = {
+    'daily_shift_rollups': lambda: [
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('shift_count', sa.Integer(), nullable=False),
+        sa.Column('assignment_count', sa.Integer(), nullable=False),
+        sa.Column('open_shift_count', sa.Integer(), nullable=False),
+        sa.Column('ratio_compliant_count', sa.Integer(), nullable=False),
+        sa.Column('kid_count', sa.Integer(), nullable=False),
+    ],
+    'daily_role_rollups': lambda: [
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('role', sa.String(64), primary_key=True),
+        sa.Column('assignment_count', sa.Integer(), nullable=False),
+        sa.Column('hard_count', sa.Integer(), nullable=False),
+    ],
+    'import_jobs': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('entity', sa.String(32), nullable=False),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id')),
+        sa.Column('dry_run', sa.Boolean(), nullable=False),
+        sa.Column('chunk_size', sa.Integer(), nullable=False),
+        sa.Column('upload_path', sa.String(255), nullable=False),
+        sa.Column('status', sa.String(16), nullable=False),
+        sa.Column('rows_processed', sa.Integer(), nullable=False),
+        sa.Column('persisted', sa.Integer(), nullable=False),
+        sa.Column('error_count', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.JSON()),
+        sa.Column('heartbeat_at', sa.DateTime()),
+        sa.Column('finished_at', sa.DateTime()),
+        *_timestamps(),
+    ],
+    'notification_outbox': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('recipient', sa.String(255)),
+        sa.Column('subject_key', sa.String(64), nullable=False),
+        sa.Column('payload', sa.JSON()),
+        sa.Column('channel', sa.String(16), nullable=False),
+        sa.Column('device_tokens', sa.JSON()),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id', ondelete='CASCADE')),
+        sa.Column('audience_roles', sa.JSON()),
+        sa.Column('entity_key', sa.String(80)),
+        sa.Column('coalesce_key', sa.String(400)),
+        sa.Column('event_count', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claimed_at', sa.DateTime()),
+        sa.Column('claim_token', sa.String(36)),
+        sa.Column('last_error', sa.String(255)),
+        sa.Column('sent_at', sa.DateTime()),
+        *_timestamps(),
+    ],
+    'push_tokens': lambda: [
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('staff_id', sa.String(36), sa.ForeignKey('staff_members.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('token', sa.String(512), nullable=False, unique=True),
+        sa.Column('platform', sa.String(16)),
+        sa.Column('last_seen_at', sa.DateTime(), nullable=False),
+        *_timestamps(),
+    ],
+    'change_events': lambda: [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('kind', sa.String(32), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    ],
+    'tombstones': lambda: [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('entity', sa.String(16), nullable=False),
+        sa.Column('entity_id', sa.String(36), nullable=False),
+        sa.Column('account_group_id', sa.String(36), sa.ForeignKey('account_groups.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    ],
+    'checkins': lambda: [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('assignment_id', sa.String(36), sa.ForeignKey('assignments.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=False),
+        sa.Column('lon', sa.Float(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=False),
+        sa.Column('on_site', sa.Boolean(), nullable=False),
+        sa.Column('distance_meters', sa.Float(), nullable=False),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+    ],
+    'presence_intervals': lambda: [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('assignment_id', sa.String(36), sa.ForeignKey('assignments.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('shift_id', sa.String(36), sa.ForeignKey('shifts.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('on_site', sa.Boolean(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('ended_at', sa.DateTime(), nullable=False),
+        sa.Column('ping_count', sa.Integer(), nullable=False),
+    ],
+}
+
+INDEXES = [
+    ('ix_staff_account_association_account', 'staff_account_association', ['account_group_id']),
+    ('ix_shifts_account_updated', 'shifts', ['account_group_id', 'updated_at']),
+    ('ix_assignments_updated_at', 'assignments', ['updated_at']),
+    ('ix_kids_account_updated', 'kids', ['account_group_id', 'updated_at']),
+    ('ix_notification_outbox_due', 'notification_outbox', ['status', 'next_attempt_at']),
+    ('ix_notification_outbox_coalesce', 'notification_outbox', ['coalesce_key', 'status']),
+    ('ix_push_tokens_staff_id', 'push_tokens', ['staff_id']),
+    ('ix_change_events_account', 'change_events', ['account_group_id', 'id']),
+    ('ix_tombstones_account_deleted', 'tombstones', ['account_group_id', 'deleted_at']),
+    ('ix_checkins_assignment_recorded', 'checkins', ['assignment_id', 'recorded_at']),
+    ('ix_presence_intervals_shift', 'presence_intervals', ['shift_id', 'started_at']),
+    ('ix_presence_intervals_assignment', 'presence_intervals', ['assignment_id', 'id']),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing_tables = set(inspector.get_table_names())
+    for name, columns in [*BASELINE_TABLES.items(), *TABLES.items()]:
+        if name not in existing_tables:
+            op.create_table(name, *columns())
+
+    kid_columns = {column['name'] for column in inspector.get_columns('kids')}
+    for name in ('ratio_staff', 'ratio_kids'):
+        if name not in kid_columns:
+            # Existing rows get 1:1 until `flask ratios backfill` parses their ratio strings.
+            with op.batch_alter_table('kids') as batch:
+                batch.add_column(sa.Column(name, sa.Integer(), nullable=False, server_default='1'))
+
+    inspector = sa.inspect(op.get_bind())
+    for index_name, table, columns in INDEXES:
+        if index_name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(index_name, table, columns)
+
+
+def downgrade():
+    for index_name, table, _ in INDEXES:
+        if table not in TABLES:
+            op.drop_index(index_name, table_name=table)
+    with op.batch_alter_table('kids') as batch:
+        batch.drop_column('ratio_kids')
+        batch.drop_column('ratio_staff')
+    # The original tables stay: downgrading returns to the pre-migration schema.
+    for name in reversed(list(TABLES)):
+        op.drop_table(name)
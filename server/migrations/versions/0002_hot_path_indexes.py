@@ -0,0 +1,46 @@
+"""Composite indexes for tenant- and time-scoped hot paths
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001_schema_catchup
+Create Date: 2026-10-18 00:00:00
+
+Shift listings filter by account and keyset-paginate on (start_time, id);
+open shifts filter on open_shift with the same ordering; kid rosters filter
+by account and sort by name; shift trees load assignments and kids by
+shift_id and assignment_id. server/tests/test_query_plans.py checks that
+these queries keep using the indexes on SQLite.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_path_indexes'
+down_revision = '0001_schema_catchup'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_shifts_account_start', 'shifts', ['account_group_id', 'start_time', 'id']),
+    ('ix_shifts_start', 'shifts', ['start_time', 'id']),
+    ('ix_shifts_open_start', 'shifts', ['open_shift', 'start_time', 'id']),
+    ('ix_assignments_shift', 'assignments', ['shift_id']),
+    ('ix_assignments_staff', 'assignments', ['staff_id']),
+    ('ix_kids_account_name', 'kids', ['account_group_id', 'full_name']),
+    ('ix_kids_shift', 'kids', ['shift_id']),
+    ('ix_kids_assignment', 'kids', ['assignment_id']),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for index_name, table, columns in INDEXES:
+        # Databases created with db.create_all() from current models already have them.
+        if index_name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(index_name, table, columns)
+
+
+def downgrade():
+    for index_name, table, _ in INDEXES:
+        op.drop_index(index_name, table_name=table)
@@ -0,0 +1,37 @@
+"""Shard directory for tenant sharding
+
+Revision ID: 0003_account_shards
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-18 00:00:00
+
+``account_shards`` places an account group on one of the databases named in
+``DATABASE_SHARD_URLS``; accounts without a row stay on this database. The
+table only matters on the default database. Shard databases get the tenant
+tables from ``flask shards init`` and are upgraded by running ``flask db
+upgrade`` with ``DATABASE_URL`` pointed at each of them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_account_shards'
+down_revision = '0002_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created with db.create_all() from current models already have it.
+    if 'account_shards' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'account_shards',
+            sa.Column('account_group_id', sa.String(36), primary_key=True),
+            sa.Column('shard', sa.String(64), nullable=False),
+            sa.Column('state', sa.String(16), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('account_shards')
@@ -1,19 +1,23 @@
 import uuid
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, validates
 from sqlalchemy.sql import func
 
-from .database import db
+from .database import DIRECTORY, db
+from .utils.ratios import parse_ratio
 
 class TimestampMixin:
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
-    updated_at = db.Column(db.DateTime(timezone=True), onupdate=func.now(), nullable=True)
+    # Stamped in Python (UTC, microsecond precision) so delta sync can compare
+    # it with watermarks and tombstones on every dialect.
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
 
 staff_account_association = db.Table(
     'staff_account_association',
     db.Column('staff_id', db.String(36), db.ForeignKey('staff_members.id', ondelete='CASCADE'), primary_key=True),
     db.Column('account_group_id', db.String(36), db.ForeignKey('account_groups.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_staff_account_association_account', 'account_group_id'),
 )
 
 class AccountGroup(db.Model, TimestampMixin):
@@ -58,6 +62,12 @@ class StaffMember(db.Model, TimestampMixin, PermissionMixin):
 
 class Shift(db.Model, TimestampMixin):
     __tablename__ = 'shifts'
+    __table_args__ = (
+        db.Index('ix_shifts_account_updated', 'account_group_id', 'updated_at'),
+        db.Index('ix_shifts_account_start', 'account_group_id', 'start_time', 'id'),
+        db.Index('ix_shifts_start', 'start_time', 'id'),
+        db.Index('ix_shifts_open_start', 'open_shift', 'start_time', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id'), nullable=False)
@@ -80,6 +90,11 @@ class Shift(db.Model, TimestampMixin):
 
 class Assignment(db.Model, TimestampMixin):
     __tablename__ = 'assignments'
+    __table_args__ = (
+        db.Index('ix_assignments_updated_at', 'updated_at'),
+        db.Index('ix_assignments_shift', 'shift_id'),
+        db.Index('ix_assignments_staff', 'staff_id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     shift_id = db.Column(db.String(36), db.ForeignKey('shifts.id'), nullable=False)
@@ -95,10 +110,18 @@ class Assignment(db.Model, TimestampMixin):
 
 class Kid(db.Model, TimestampMixin):
     __tablename__ = 'kids'
+    __table_args__ = (
+        db.Index('ix_kids_account_updated', 'account_group_id', 'updated_at'),
+        db.Index('ix_kids_account_name', 'account_group_id', 'full_name'),
+        db.Index('ix_kids_shift', 'shift_id'),
+        db.Index('ix_kids_assignment', 'assignment_id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     full_name = db.Column(db.String(120), nullable=False)
     ratio = db.Column(db.String(10), nullable=False, default='1:1')
+    ratio_staff = db.Column(db.Integer, nullable=False, default=1)
+    ratio_kids = db.Column(db.Integer, nullable=False, default=1)
     special_instructions = db.Column(db.Text)
     banned_staff = db.Column(db.JSON, default=list)
     requires_personal_trainer = db.Column(db.Boolean, default=False)
@@ -110,6 +133,11 @@ class Kid(db.Model, TimestampMixin):
     shift = db.relationship('Shift', back_populates='kids')
     assignment = db.relationship('Assignment', back_populates='kids')
 
+    @validates('ratio')
+    def _parse_ratio(self, key, value):
+        self.ratio_staff, self.ratio_kids = parse_ratio(value)
+        return value
+
 class Invitation(db.Model, TimestampMixin):
     __tablename__ = 'invitations'
 
@@ -133,3 +161,142 @@ class OpenShiftRequest(db.Model, TimestampMixin):
 
     staff = db.relationship('StaffMember', back_populates='open_shift_requests')
     shift = db.relationship('Shift')
+
+class DailyShiftRollup(db.Model):
+    __tablename__ = 'daily_shift_rollups'
+
+    account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    shift_count = db.Column(db.Integer, nullable=False, default=0)
+    assignment_count = db.Column(db.Integer, nullable=False, default=0)
+    open_shift_count = db.Column(db.Integer, nullable=False, default=0)
+    ratio_compliant_count = db.Column(db.Integer, nullable=False, default=0)
+    kid_count = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyRoleRollup(db.Model):
+    __tablename__ = 'daily_role_rollups'
+
+    account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    role = db.Column(db.String(64), primary_key=True)
+    assignment_count = db.Column(db.Integer, nullable=False, default=0)
+    hard_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ImportJob(db.Model, TimestampMixin):
+    __tablename__ = 'import_jobs'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    entity = db.Column(db.String(32), nullable=False)
+    account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id'))
+    dry_run = db.Column(db.Boolean, nullable=False, default=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    upload_path = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    persisted = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.JSON, default=list)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class NotificationOutbox(db.Model, TimestampMixin):
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        db.Index('ix_notification_outbox_due', 'status', 'next_attempt_at'),
+        db.Index('ix_notification_outbox_coalesce', 'coalesce_key', 'status'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    recipient = db.Column(db.String(255))
+    subject_key = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, default=dict)
+    # 'email' rows go to ``recipient``; 'push' rows carry a batch of
+    # ``device_tokens``; 'broadcast' rows are stored once with an audience
+    # and fanned out into the other two by the dispatcher.
+    channel = db.Column(db.String(16), nullable=False, default='email')
+    device_tokens = db.Column(db.JSON)
+    account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id', ondelete='CASCADE'))
+    audience_roles = db.Column(db.JSON)
+    # Events for the same (recipient, subject, entity) inside the coalescing
+    # window are merged into one row; event_count says how many it stands for.
+    entity_key = db.Column(db.String(80))
+    coalesce_key = db.Column(db.String(400))
+    event_count = db.Column(db.Integer, nullable=False, default=1)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    claim_token = db.Column(db.String(36))
+    last_error = db.Column(db.String(255))
+    sent_at = db.Column(db.DateTime)
+
+class PushToken(db.Model, TimestampMixin):
+    __tablename__ = 'push_tokens'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    staff_id = db.Column(db.String(36), db.ForeignKey('staff_members.id', ondelete='CASCADE'), nullable=False, index=True)
+    token = db.Column(db.String(512), nullable=False, unique=True)
+    platform = db.Column(db.String(16))
+    last_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ChangeEvent(db.Model):
+    __tablename__ = 'change_events'
+    __table_args__ = (db.Index('ix_change_events_account', 'account_group_id', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Tombstone(db.Model):
+    __tablename__ = 'tombstones'
+    __table_args__ = (db.Index('ix_tombstones_account_deleted', 'account_group_id', 'deleted_at'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.String(36), nullable=False)
+    account_group_id = db.Column(db.String(36), db.ForeignKey('account_groups.id', ondelete='CASCADE'), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Append-only location pings, classified against the account geofence on ingest.
+class CheckIn(db.Model):
+    __tablename__ = 'checkins'
+    __table_args__ = (db.Index('ix_checkins_assignment_recorded', 'assignment_id', 'recorded_at'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    assignment_id = db.Column(db.String(36), db.ForeignKey('assignments.id', ondelete='CASCADE'), nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    on_site = db.Column(db.Boolean, nullable=False)
+    distance_meters = db.Column(db.Float, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# A run of consecutive check-ins for one assignment that were all on site
+# (or all off site); a new interval starts when that flips or pings go quiet.
+class PresenceInterval(db.Model):
+    __tablename__ = 'presence_intervals'
+    __table_args__ = (
+        db.Index('ix_presence_intervals_shift', 'shift_id', 'started_at'),
+        db.Index('ix_presence_intervals_assignment', 'assignment_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    assignment_id = db.Column(db.String(36), db.ForeignKey('assignments.id', ondelete='CASCADE'), nullable=False)
+    shift_id = db.Column(db.String(36), db.ForeignKey('shifts.id', ondelete='CASCADE'), nullable=False)
+    on_site = db.Column(db.Boolean, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime, nullable=False)
+    ping_count = db.Column(db.Integer, nullable=False, default=1)
+
+# Directory entry placing an account group on a shard database. Accounts without
+# one live on the default database; the table itself always lives there too.
+class AccountShard(db.Model):
+    __tablename__ = 'account_shards'
+    __table_args__ = {'info': {DIRECTORY: True}}
+
+    account_group_id = db.Column(db.String(36), primary_key=True)
+    shard = db.Column(db.String(64), nullable=False)
+    state = db.Column(db.String(16), nullable=False, default='active')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -5,6 +5,7 @@ from sqlalchemy.exc import IntegrityError
 from ..database import db
 from ..models import AccountGroup, Invitation, StaffMember
 from ..services.auth import create_invite_token, hash_password, supported_roles
+from ..services.geofence_index import containing_geofences
 from ..utils.auth_helpers import require_auth, require_role
 
 accounts_bp = Blueprint('accounts', __name__)
@@ -29,6 +30,25 @@ def create_account():
     db.session.commit()
     return jsonify({'id': account.id, 'message': 'Account created'}), 201
 
+@accounts_bp.route('/geofences/lookup', methods=['GET'])
+def geofence_lookup():
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat and lon are required numbers'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'lat or lon out of range'}), 400
+    matches = containing_geofences(lat, lon)
+    return jsonify(
+        {
+            'accounts': [
+                {'id': match.account_group_id, 'name': match.name, 'distance_meters': match.distance_meters}
+                for match in matches
+            ]
+        }
+    )
+
 @accounts_bp.route('/accounts/<account_id>/staff', methods=['GET'])
 def account_staff(account_id):
     account = AccountGroup.query.get_or_404(account_id)
@@ -48,9 +68,9 @@ def account_staff(account_id):
 @require_auth
 @require_role('Owner_admin')
 def create_account_staff(account_id, *, current_staff):
-    account = AccountGroup.query.get_or_404(account_id)
-    if account not in current_staff.accounts:
+    if account_id not in current_staff.account_ids:
         return jsonify({'error': 'Not assigned to the requested account'}), 403
+    account = AccountGroup.query.get_or_404(account_id)
 
     data = request.json or {}
     full_name = data.get('full_name', '').strip()
@@ -89,7 +109,7 @@ def create_account_staff(account_id, *, current_staff):
             'email': staff.email,
             'role': staff.role,
             'status': staff.status,
-            'assigned_account_ids': [acct.id for acct in staff.accounts],
+            'assigned_account_ids': [account.id],
         }
     ), 201
 
@@ -1,38 +1,36 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from sqlalchemy.orm import joinedload
 
 from ..database import db
 from ..models import Assignment, Kid, Shift, StaffMember
-from ..services.geofence import is_within_geofence
+from ..services.changes import assignment_created
+from ..services.geofence import assignment_geofences, check_points, is_within_geofence
 from ..services.notifications import broadcast_open_shift, notify_assignment_change
-from ..utils.serializers import shift_payload
+from ..services.shift_loader import load_shift_batch, shift_select
+from ..utils.read_routing import replica_reads
+from ..utils.serializers import shift_batch_payload
 
 assignments_bp = Blueprint('assignments', __name__)
 
+ADMIN_ROLES = ('Owner_admin', 'Admin')
+
 @assignments_bp.route('/assignments/open', methods=['GET'])
+@replica_reads
 def open_shifts():
-    query = (
-        Shift.query.filter_by(open_shift=True)
-        .options(
-            joinedload(Shift.assignments).joinedload(Assignment.staff),
-            joinedload(Shift.assignments).joinedload(Assignment.kids),
-        )
-        .order_by(Shift.start_time)
-    )
+    batch = load_shift_batch(shift_select().where(Shift.open_shift.is_(True)).order_by(Shift.start_time, Shift.id))
     payload = []
-    for shift in query.all():
-        shift_data = shift_payload(shift)
+    for shift_data in shift_batch_payload(batch):
         payload.append(
             {
-                'id': shift.id,
-                'site': shift.site,
-                'ratio_min': shift.ratio_min,
-                'start_time': shift.start_time.isoformat(),
-                'end_time': shift.end_time.isoformat(),
+                'id': shift_data['id'],
+                'site': shift_data['site'],
+                'ratio_min': shift_data['ratio_min'],
+                'start_time': shift_data['start_time'],
+                'end_time': shift_data['end_time'],
                 'role': shift_data['role'],
                 'assignments': shift_data['assignments'],
                 'pendingAssignmentId': shift_data['pendingAssignmentId'],
-                'openShift': shift.open_shift,
+                'openShift': shift_data['openShift'],
                 'difficulty': shift_data['difficulty'],
             }
         )
@@ -52,8 +50,8 @@ def create_assignment():
     )
     db.session.add(assignment)
     db.session.flush()
-    kids_payload = data.get('kids', [])
-    for kid in kids_payload:
+    kids = []
+    for kid in data.get('kids', []):
         kid_model = Kid(
             full_name=kid['name'],
             ratio=kid.get('ratio', '1:1'),
@@ -64,15 +62,18 @@ def create_assignment():
             assignment_id=assignment.id,
         )
         db.session.add(kid_model)
-    db.session.commit()
+        kids.append(kid_model)
+    db.session.flush()
+    assignment_created(assignment, shift.account_group_id, kids)
     if assignment.staff:
         notify_assignment_change(assignment.staff.email, assignment.id)
+    db.session.commit()
     return jsonify({'id': assignment.id}), 201
 
 @assignments_bp.route('/assignments/<assignment_id>/request', methods=['POST'])
 def request_open_shift(assignment_id):
     assignment = (
-        Assignment.query.options(joinedload(Assignment.shift).joinedload(Shift.account_group)).get_or_404(assignment_id)
+        Assignment.query.options(joinedload(Assignment.shift)).get_or_404(assignment_id)
     )
     if assignment.staff_id:
         return jsonify({'error': 'Assignment already filled'}), 409
@@ -81,19 +82,36 @@ def request_open_shift(assignment_id):
     if not staff:
         return jsonify({'error': 'Staff not found'}), 404
     shift = assignment.shift
-    account_staff = shift.account_group.staff if shift and shift.account_group else []
-    admins = [member.email for member in account_staff if member.role in ['Owner_admin', 'Admin']]
-    if admins and shift:
-        broadcast_open_shift(shift.id, admins)
+    if shift:
+        broadcast_open_shift(shift.id, shift.account_group_id, roles=ADMIN_ROLES)
     notify_assignment_change(staff.email, assignment.id)
+    db.session.commit()
     return jsonify({'message': 'Request received', 'assignment_id': assignment.id})
 
 @assignments_bp.route('/assignments/<assignment_id>/validate-geofence', methods=['GET'])
 def assignment_geofence(assignment_id):
-    assignment = Assignment.query.get_or_404(assignment_id)
+    fence = assignment_geofences([assignment_id]).get(assignment_id)
+    if fence is None:
+        return jsonify({'error': 'Assignment not found'}), 404
     lat = float(request.args.get('lat', 0))
     lon = float(request.args.get('lon', 0))
-    shift = Shift.query.get(assignment.shift_id)
-    account = shift.account_group
-    allowed = is_within_geofence(lat, lon, account.geofence_lat, account.geofence_lon, account.geofence_radius)
+    allowed = is_within_geofence(lat, lon, fence.lat, fence.lon, fence.radius)
     return jsonify({'allowed': allowed})
+
+@assignments_bp.route('/assignments/validate-geofence', methods=['POST'])
+def assignment_geofence_batch():
+    points = (request.get_json(silent=True) or {}).get('points')
+    if not isinstance(points, list) or not all(isinstance(point, dict) for point in points):
+        return jsonify({'error': 'points must be a list of objects'}), 400
+    limit = current_app.config.get('GEOFENCE_BATCH_LIMIT', 1000)
+    if len(points) > limit:
+        return jsonify({'error': f'At most {limit} points per request'}), 400
+    results = []
+    for check in check_points(points):
+        result = {'assignment_id': check.assignment_id, 'timestamp': check.timestamp}
+        if check.error:
+            result['error'] = check.error
+        else:
+            result.update(allowed=check.allowed, distance_meters=check.distance_meters)
+        results.append(result)
+    return jsonify({'results': results})
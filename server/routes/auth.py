@@ -4,14 +4,17 @@ from flask import Blueprint, jsonify, request
 from sqlalchemy.exc import IntegrityError
 
 from ..database import db
-from ..models import AccountGroup, StaffMember
+from ..models import AccountGroup, StaffMember, staff_account_association
 from ..services.auth import (
+    PasswordPoolBusy,
     create_access_token,
-    decode_access_token,
     hash_password,
+    password_needs_rehash,
     supported_roles,
     verify_password,
 )
+from ..services.sharding import gather, locate
+from ..utils.auth_helpers import require_auth
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -33,27 +36,33 @@ def _account_payload(account: AccountGroup) -> dict:
     }
 
 
-def _staff_payload(staff: StaffMember) -> dict:
+def _member_accounts(staff_id: str) -> list[AccountGroup]:
+    """The member's accounts on every shard that keeps a copy of them."""
+    accounts = gather(
+        lambda: AccountGroup.query.join(
+            staff_account_association, staff_account_association.c.account_group_id == AccountGroup.id
+        )
+        .filter(staff_account_association.c.staff_id == staff_id)
+        .all()
+    )
+    # An account caught mid-move is on two shards at once.
+    return list({account.id: account for account in accounts}.values())
+
+
+def _staff_payload(staff: StaffMember, accounts: list[AccountGroup]) -> dict:
     return {
         'id': staff.id,
         'full_name': staff.full_name,
         'email': staff.email,
         'role': staff.role,
         'status': staff.status,
-        'assigned_account_ids': [account.id for account in staff.accounts],
+        'assigned_account_ids': [account.id for account in accounts],
         'invite_expires_at': staff.invite_expires_at.isoformat() if staff.invite_expires_at else None,
     }
 
 
-def _token_from_header() -> str | None:
-    header = request.headers.get('Authorization', '')
-    parts = header.split()
-    if len(parts) == 2 and parts[0].lower() == 'bearer':
-        return parts[1]
-    return None
-
-
 def _respond_with_token(staff: StaffMember, status_code: int = 200):
+    accounts = _member_accounts(staff.id)
     token_data = create_access_token(staff.id, staff.role)
     return (
         jsonify(
@@ -61,8 +70,8 @@ def _respond_with_token(staff: StaffMember, status_code: int = 200):
                 'access_token': token_data['token'],
                 'token_type': 'bearer',
                 'expires_at': token_data['expires_at'],
-                'staff': _staff_payload(staff),
-                'accounts': [_account_payload(account) for account in staff.accounts],
+                'staff': _staff_payload(staff, accounts),
+                'accounts': [_account_payload(account) for account in accounts],
             }
         ),
         status_code,
@@ -80,7 +89,7 @@ def signup():
     role = payload.get('role', 'Owner_admin')
     if role not in supported_roles():
         return jsonify({'error': 'Unsupported role'}), 400
-    if StaffMember.query.filter_by(email=email).first():
+    if locate(lambda: StaffMember.query.filter_by(email=email).first()):
         return jsonify({'error': 'Email already registered'}), 409
 
     friendly_name = full_name.strip()
@@ -130,28 +139,32 @@ def login():
     password = payload.get('password')
     if not (email and password):
         return jsonify({'error': 'Email and password are required'}), 400
-    staff = StaffMember.query.filter_by(email=email).first()
+    staff = locate(lambda: StaffMember.query.filter_by(email=email).first())
     if not staff or not verify_password(password, staff.password_hash):
         return jsonify({'error': 'Invalid credentials'}), 401
+    if password_needs_rehash(staff.password_hash):
+        try:
+            staff.password_hash = hash_password(password)
+        except PasswordPoolBusy:
+            pass  # Upgrade on a quieter login rather than fail this one.
+        else:
+            db.session.commit()
 
     return _respond_with_token(staff)
 
 
 @auth_bp.route('/auth/me', methods=['GET'])
-def me():
-    token = _token_from_header()
-    if not token:
-        return jsonify({'error': 'Authorization token required'}), 401
-    payload = decode_access_token(token)
-    if not payload:
-        return jsonify({'error': 'Invalid or expired token'}), 401
-    staff_id = payload.get('sub')
-    staff = StaffMember.query.get_or_404(staff_id)
+@require_auth
+def me(*, current_staff):
+    staff = db.session.get(StaffMember, current_staff.id)
+    if staff is None:
+        return jsonify({'error': 'Staff member not found'}), 404
+    accounts = _member_accounts(staff.id)
     return (
         jsonify(
             {
-                'staff': _staff_payload(staff),
-                'accounts': [_account_payload(account) for account in staff.accounts],
+                'staff': _staff_payload(staff, accounts),
+                'accounts': [_account_payload(account) for account in accounts],
             }
         ),
         200,
@@ -0,0 +1,26 @@
+from flask import Blueprint, current_app, jsonify, request
+
+from ..database import db
+from ..models import Shift
+from ..services.checkins import ingest_checkins, presence_for_shift
+
+checkins_bp = Blueprint('checkins', __name__)
+
+
+@checkins_bp.route('/checkins', methods=['POST'])
+def create_checkins():
+    points = (request.get_json(silent=True) or {}).get('points')
+    if not isinstance(points, list) or not all(isinstance(point, dict) for point in points):
+        return jsonify({'error': 'points must be a list of objects'}), 400
+    limit = current_app.config.get('GEOFENCE_BATCH_LIMIT', 1000)
+    if len(points) > limit:
+        return jsonify({'error': f'At most {limit} points per request'}), 400
+    result = ingest_checkins(current_app._get_current_object(), points)
+    return jsonify({'accepted': result.accepted, 'rejected': result.rejected}), 202
+
+
+@checkins_bp.route('/shifts/<shift_id>/presence', methods=['GET'])
+def shift_presence(shift_id):
+    if not db.session.get(Shift, shift_id):
+        return jsonify({'error': 'Shift not found'}), 404
+    return jsonify({'shift_id': shift_id, 'assignments': presence_for_shift(shift_id)})
@@ -0,0 +1,21 @@
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+
+from ..models import AccountGroup
+from ..services.changes import stream_changes
+
+events_bp = Blueprint('events', __name__)
+
+
+@events_bp.route('/accounts/<account_id>/events', methods=['GET'])
+def account_events(account_id):
+    AccountGroup.query.get_or_404(account_id)
+    raw_last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(raw_last_id) if raw_last_id else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+    return Response(
+        stream_with_context(stream_changes(current_app._get_current_object(), account_id, last_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -1,48 +1,150 @@
 import csv
-from io import StringIO
-from typing import Sequence
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 
-from ..services.notifications import send_email
+from ..database import db
+from ..models import AccountGroup, ImportJob
+from ..services.exports import (
+    DEFAULT_CHECKPOINT_ROWS,
+    EXPORT_COLUMNS,
+    EXPORT_FORMATS,
+    MAX_CHECKPOINT_ROWS,
+    ExportCheckpoint,
+    decode_checkpoint,
+    export_chunk,
+    export_statement,
+    resolve_fields,
+    stream_export,
+)
+from ..services.jobs import enqueue_import, job_payload, wake_runner
+from ..services.imports import DEFAULT_CHUNK_SIZE, SUPPORTED_ENTITIES, TRUTHY, import_rows, open_csv_reader
+from ..utils.auth_helpers import require_auth, require_role
+from ..utils.pagination import parse_page_size, parse_timestamp
+from ..utils.read_routing import replica_reads
+from .assignments import ADMIN_ROLES
 
 imports_bp = Blueprint('imports', __name__)
 
-SUPPORTED_ENTITIES = {'staff', 'kids', 'assignments'}
-
 @imports_bp.route('/imports/<entity>', methods=['POST'])
-def import_entity(entity: str):
+@require_auth
+@require_role(*ADMIN_ROLES)
+def import_entity(entity: str, *, current_staff):
     if entity not in SUPPORTED_ENTITIES:
         return jsonify({'error': 'Unsupported entity'}), 400
-    data = request.get_data(as_text=True)
-    if not data:
-        return jsonify({'error': 'payload required'}), 400
-    reader = csv.DictReader(StringIO(data))
-    preview: list[dict] = []
-    errors: list[str] = []
-    rows = list(reader)
-    for index, row in enumerate(rows[:5], start=1):
-        preview.append(row)
-    for index, row in enumerate(rows, start=1):
-        if entity == 'staff':
-            if not row.get('email') or not row.get('full_name'):
-                errors.append(f'Row {index} invalid: missing email or name')
-            else:
-                send_email(row['email'], 'shift_update', {'preview': True})
-        if entity == 'kids':
-            if not row.get('name'):
-                errors.append(f'Row {index} invalid: missing kid name')
-        if entity == 'assignments':
-            if not row.get('shift_id'):
-                errors.append(f'Row {index} invalid: missing shift_id')
-    result = {'rows': len(rows), 'preview': preview, 'errors': errors}
-    if errors:
+    dry_run = request.args.get('dry_run', '').lower() in TRUTHY
+    account_id = request.args.get('account_id')
+    try:
+        chunk_size = int(request.args.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        return jsonify({'error': 'chunk_size must be an integer'}), 400
+    if not account_id:
+        return jsonify({'error': 'account_id is required'}), 400
+    if account_id not in current_staff.account_ids:
+        return jsonify({'error': 'Not assigned to the requested account'}), 403
+    if not db.session.get(AccountGroup, account_id):
+        return jsonify({'error': 'Account not found'}), 404
+
+    if request.args.get('async', '').lower() in TRUTHY:
+        job = enqueue_import(request.stream, entity, account_id, dry_run, chunk_size)
+        return jsonify(job_payload(job)), 202
+
+    reader = open_csv_reader(request.stream)
+    try:
+        if reader.fieldnames is None:
+            return jsonify({'error': 'payload required'}), 400
+        report = import_rows(entity, reader, account_id=account_id, dry_run=dry_run, chunk_size=chunk_size)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        return jsonify({'error': f'Unreadable CSV: {exc}'}), 400
+    result = {**report.as_dict(), 'dry_run': dry_run}
+    if report.error_count:
         return jsonify(result), 422
     return jsonify(result)
 
+@imports_bp.route('/imports/jobs/<job_id>', methods=['GET'])
+@require_auth
+@require_role(*ADMIN_ROLES)
+def import_job_status(job_id: str, *, current_staff):
+    job = ImportJob.query.get_or_404(job_id)
+    if job.account_group_id not in current_staff.account_ids:
+        return jsonify({'error': 'Not assigned to the requested account'}), 403
+    if job.status == 'queued':
+        # Picks up jobs left queued by a worker that restarted before running them.
+        wake_runner(current_app._get_current_object())
+    return jsonify(job_payload(job))
+
 @imports_bp.route('/exports/<entity>', methods=['GET'])
-def export_entity(entity: str):
-    if entity not in {'staff', 'kids'}:
+@require_auth
+@replica_reads
+def export_entity(entity: str, *, current_staff):
+    if entity not in EXPORT_COLUMNS:
+        return jsonify({'error': 'Unsupported entity'}), 400
+    account_id = request.args.get('account_id')
+    if not account_id:
+        return jsonify({'error': 'account_id is required'}), 400
+    if account_id not in current_staff.account_ids:
+        return jsonify({'error': 'Not assigned to the requested account'}), 403
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        fields = resolve_fields(entity, request.args.get('fields'))
+        start = parse_timestamp(request.args.get('from'), 'from')
+        end = parse_timestamp(request.args.get('to'), 'to')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    statement = export_statement(entity, fields, account_id=account_id, start=start, end=end)
+    return Response(
+        stream_with_context(stream_export(fields, export_format, statement)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={entity}.{export_format}'},
+    )
+
+@imports_bp.route('/exports/<entity>/chunks', methods=['GET'])
+@require_auth
+@replica_reads
+def export_entity_chunk(entity: str, *, current_staff):
+    """One gzip-compressed chunk of a resumable export.
+
+    Start with the same filters as ``/exports/<entity>``; every response
+    carries an ``X-Export-Checkpoint`` token, and passing it back as
+    ``checkpoint`` returns the rows after that chunk.
+    """
+    if entity not in EXPORT_COLUMNS:
         return jsonify({'error': 'Unsupported entity'}), 400
-    fields: Sequence[str] = request.args.get('fields', 'id,name,role').split(',')
-    return jsonify({'entity': entity, 'fields': fields, 'format': 'csv', 'timestamp': request.args.get('timestamp')})
+    try:
+        max_rows = parse_page_size(request.args.get('limit'), DEFAULT_CHECKPOINT_ROWS, MAX_CHECKPOINT_ROWS)
+        token = request.args.get('checkpoint')
+        if token:
+            checkpoint = decode_checkpoint(token)
+            if checkpoint.entity != entity:
+                raise ValueError('Checkpoint belongs to a different export')
+        else:
+            export_format = request.args.get('format', 'csv')
+            if export_format not in EXPORT_FORMATS:
+                raise ValueError('format must be csv or ndjson')
+            if not request.args.get('account_id'):
+                raise ValueError('account_id is required')
+            checkpoint = ExportCheckpoint(
+                entity,
+                resolve_fields(entity, request.args.get('fields')),
+                export_format,
+                request.args.get('account_id'),
+                parse_timestamp(request.args.get('from'), 'from'),
+                parse_timestamp(request.args.get('to'), 'to'),
+            )
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    # A checkpoint carries its own account_id, so check the decoded one as well.
+    if checkpoint.account_id not in current_staff.account_ids:
+        return jsonify({'error': 'Not assigned to the requested account'}), 403
+    chunk = export_chunk(checkpoint, max_rows)
+    return Response(
+        chunk.body,
+        mimetype='application/gzip',
+        headers={
+            'Content-Disposition': f'attachment; filename={entity}.{checkpoint.export_format}.gz',
+            'X-Export-Checkpoint': chunk.checkpoint,
+            'X-Export-Rows': str(chunk.rows),
+            'X-Export-Complete': 'true' if chunk.complete else 'false',
+        },
+    )
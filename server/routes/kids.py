@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request
 
 from ..database import db
 from ..models import AccountGroup, Kid
+from ..services.changes import kid_created
 from ..utils.serializers import kid_payload
 
 kids_bp = Blueprint('kids', __name__)
@@ -29,5 +30,7 @@ def create_kid(account_id):
         assignment_id=payload.get('assignment_id'),
     )
     db.session.add(kid)
+    db.session.flush()
+    kid_created(kid)
     db.session.commit()
     return jsonify(kid_payload(kid)), 201
@@ -1,7 +1,11 @@
 from flask import Blueprint, jsonify, request
 
+from ..database import db
 from ..models import Assignment, StaffMember
-from ..services.notifications import notify_assignment_change
+from ..services.notifications import notification_stats, notify_assignment_change
+from ..services.push import forget_tokens, register_token
+from ..services.sharding import locate
+from ..utils.pagination import parse_timestamp
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -13,15 +17,37 @@ def register_push_token():
     token = data.get('token')
     if not staff_id or not token:
         return jsonify({'error': 'staff_id and token are required'}), 400
-    staff = StaffMember.query.get(staff_id)
+    staff = locate(lambda: db.session.get(StaffMember, staff_id))
     if not staff:
         return jsonify({'error': 'Staff member not found'}), 404
+    register_token(staff.id, token, data.get('platform'))
+    db.session.commit()
     return jsonify({'message': 'Push token recorded'}), 201
 
 
+@notifications_bp.route('/notifications/register', methods=['DELETE'])
+def unregister_push_token():
+    token = (request.json or {}).get('token')
+    if not token:
+        return jsonify({'error': 'token is required'}), 400
+    forget_tokens([token])
+    db.session.commit()
+    return '', 204
+
+
 @notifications_bp.route('/notifications/assignment/<assignment_id>', methods=['POST'])
 def assignment_alert(assignment_id):
     assignment = Assignment.query.get_or_404(assignment_id)
     if assignment.staff:
         notify_assignment_change(assignment.staff.email, assignment.id)
+        db.session.commit()
     return jsonify({'message': 'Assignment notification queued'}), 200
+
+
+@notifications_bp.route('/notifications/stats', methods=['GET'])
+def outbox_stats():
+    try:
+        since = parse_timestamp(request.args.get('since'), 'since')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(notification_stats(since))
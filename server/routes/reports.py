@@ -1,38 +1,79 @@
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
+
 from flask import Blueprint, jsonify, request
 
-from ..models import Assignment, Shift
+from ..services.coverage import coverage_timeline
+from ..services.ratios import count_shifts, evaluate_shift_ratios, ratio_gap_payload
+from ..services.reporting import ratio_compliance_by_role, staff_utilization_summary
+from ..utils.pagination import parse_timestamp
+from ..utils.read_routing import replica_reads
 
 reports_bp = Blueprint('reports', __name__)
 
+DEFAULT_BUCKET_MINUTES = 15
+
 @reports_bp.route('/reports/staff-utilization', methods=['GET'])
+@replica_reads
 def staff_utilization():
-    since = request.args.get('since')
-    query = Shift.query
-    if since:
-        query = query.filter(Shift.start_time >= datetime.fromisoformat(since))
-    shifts = query.all()
-    total_shifts = len(shifts)
-    ratio_compliant = sum(1 for shift in shifts if shift.ratio_min <= len(shift.assignments))
-    open_shifts = Shift.query.filter_by(open_shift=True).count()
-    summary = {
-        'total_shifts': total_shifts,
-        'ratio_compliant': ratio_compliant,
-        'open_shifts': open_shifts,
-        'averages': {
-            'assignments_per_shift': round(sum(len(shift.assignments) for shift in shifts) / (total_shifts or 1), 2),
-        },
-    }
+    try:
+        since = parse_timestamp(request.args.get('since'), 'since')
+        summary = staff_utilization_summary(
+            account_id=request.args.get('account_id'),
+            since=since,
+            group_by=request.args.get('group_by'),
+        )
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
     return jsonify(summary)
 
 @reports_bp.route('/reports/ratio-compliance', methods=['GET'])
+@replica_reads
 def ratio_compliance():
-    assignments = Assignment.query.all()
-    by_role: dict[str, dict[str, int]] = {}
-    for assignment in assignments:
-        role = assignment.staff.role if assignment.staff else 'Unassigned'
-        by_role.setdefault(role, {'count': 0, 'hard': 0})
-        by_role[role]['count'] += 1
-        if assignment.difficulty_rating >= 4:
-            by_role[role]['hard'] += 1
+    try:
+        start = parse_timestamp(request.args.get('from'), 'from')
+        end = parse_timestamp(request.args.get('to'), 'to')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    by_role = ratio_compliance_by_role(account_id=request.args.get('account_id'), start=start, end=end)
     return jsonify({'by_role': by_role})
+
+@reports_bp.route('/reports/ratio-gaps', methods=['GET'])
+@replica_reads
+def ratio_gaps():
+    try:
+        start = parse_timestamp(request.args.get('from'), 'from')
+        end = parse_timestamp(request.args.get('to'), 'to')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    account_id = request.args.get('account_id')
+    gaps = [
+        ratio_gap_payload(ratio)
+        for ratio in evaluate_shift_ratios(account_id=account_id, start=start, end=end, gaps_only=True)
+    ]
+    evaluated = count_shifts(account_id=account_id, start=start, end=end)
+    return jsonify({'shifts_evaluated': evaluated, 'shifts_with_gaps': len(gaps), 'gaps': gaps})
+
+@reports_bp.route('/reports/coverage', methods=['GET'])
+@replica_reads
+def coverage():
+    account_id = request.args.get('account_id')
+    if not account_id:
+        return jsonify({'error': 'account_id is required'}), 400
+    try:
+        start = parse_timestamp(request.args.get('from'), 'from') or datetime.combine(date.today(), time.min)
+        end = parse_timestamp(request.args.get('to'), 'to') or start + timedelta(days=1)
+        bucket_minutes = int(request.args.get('bucket_minutes', DEFAULT_BUCKET_MINUTES))
+        buckets = coverage_timeline(account_id, start, end, timedelta(minutes=bucket_minutes))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(
+        {
+            'account_id': account_id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'bucket_minutes': bucket_minutes,
+            'buckets': [
+                {'start': bucket.start.isoformat(), 'staff': bucket.staff, 'kids': bucket.kids} for bucket in buckets
+            ],
+        }
+    )
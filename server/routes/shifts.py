@@ -1,29 +1,59 @@
 from datetime import datetime
 from flask import Blueprint, jsonify, request
-from sqlalchemy.orm import joinedload
+from sqlalchemy import and_, or_, select
 
 from ..database import db
-from ..models import Assignment, Shift
+from ..models import Assignment, Shift, StaffMember
+from ..services.changes import shift_created, shift_updated
 from ..services.notifications import broadcast_open_shift, notify_shift_change
-from ..utils.serializers import shift_payload
+from ..services.shift_loader import load_shift_batch, shift_select
+from ..utils.pagination import decode_cursor, encode_cursor, parse_page_size, parse_timestamp
+from ..utils.read_routing import replica_reads
+from ..utils.serializers import shift_batch_payload
 
 shifts_bp = Blueprint('shifts', __name__)
 
 @shifts_bp.route('/shifts', methods=['GET'])
+@replica_reads
 def list_shifts():
     account_id = request.args.get('account_id')
     role_filter = request.args.get('role')
-    query = Shift.query.options(
-        joinedload(Shift.assignments).joinedload(Assignment.staff),
-        joinedload(Shift.assignments).joinedload(Assignment.kids),
-        joinedload(Shift.kids),
-    )
+    try:
+        window_start = parse_timestamp(request.args.get('from'), 'from')
+        window_end = parse_timestamp(request.args.get('to'), 'to')
+        page_size = parse_page_size(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    query = shift_select()
     if account_id:
-        query = query.filter_by(account_group_id=account_id)
+        query = query.where(Shift.account_group_id == account_id)
     if role_filter:
-        query = query.filter(Shift.assignments.any(Assignment.staff.has(role=role_filter)))
-    shifts = query.order_by(Shift.start_time).all()
-    return jsonify([shift_payload(shift) for shift in shifts])
+        query = query.where(Shift.assignments.any(Assignment.staff.has(role=role_filter)))
+    if window_start:
+        query = query.where(Shift.start_time >= window_start)
+    if window_end:
+        query = query.where(Shift.start_time < window_end)
+    if after:
+        after_start, after_id = after
+        query = query.where(
+            or_(
+                Shift.start_time > after_start,
+                and_(Shift.start_time == after_start, Shift.id > after_id),
+            )
+        )
+    # Fetch one extra row to learn whether another page exists.
+    batch = load_shift_batch(query.order_by(Shift.start_time, Shift.id).limit(page_size + 1))
+
+    next_cursor = None
+    shifts = shift_batch_payload(batch)
+    if len(shifts) > page_size:
+        shifts = shifts[:page_size]
+        last = batch.shifts[page_size - 1]
+        next_cursor = encode_cursor(last.start_time, last.id)
+    return jsonify({'shifts': shifts, 'next_cursor': next_cursor})
 
 @shifts_bp.route('/shifts', methods=['POST'])
 def create_shift():
@@ -40,6 +70,8 @@ def create_shift():
         open_shift=payload.get('openShift', False),
     )
     db.session.add(shift)
+    db.session.flush()
+    shift_created(shift)
     db.session.commit()
     return jsonify({'id': shift.id}), 201
 
@@ -52,11 +84,16 @@ def update_shift(shift_id):
     shift.is_special = payload.get('is_special', shift.is_special)
     previous_open = shift.open_shift
     shift.open_shift = payload.get('openShift', shift.open_shift)
-    db.session.commit()
-    for assignment in shift.assignments:
-        if assignment.staff:
-            notify_shift_change(assignment.staff.email, shift.id)
+    assigned_emails = db.session.execute(
+        select(StaffMember.email)
+        .join(Assignment, Assignment.staff_id == StaffMember.id)
+        .where(Assignment.shift_id == shift.id)
+        .distinct()
+    ).scalars()
+    for email in assigned_emails:
+        notify_shift_change(email, shift.id)
     if shift.open_shift and not previous_open:
-        staff_emails = [member.email for member in shift.account_group.staff]
-        broadcast_open_shift(shift.id, staff_emails)
+        broadcast_open_shift(shift.id, shift.account_group_id)
+    shift_updated(shift)
+    db.session.commit()
     return jsonify({'message': 'Shift updated'})
@@ -0,0 +1,22 @@
+from flask import Blueprint, jsonify, request
+
+from ..database import db
+from ..models import AccountGroup
+from ..services.sync import sync_delta
+from ..utils.pagination import parse_timestamp
+
+sync_bp = Blueprint('sync', __name__)
+
+
+@sync_bp.route('/sync', methods=['GET'])
+def delta_sync():
+    account_id = request.args.get('account_id')
+    if not account_id:
+        return jsonify({'error': 'account_id is required'}), 400
+    try:
+        since = parse_timestamp(request.args.get('since'), 'since')
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    if not db.session.get(AccountGroup, account_id):
+        return jsonify({'error': 'Account not found'}), 404
+    return jsonify(sync_delta(account_id, since))
@@ -1,25 +1,99 @@
+"""Password hashing, access tokens, and invite tokens.
+
+bcrypt runs on a small per-process pool of ``PASSWORD_WORKERS`` threads
+rather than on the request thread that asked for it. At most
+``PASSWORD_QUEUE_LIMIT`` further requests may wait for a worker; beyond that
+:class:`PasswordPoolBusy` is raised (and served as a 503) immediately, so a
+login burst can tie up only a bounded number of gthread threads and the rest
+keep serving reads. ``PASSWORD_BCRYPT_ROUNDS`` sets the cost of new hashes.
+"""
 from __future__ import annotations
 
 import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional, TypeVar
 
 import bcrypt
 import jwt
-from flask import current_app
+from flask import Flask, current_app, has_app_context
 from jwt import PyJWTError
 
 from .permissions import ROLES
 
+T = TypeVar('T')
+
+
+class PasswordPoolBusy(RuntimeError):
+    """Every password worker is busy and the wait queue is full."""
+
+
+class PasswordPool:
+    def __init__(self, workers: int, queue_limit: int):
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max(queue_limit, 0))
+
+    def run(self, func: Callable[..., T], *args) -> T:
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy('Password workers are busy')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def password_pool(app: Flask) -> PasswordPool:
+    pool = app.extensions.get('password_pool')
+    if pool is None:
+        pool = app.extensions.setdefault(
+            'password_pool',
+            PasswordPool(app.config.get('PASSWORD_WORKERS', 2), app.config.get('PASSWORD_QUEUE_LIMIT', 1)),
+        )
+    return pool
+
+
+def _run_password_work(func: Callable[..., T], *args) -> T:
+    if not has_app_context():
+        return func(*args)
+    return password_pool(current_app._get_current_object()).run(func, *args)
+
+
+def _configured_rounds() -> int:
+    return current_app.config.get('PASSWORD_BCRYPT_ROUNDS', 12) if has_app_context() else 12
+
+
+def _hashpw(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return _run_password_work(_hashpw, password, _configured_rounds())
 
 
 def verify_password(password: str, password_hash: Optional[str]) -> bool:
     if not password_hash:
         return False
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    return _run_password_work(_checkpw, password, password_hash)
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True when the stored hash was made with a different cost than configured."""
+    try:
+        rounds = int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != _configured_rounds()
 
 
 def create_access_token(staff_id: str, role: str, expiry: Optional[timedelta] = None) -> dict:
@@ -0,0 +1,221 @@
+"""Per-account change feed served as server-sent events.
+
+Write endpoints add a compact ``change_events`` row in the same transaction
+as the change, so every worker process sees the same ordered feed and an
+event exists only if its change committed. Each account keeps its newest
+``SSE_REPLAY_LIMIT`` events; a subscriber reconnecting with an older
+``Last-Event-ID`` is told to reset and refetch instead.
+
+A WSGI response occupies a gthread worker thread while it streams, so streams
+are short-lived: a response replays what the subscriber missed, waits for new
+events for at most ``SSE_HOLD_SECONDS``, and closes with a ``retry`` hint so
+the browser's EventSource reconnects from its last event id. Only
+``SSE_MAX_HELD_STREAMS`` responses per process may wait at all; the rest
+return immediately, so idle subscribers can never occupy every thread.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Iterator, Optional
+
+from flask import Flask, current_app, has_app_context
+from sqlalchemy import delete, event, func, select
+
+from ..database import db
+from ..models import Assignment, ChangeEvent, Kid, Shift
+from ..utils.serializers import kid_payload
+
+PENDING_ACCOUNTS = 'change_event_accounts'
+POLL_SECONDS = 1.0
+
+
+class ChangeFeed:
+    """Wakes this process's held streams when a commit adds events."""
+
+    def __init__(self, max_held: int):
+        self.holders = threading.BoundedSemaphore(max_held) if max_held > 0 else None
+        self._condition = threading.Condition()
+
+    def notify(self) -> None:
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait(self, timeout: float) -> None:
+        with self._condition:
+            self._condition.wait(timeout)
+
+    def try_hold(self) -> bool:
+        return bool(self.holders and self.holders.acquire(blocking=False))
+
+    def release(self) -> None:
+        self.holders.release()
+
+
+def change_feed(app: Flask) -> ChangeFeed:
+    feed = app.extensions.get('change_feed')
+    if feed is None:
+        feed = app.extensions.setdefault('change_feed', ChangeFeed(app.config.get('SSE_MAX_HELD_STREAMS', 2)))
+    return feed
+
+
+def record_change(account_id: str, kind: str, payload: dict) -> None:
+    db.session.add(ChangeEvent(account_group_id=account_id, kind=kind, payload=payload))
+    db.session.info.setdefault(PENDING_ACCOUNTS, set()).add(account_id)
+
+
+def shift_created(shift: Shift) -> None:
+    record_change(
+        shift.account_group_id,
+        'shift.created',
+        {
+            'id': shift.id,
+            'site': shift.site,
+            'start_time': shift.start_time.isoformat(),
+            'end_time': shift.end_time.isoformat(),
+            'ratio_min': shift.ratio_min,
+            'leads_required': shift.leads_required,
+            'difficulty': shift.difficulty,
+            'openShift': shift.open_shift,
+        },
+    )
+
+
+def shift_updated(shift: Shift) -> None:
+    record_change(
+        shift.account_group_id,
+        'shift.updated',
+        {
+            'id': shift.id,
+            'ratio_min': shift.ratio_min,
+            'leads_required': shift.leads_required,
+            'is_special': shift.is_special,
+            'openShift': shift.open_shift,
+        },
+    )
+
+
+def assignment_created(assignment: Assignment, account_id: str, kids: list[Kid]) -> None:
+    record_change(
+        account_id,
+        'assignment.created',
+        {
+            'id': assignment.id,
+            'shift_id': assignment.shift_id,
+            'staff_id': assignment.staff_id,
+            'title': assignment.title,
+            'difficulty_rating': assignment.difficulty_rating,
+            'kids': [kid_payload(kid) for kid in kids],
+        },
+    )
+
+
+def kid_created(kid: Kid) -> None:
+    record_change(kid.account_group_id, 'kid.created', kid_payload(kid))
+
+
+def latest_event_id(account_id: str) -> int:
+    return db.session.execute(
+        select(func.coalesce(func.max(ChangeEvent.id), 0)).where(ChangeEvent.account_group_id == account_id)
+    ).scalar_one()
+
+
+def events_after(account_id: str, last_id: int, replay_limit: int, limit: int) -> tuple[list, bool]:
+    """Events after ``last_id``, plus whether the subscriber must reset (it fell behind the replay buffer or its ids come from another shard)."""
+    account_events = ChangeEvent.account_group_id == account_id
+    # Ids are global, so gaps between one account's events are normal; the
+    # subscriber only missed events if the event it last saw was trimmed away.
+    seen_retained = select(ChangeEvent.id).where(account_events, ChangeEvent.id <= last_id).exists()
+    newest, retained, seen = db.session.execute(
+        select(func.max(ChangeEvent.id), func.count(), seen_retained).where(account_events)
+    ).one()
+    if retained >= replay_limit and not seen:
+        return [], True
+    # Ids past the newest event come from another database: the account moved shards.
+    if last_id > (newest or 0):
+        return [], True
+    events = db.session.execute(
+        select(ChangeEvent.id, ChangeEvent.kind, ChangeEvent.payload)
+        .where(ChangeEvent.account_group_id == account_id, ChangeEvent.id > last_id)
+        .order_by(ChangeEvent.id)
+        .limit(limit)
+    ).all()
+    return events, False
+
+
+def format_event(event_id: int, kind: str, payload: dict) -> str:
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(payload, separators=(",", ":"))}\n\n'
+
+
+def stream_changes(app: Flask, account_id: str, last_id: Optional[int]) -> Iterator[str]:
+    config = app.config
+    replay_limit = config.get('SSE_REPLAY_LIMIT', 500)
+    batch_limit = config.get('SSE_BATCH_LIMIT', 200)
+    feed = change_feed(app)
+    yield f"retry: {config.get('SSE_RETRY_MS', 3000)}\n\n"
+    if last_id is None:
+        last_id = latest_event_id(account_id)
+        yield format_event(last_id, 'ready', {})
+    hold = config.get('SSE_HOLD_SECONDS', 15)
+    held = hold > 0 and feed.try_hold()
+    deadline = time.monotonic() + (hold if held else 0)
+    try:
+        while True:
+            events, reset = events_after(account_id, last_id, replay_limit, batch_limit)
+            # Release the connection (and SQLite's read snapshot) while waiting.
+            db.session.close()
+            if reset:
+                yield format_event(latest_event_id(account_id), 'reset', {})
+                db.session.close()
+                return
+            for change in events:
+                last_id = change.id
+                yield format_event(change.id, change.kind, change.payload)
+            if len(events) == batch_limit:
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            feed.wait(min(remaining, POLL_SECONDS))
+    finally:
+        if held:
+            feed.release()
+
+
+def _trim_replay_buffers(session) -> None:
+    accounts = session.info.get(PENDING_ACCOUNTS)
+    if not accounts:
+        return
+    limit = current_app.config.get('SSE_REPLAY_LIMIT', 500) if has_app_context() else 500
+    for account_id in accounts:
+        cutoff = (
+            select(ChangeEvent.id)
+            .where(ChangeEvent.account_group_id == account_id)
+            .order_by(ChangeEvent.id.desc())
+            .offset(limit)
+            .limit(1)
+            .scalar_subquery()
+        )
+        session.execute(
+            delete(ChangeEvent)
+            .where(ChangeEvent.account_group_id == account_id, ChangeEvent.id <= cutoff)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _notify_subscribers(session) -> None:
+    if session.info.pop(PENDING_ACCOUNTS, None) and has_app_context():
+        change_feed(current_app._get_current_object()).notify()
+
+
+def _discard_pending(session, *args) -> None:
+    session.info.pop(PENDING_ACCOUNTS, None)
+
+
+def register_change_listeners() -> None:
+    if event.contains(db.session, 'before_commit', _trim_replay_buffers):
+        return
+    event.listen(db.session, 'before_commit', _trim_replay_buffers)
+    event.listen(db.session, 'after_commit', _notify_subscribers)
+    event.listen(db.session, 'after_soft_rollback', _discard_pending)
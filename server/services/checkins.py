@@ -0,0 +1,326 @@
+"""Buffered ingestion of location check-ins and on-site/off-site intervals.
+
+``POST /api/checkins`` classifies each ping against its assignment's account
+geofence (one query per request) and appends it to a per-process buffer
+instead of writing it. A daemon flusher thread drains the buffer whenever it
+reaches ``CHECKIN_FLUSH_SIZE`` pings or every ``CHECKIN_FLUSH_SECONDS``,
+writing the raw pings with one executemany insert and advancing each
+assignment's presence intervals in the same transaction. If the buffer
+reaches ``CHECKIN_BUFFER_LIMIT`` the request thread flushes it itself, so a
+stalled flusher slows ingest down rather than growing memory without bound;
+if that flush fails the buffered pings are requeued and the request's own
+pings are refused with :class:`CheckInBufferFull` (503), so the client retries.
+Pings still in the buffer when a worker is killed outright are lost; a clean
+exit flushes them. Each ping remembers its assignment's account and is
+written to the shard that holds the account when it is flushed; pings of an
+account that is moving between shards stay buffered until the move ends.
+
+Intervals are advanced in ``recorded_at`` order per assignment, holding the
+assignment's row lock so concurrent flushes cannot both start its first
+interval: a ping with the same on-site state as the assignment's latest
+interval, arriving within ``CHECKIN_GAP_SECONDS`` of its end, extends it;
+anything else starts a new interval. Pings recorded before the latest
+interval ended are kept as raw check-ins but do not rewrite intervals.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from flask import Flask
+from sqlalchemy import func, insert, select, update
+
+from ..database import DEFAULT_SHARD, db
+from ..models import Assignment, CheckIn, PresenceInterval
+from .geofence import check_points
+from .sharding import MOVING, account_placement, use_shard
+
+LOG = logging.getLogger('staffmonitr.checkins')
+
+_flusher_lock = threading.Lock()
+_flushers: dict[int, 'CheckInFlusher'] = {}
+
+
+class CheckInBufferFull(RuntimeError):
+    """The buffer is at its limit and could not be flushed."""
+
+
+class IngestResult(NamedTuple):
+    accepted: int
+    rejected: list[dict]
+
+
+class CheckInBuffer:
+    def __init__(self):
+        self._rows: list[tuple[str, dict]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def extend(self, rows: list[tuple[str, dict]]) -> int:
+        with self._lock:
+            self._rows.extend(rows)
+            return len(self._rows)
+
+    def drain(self) -> list[tuple[str, dict]]:
+        with self._lock:
+            rows, self._rows = self._rows, []
+        return rows
+
+    def requeue(self, rows: list[tuple[str, dict]]) -> None:
+        with self._lock:
+            self._rows[:0] = rows
+
+
+def checkin_buffer(app: Flask) -> CheckInBuffer:
+    buffer = app.extensions.get('checkin_buffer')
+    if buffer is None:
+        buffer = app.extensions.setdefault('checkin_buffer', CheckInBuffer())
+    return buffer
+
+
+def _recorded_at(raw) -> datetime:
+    if not isinstance(raw, str):
+        raise ValueError('timestamp is required')
+    try:
+        value = datetime.fromisoformat(raw)
+    except ValueError as exc:
+        raise ValueError('timestamp must be an ISO-8601 timestamp') from exc
+    if value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value
+
+
+def ingest_checkins(app: Flask, points: list[dict]) -> IngestResult:
+    """Classify ``points`` and buffer the valid ones; returns per-point rejections."""
+    received_at = datetime.utcnow()
+    rows: list[tuple[str, dict]] = []
+    rejected: list[dict] = []
+    for index, (point, check) in enumerate(zip(points, check_points(points))):
+        try:
+            recorded_at = _recorded_at(point.get('timestamp'))
+        except ValueError as exc:
+            rejected.append({'index': index, 'error': str(exc)})
+            continue
+        if check.error:
+            rejected.append({'index': index, 'error': check.error})
+            continue
+        rows.append(
+            (
+                check.account_group_id,
+                {
+                    'assignment_id': check.assignment_id,
+                    'lat': float(point['lat']),
+                    'lon': float(point['lon']),
+                    'recorded_at': recorded_at,
+                    'on_site': check.allowed,
+                    'distance_meters': check.distance_meters,
+                    'received_at': received_at,
+                },
+            )
+        )
+    if rows:
+        buffer = checkin_buffer(app)
+        if len(buffer) >= app.config.get('CHECKIN_BUFFER_LIMIT', 20000):
+            try:
+                flush_checkins(app)
+            except Exception as exc:
+                LOG.exception('Inline check-in flush failed; refusing new pings')
+                raise CheckInBufferFull() from exc
+        buffered = buffer.extend(rows)
+        if app.config.get('CHECKIN_FLUSHER_AUTOSTART', True):
+            flusher = ensure_flusher(app)
+            if buffered >= app.config.get('CHECKIN_FLUSH_SIZE', 500):
+                flusher.wake()
+    return IngestResult(len(rows), rejected)
+
+
+def advance_intervals(rows: list[dict], shift_ids: dict[str, str], gap: timedelta) -> tuple[int, int]:
+    """Fold check-ins into presence intervals; returns (intervals extended, intervals started).
+
+    The caller must hold the row locks of the pings' assignments.
+    """
+    by_assignment: dict[str, list[dict]] = defaultdict(list)
+    for row in rows:
+        by_assignment[row['assignment_id']].append(row)
+    latest_ids = (
+        select(func.max(PresenceInterval.id))
+        .where(PresenceInterval.assignment_id.in_(by_assignment))
+        .group_by(PresenceInterval.assignment_id)
+    )
+    current = {
+        row.assignment_id: dict(row._mapping)
+        for row in db.session.execute(
+            select(
+                PresenceInterval.id,
+                PresenceInterval.assignment_id,
+                PresenceInterval.on_site,
+                PresenceInterval.ended_at,
+                PresenceInterval.ping_count,
+            )
+            .where(PresenceInterval.id.in_(latest_ids))
+        )
+    }
+    extended: dict[int, dict] = {}
+    started: list[dict] = []
+    for assignment_id, pings in by_assignment.items():
+        shift_id = shift_ids[assignment_id]
+        interval = current.get(assignment_id)
+        for ping in sorted(pings, key=lambda ping: ping['recorded_at']):
+            recorded_at = ping['recorded_at']
+            if interval is not None and recorded_at < interval['ended_at']:
+                continue
+            if (
+                interval is not None
+                and interval['on_site'] == ping['on_site']
+                and recorded_at - interval['ended_at'] <= gap
+            ):
+                interval['ended_at'] = recorded_at
+                interval['ping_count'] += 1
+                if 'id' in interval:
+                    extended[interval['id']] = interval
+                continue
+            interval = {
+                'assignment_id': assignment_id,
+                'shift_id': shift_id,
+                'on_site': ping['on_site'],
+                'started_at': recorded_at,
+                'ended_at': recorded_at,
+                'ping_count': 1,
+            }
+            started.append(interval)
+    if extended:
+        db.session.execute(
+            update(PresenceInterval),
+            [
+                {'id': interval_id, 'ended_at': interval['ended_at'], 'ping_count': interval['ping_count']}
+                for interval_id, interval in extended.items()
+            ],
+        )
+    if started:
+        db.session.execute(insert(PresenceInterval.__table__), started)
+    return len(extended), len(started)
+
+
+def _store_checkins(app: Flask, rows: list[dict]) -> int:
+    assignment_ids = {row['assignment_id'] for row in rows}
+    # Locking the assignments (in id order, so flushes cannot deadlock) serializes
+    # interval updates per assignment, including when it has no interval yet.
+    shift_ids = dict(
+        db.session.execute(
+            select(Assignment.id, Assignment.shift_id)
+            .where(Assignment.id.in_(assignment_ids))
+            .order_by(Assignment.id)
+            .with_for_update()
+        ).all()
+    )
+    # Pings for assignments deleted since ingest would fail the batch forever.
+    stored = [row for row in rows if row['assignment_id'] in shift_ids]
+    if stored:
+        # Append the raw pings first: on SQLite that takes the write lock,
+        # so concurrent flushes advance the same intervals one at a time.
+        db.session.execute(insert(CheckIn.__table__), stored)
+        advance_intervals(stored, shift_ids, timedelta(seconds=app.config.get('CHECKIN_GAP_SECONDS', 300)))
+        db.session.commit()
+    return len(stored)
+
+
+def flush_checkins(app: Flask) -> int:
+    """Write everything buffered in this process; returns the number of check-ins stored."""
+    buffer = checkin_buffer(app)
+    pending = buffer.drain()
+    if not pending:
+        return 0
+    by_shard: dict[str, list[tuple[str, dict]]] = defaultdict(list)
+    held: list[tuple[str, dict]] = []
+    stored = 0
+    with app.app_context():
+        for account_id, row in pending:
+            entry = account_placement(account_id, app)
+            if entry is not None and entry.state == MOVING:
+                held.append((account_id, row))
+            else:
+                by_shard[entry.shard if entry is not None else DEFAULT_SHARD].append((account_id, row))
+        if held:
+            buffer.requeue(held)
+        shards = list(by_shard)
+        for position, shard in enumerate(shards):
+            use_shard(shard)
+            try:
+                stored += _store_checkins(app, [row for _, row in by_shard[shard]])
+            except Exception:
+                # Shards already written keep their pings; this one and the rest go back.
+                buffer.requeue([item for name in shards[position:] for item in by_shard[name]])
+                raise
+    return stored
+
+
+def presence_for_shift(shift_id: str) -> list[dict]:
+    """Presence intervals of every assignment on the shift, with total on-site seconds."""
+    intervals = db.session.execute(
+        select(
+            PresenceInterval.assignment_id,
+            PresenceInterval.on_site,
+            PresenceInterval.started_at,
+            PresenceInterval.ended_at,
+            PresenceInterval.ping_count,
+        )
+        .where(PresenceInterval.shift_id == shift_id)
+        .order_by(PresenceInterval.assignment_id, PresenceInterval.started_at, PresenceInterval.id)
+    )
+    assignments: dict[str, dict] = {}
+    for row in intervals:
+        entry = assignments.setdefault(
+            row.assignment_id, {'assignment_id': row.assignment_id, 'on_site_seconds': 0, 'intervals': []}
+        )
+        if row.on_site:
+            entry['on_site_seconds'] += int((row.ended_at - row.started_at).total_seconds())
+        entry['intervals'].append(
+            {
+                'on_site': row.on_site,
+                'started_at': row.started_at.isoformat(),
+                'ended_at': row.ended_at.isoformat(),
+                'ping_count': row.ping_count,
+            }
+        )
+    return list(assignments.values())
+
+
+class CheckInFlusher(threading.Thread):
+    def __init__(self, app: Flask):
+        super().__init__(name='checkin-flusher', daemon=True)
+        self.app = app
+        self.flush_seconds = app.config.get('CHECKIN_FLUSH_SECONDS', 1)
+        self._wakeup = threading.Event()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def flush(self) -> None:
+        try:
+            flush_checkins(self.app)
+        except Exception:
+            LOG.exception('Check-in flush failed')
+
+    def run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+
+def ensure_flusher(app: Flask) -> CheckInFlusher:
+    """Start this process's check-in flusher for ``app`` if it is not running yet."""
+    with _flusher_lock:
+        flusher = _flushers.get(id(app))
+        if flusher is None or not flusher.is_alive():
+            flusher = CheckInFlusher(app)
+            flusher.start()
+            _flushers[id(app)] = flusher
+            atexit.register(flusher.flush)
+        return flusher
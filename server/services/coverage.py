@@ -0,0 +1,114 @@
+"""On-site headcount timeline built with a sweep line over shift intervals."""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from typing import NamedTuple
+
+from sqlalchemy import distinct, func, select
+
+from ..database import db
+from ..models import Assignment, Kid, Shift
+
+MAX_BUCKETS = 10_000
+
+
+class CoverageBucket(NamedTuple):
+    start: datetime
+    staff: int
+    kids: int
+
+
+def _shift_intervals(account_id: str, start: datetime, end: datetime):
+    overlapping = [
+        Shift.account_group_id == account_id,
+        Shift.start_time < end,
+        Shift.end_time > start,
+    ]
+    shift_ids = select(Shift.id).where(*overlapping)
+    staff_counts = (
+        select(Assignment.shift_id, func.count(distinct(Assignment.staff_id)).label('total'))
+        .where(Assignment.shift_id.in_(shift_ids))
+        .group_by(Assignment.shift_id)
+        .subquery()
+    )
+    kid_counts = (
+        select(Kid.shift_id, func.count().label('total'))
+        .where(Kid.shift_id.in_(shift_ids))
+        .group_by(Kid.shift_id)
+        .subquery()
+    )
+    statement = (
+        select(
+            Shift.start_time,
+            Shift.end_time,
+            func.coalesce(staff_counts.c.total, 0),
+            func.coalesce(kid_counts.c.total, 0),
+        )
+        .outerjoin(staff_counts, staff_counts.c.shift_id == Shift.id)
+        .outerjoin(kid_counts, kid_counts.c.shift_id == Shift.id)
+        .where(*overlapping)
+    )
+    return db.session.execute(statement).all()
+
+
+def coverage_timeline(account_id: str, start: datetime, end: datetime, bucket: timedelta) -> list[CoverageBucket]:
+    """Peak concurrent staff and kids per bucket between ``start`` and ``end``.
+
+    Every shift contributes a +count event at its start and a -count event at
+    its end. Sorting the events once and sweeping them in order gives the
+    running headcount, and each bucket keeps the highest level seen while it
+    was open, so the cost is O(n log n) in shifts plus O(buckets).
+    """
+    if end <= start:
+        raise ValueError('to must be after from')
+    if bucket <= timedelta(0):
+        raise ValueError('bucket_minutes must be positive')
+    bucket_count = -(-(end - start) // bucket)
+    if bucket_count > MAX_BUCKETS:
+        raise ValueError(f'window spans more than {MAX_BUCKETS} buckets')
+
+    events = []
+    for shift_start, shift_end, staff, kids in _shift_intervals(account_id, start, end):
+        if not (staff or kids):
+            continue
+        events.append((shift_start, staff, kids))
+        events.append((shift_end, -staff, -kids))
+    events.sort(key=itemgetter(0))
+
+    staff_peak = [0] * bucket_count
+    kids_peak = [0] * bucket_count
+    staff_level = kids_level = 0
+    cursor = 0
+
+    def record(index: int) -> None:
+        staff_peak[index] = max(staff_peak[index], staff_level)
+        kids_peak[index] = max(kids_peak[index], kids_level)
+
+    for moment, group in groupby(events, key=itemgetter(0)):
+        if moment >= end:
+            break
+        index = (moment - start) // bucket if moment >= start else -1
+        # Buckets the sweep passes over hold the current level throughout;
+        # the bucket holding this instant only does if it opened earlier.
+        while cursor < index:
+            record(cursor)
+            cursor += 1
+        if cursor == index:
+            if moment > start + bucket * index:
+                record(cursor)
+            cursor += 1
+        for _, staff_delta, kids_delta in group:
+            staff_level += staff_delta
+            kids_level += kids_delta
+        if index >= 0:
+            record(index)
+    while cursor < bucket_count:
+        record(cursor)
+        cursor += 1
+
+    return [
+        CoverageBucket(start + bucket * index, staff_peak[index], kids_peak[index])
+        for index in range(bucket_count)
+    ]
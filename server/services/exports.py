@@ -0,0 +1,303 @@
+"""Streaming CSV/NDJSON exports.
+
+Only the requested columns are selected, rows are fetched from a server-side
+cursor ``EXPORT_BATCH_SIZE`` at a time, and each batch is encoded and yielded
+before the next one is read, so memory stays constant and the header leaves
+the server before the query has produced its first row.
+
+Checkpointed exports instead return one gzip-compressed chunk per request,
+ordered by the keyset ``(created_at, id)``, together with an opaque token for
+the position after its last row. Resuming from a token continues strictly
+after that position, so a client that loses its connection re-requests only
+the chunk it was receiving.
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime
+from typing import Iterator, NamedTuple, Optional
+
+from sqlalchemy import Select, and_, func, or_, select
+
+from ..database import db
+from ..models import Assignment, Kid, Shift, StaffMember, staff_account_association
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+DEFAULT_CHECKPOINT_ROWS = 10_000
+MAX_CHECKPOINT_ROWS = 100_000
+
+EXPORT_COLUMNS = {
+    'staff': {
+        'id': StaffMember.id,
+        'name': StaffMember.full_name,
+        'full_name': StaffMember.full_name,
+        'email': StaffMember.email,
+        'role': StaffMember.role,
+        'status': StaffMember.status,
+        'created_at': StaffMember.created_at,
+    },
+    'kids': {
+        'id': Kid.id,
+        'name': Kid.full_name,
+        'ratio': Kid.ratio,
+        'requires_personal_trainer': Kid.requires_personal_trainer,
+        'special_instructions': Kid.special_instructions,
+        'account_group_id': Kid.account_group_id,
+        'shift_id': Kid.shift_id,
+        'assignment_id': Kid.assignment_id,
+        'created_at': Kid.created_at,
+    },
+    'shifts': {
+        'id': Shift.id,
+        'account_group_id': Shift.account_group_id,
+        'site': Shift.site,
+        'start_time': Shift.start_time,
+        'end_time': Shift.end_time,
+        'ratio_min': Shift.ratio_min,
+        'leads_required': Shift.leads_required,
+        'is_special': Shift.is_special,
+        'difficulty': Shift.difficulty,
+        'open_shift': Shift.open_shift,
+        'created_at': Shift.created_at,
+    },
+    'assignments': {
+        'id': Assignment.id,
+        'shift_id': Assignment.shift_id,
+        'staff_id': Assignment.staff_id,
+        'title': Assignment.title,
+        'difficulty_rating': Assignment.difficulty_rating,
+        'instructions': Assignment.instructions,
+        'requires_one_on_one': Assignment.requires_one_on_one,
+        'created_at': Assignment.created_at,
+    },
+}
+
+KEYSET_COLUMNS = {
+    'staff': (StaffMember.created_at, StaffMember.id),
+    'kids': (Kid.created_at, Kid.id),
+    'shifts': (Shift.created_at, Shift.id),
+    'assignments': (Assignment.created_at, Assignment.id),
+}
+
+DEFAULT_FIELDS = {
+    'staff': ['id', 'full_name', 'email', 'role', 'status'],
+    'kids': ['id', 'name', 'ratio', 'requires_personal_trainer', 'account_group_id', 'shift_id', 'assignment_id'],
+    'shifts': ['id', 'account_group_id', 'site', 'start_time', 'end_time', 'ratio_min', 'leads_required', 'open_shift'],
+    'assignments': ['id', 'shift_id', 'staff_id', 'title', 'difficulty_rating', 'requires_one_on_one'],
+}
+
+
+def resolve_fields(entity: str, requested: Optional[str]) -> list[str]:
+    if not requested:
+        return list(DEFAULT_FIELDS[entity])
+    fields = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in EXPORT_COLUMNS[entity]]
+    if unknown:
+        raise ValueError(f"Unknown fields for {entity}: {', '.join(unknown)}")
+    return fields
+
+
+def export_statement(
+    entity: str,
+    fields: list[str],
+    account_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Select:
+    """Project ``fields`` and scope by account and time window.
+
+    Shifts and assignments are windowed on the shift start time; staff and
+    kids on their ``created_at``.
+    """
+    columns = EXPORT_COLUMNS[entity]
+    statement = select(*[columns[field].label(field) for field in fields])
+    if entity == 'staff':
+        statement = statement.select_from(StaffMember)
+        if account_id:
+            members = select(staff_account_association.c.staff_id).where(
+                staff_account_association.c.account_group_id == account_id
+            )
+            statement = statement.where(StaffMember.id.in_(members))
+        window_column = StaffMember.created_at
+    elif entity == 'kids':
+        statement = statement.select_from(Kid)
+        if account_id:
+            statement = statement.where(Kid.account_group_id == account_id)
+        window_column = Kid.created_at
+    elif entity == 'shifts':
+        statement = statement.select_from(Shift)
+        if account_id:
+            statement = statement.where(Shift.account_group_id == account_id)
+        window_column = Shift.start_time
+    else:
+        statement = statement.select_from(Assignment)
+        if account_id or start or end:
+            statement = statement.join(Shift, Shift.id == Assignment.shift_id)
+        if account_id:
+            statement = statement.where(Shift.account_group_id == account_id)
+        window_column = Shift.start_time
+    if start:
+        statement = statement.where(window_column >= start)
+    if end:
+        statement = statement.where(window_column < end)
+    return statement
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_batches(statement: Select, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[list]:
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+
+def encode_csv(fields: list[str], batches: Iterator[list], header: bool = True) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+        yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_plain(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+
+
+def encode_ndjson(fields: list[str], batches: Iterator[list]) -> Iterator[str]:
+    for batch in batches:
+        yield ''.join(
+            json.dumps({field: _plain(value) for field, value in zip(fields, row)}) + '\n' for row in batch
+        )
+
+
+def stream_export(fields: list[str], export_format: str, statement: Select) -> Iterator[str]:
+    encoder = encode_csv if export_format == 'csv' else encode_ndjson
+    return encoder(fields, iter_batches(statement))
+
+
+class ExportCheckpoint(NamedTuple):
+    """Everything needed to continue an export; encoded into the opaque token."""
+
+    entity: str
+    fields: list[str]
+    export_format: str
+    account_id: Optional[str]
+    start: Optional[datetime]
+    end: Optional[datetime]
+    high_water: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    row_id: Optional[str] = None
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _from_iso(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def encode_checkpoint(checkpoint: ExportCheckpoint) -> str:
+    raw = json.dumps(
+        [
+            checkpoint.entity,
+            checkpoint.fields,
+            checkpoint.export_format,
+            checkpoint.account_id,
+            _iso(checkpoint.start),
+            _iso(checkpoint.end),
+            _iso(checkpoint.high_water),
+            _iso(checkpoint.created_at),
+            checkpoint.row_id,
+        ],
+        separators=(',', ':'),
+    ).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_checkpoint(token: str) -> ExportCheckpoint:
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        entity, fields, export_format, account_id, start, end, high_water, created_at, row_id = raw
+        if entity not in EXPORT_COLUMNS or export_format not in EXPORT_FORMATS:
+            raise ValueError(entity)
+        if any(field not in EXPORT_COLUMNS[entity] for field in fields):
+            raise ValueError(fields)
+        return ExportCheckpoint(
+            entity,
+            fields,
+            export_format,
+            account_id,
+            _from_iso(start),
+            _from_iso(end),
+            _from_iso(high_water),
+            _from_iso(created_at),
+            row_id,
+        )
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as exc:
+        raise ValueError('Invalid checkpoint') from exc
+
+
+class ExportChunk(NamedTuple):
+    body: bytes
+    rows: int
+    checkpoint: str
+    complete: bool
+
+
+def export_chunk(checkpoint: ExportCheckpoint, max_rows: int = DEFAULT_CHECKPOINT_ROWS) -> ExportChunk:
+    """Read up to ``max_rows`` rows after ``checkpoint`` and gzip them.
+
+    The first chunk pins a high-water mark at the newest ``created_at`` in
+    scope, so rows written while the export is in progress do not keep it
+    from finishing. CSV chunks after the first carry no header, which makes
+    the concatenation of every chunk one valid gzip file.
+    """
+    created_column, id_column = KEYSET_COLUMNS[checkpoint.entity]
+    scoped = export_statement(
+        checkpoint.entity,
+        checkpoint.fields,
+        account_id=checkpoint.account_id,
+        start=checkpoint.start,
+        end=checkpoint.end,
+    )
+    first = checkpoint.created_at is None
+    if first:
+        high_water = db.session.execute(scoped.with_only_columns(func.max(created_column))).scalar()
+        checkpoint = checkpoint._replace(high_water=high_water)
+    rows = []
+    if checkpoint.high_water is not None:
+        statement = scoped.add_columns(created_column, id_column).where(created_column <= checkpoint.high_water)
+        if not first:
+            statement = statement.where(
+                or_(
+                    created_column > checkpoint.created_at,
+                    and_(created_column == checkpoint.created_at, id_column > checkpoint.row_id),
+                )
+            )
+        rows = db.session.execute(statement.order_by(created_column, id_column).limit(max_rows + 1)).all()
+    complete = len(rows) <= max_rows
+    rows = rows[:max_rows]
+    width = len(checkpoint.fields)
+    projected = [row[:width] for row in rows]
+    if checkpoint.export_format == 'csv':
+        text = ''.join(encode_csv(checkpoint.fields, iter([projected]), header=first))
+    else:
+        text = ''.join(encode_ndjson(checkpoint.fields, iter([projected])))
+    if rows:
+        checkpoint = checkpoint._replace(created_at=rows[-1][width], row_id=rows[-1][width + 1])
+    return ExportChunk(gzip.compress(text.encode('utf-8')), len(rows), encode_checkpoint(checkpoint), complete)
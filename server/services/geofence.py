@@ -1,10 +1,123 @@
+"""Haversine checks of device coordinates against account geofences."""
+from __future__ import annotations
+
 import math
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from ..database import db
+from ..models import AccountGroup, Assignment, Shift
 
 RADIUS_EARTH_METERS = 6_371_000
 
+
 def is_within_geofence(lat: float, lon: float, center_lat: float, center_lon: float, radius: float) -> bool:
     dlat = math.radians(center_lat - lat)
     dlon = math.radians(center_lon - lon)
     a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat)) * math.cos(math.radians(center_lat)) * math.sin(dlon / 2) ** 2
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return (RADIUS_EARTH_METERS * c) <= radius
+
+
+class Geofence(NamedTuple):
+    account_group_id: str
+    lat: float
+    lon: float
+    radius: float
+
+
+def assignment_geofences(assignment_ids: Iterable[str]) -> dict[str, Geofence]:
+    """Each assignment's account geofence, for any number of assignments in one query."""
+    ids = set(assignment_ids)
+    if not ids:
+        return {}
+    rows = db.session.execute(
+        select(
+            Assignment.id,
+            AccountGroup.id,
+            AccountGroup.geofence_lat,
+            AccountGroup.geofence_lon,
+            AccountGroup.geofence_radius,
+        )
+        .join(Shift, Shift.id == Assignment.shift_id)
+        .join(AccountGroup, AccountGroup.id == Shift.account_group_id)
+        .where(Assignment.id.in_(ids))
+    )
+    return {
+        assignment_id: Geofence(account_id, lat or 0.0, lon or 0.0, radius or 0)
+        for assignment_id, account_id, lat, lon, radius in rows
+    }
+
+
+def distances_to_fences(points: list[tuple[float, float, Geofence]]) -> list[float]:
+    """Great-circle distance in meters from each (lat, lon) to its fence's center.
+
+    Per-fence terms (center in radians and its cosine) are computed once per
+    distinct fence rather than once per point, and the loop keeps the math
+    functions in locals, since a reconnect upload is mostly many pings
+    against a handful of fences.
+    """
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+    centers: dict[Geofence, tuple[float, float, float]] = {}
+    distances = []
+    for lat, lon, fence in points:
+        center = centers.get(fence)
+        if center is None:
+            center_lat = radians(fence.lat)
+            center = centers[fence] = (center_lat, radians(fence.lon), cos(center_lat))
+        center_lat, center_lon, cos_center = center
+        phi = radians(lat)
+        half_dlat = (center_lat - phi) / 2
+        half_dlon = (center_lon - radians(lon)) / 2
+        a = sin(half_dlat) ** 2 + cos(phi) * cos_center * sin(half_dlon) ** 2
+        distances.append(2 * RADIUS_EARTH_METERS * asin(sqrt(min(a, 1.0))))
+    return distances
+
+
+class PointCheck(NamedTuple):
+    assignment_id: Optional[str]
+    timestamp: Optional[str]
+    allowed: Optional[bool]
+    distance_meters: Optional[float]
+    error: Optional[str]
+    account_group_id: Optional[str] = None
+
+
+def check_points(points: list[dict]) -> list[PointCheck]:
+    """Validate a buffer of location pings, resolving each distinct assignment's geofence once."""
+    fences = assignment_geofences(
+        point.get('assignment_id') for point in points if isinstance(point.get('assignment_id'), str)
+    )
+    results: list[Optional[PointCheck]] = []
+    measurable: list[tuple[float, float, Geofence]] = []
+    positions: list[int] = []
+    for point in points:
+        assignment_id = point.get('assignment_id')
+        timestamp = point.get('timestamp')
+        fence = fences.get(assignment_id) if isinstance(assignment_id, str) else None
+        try:
+            lat, lon = float(point['lat']), float(point['lon'])
+        except (KeyError, TypeError, ValueError):
+            results.append(PointCheck(assignment_id, timestamp, None, None, 'lat and lon must be numbers'))
+            continue
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            results.append(PointCheck(assignment_id, timestamp, None, None, 'lat or lon out of range'))
+            continue
+        if fence is None:
+            results.append(PointCheck(assignment_id, timestamp, None, None, 'Assignment not found'))
+            continue
+        positions.append(len(results))
+        results.append(None)
+        measurable.append((lat, lon, fence))
+    for position, (_, _, fence), distance in zip(positions, measurable, distances_to_fences(measurable)):
+        point = points[position]
+        results[position] = PointCheck(
+            point['assignment_id'],
+            point.get('timestamp'),
+            distance <= fence.radius,
+            round(distance, 1),
+            None,
+            fence.account_group_id,
+        )
+    return results
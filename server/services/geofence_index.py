@@ -0,0 +1,252 @@
+"""In-memory grid index answering "which account geofences contain this point".
+
+Each active account's circle is registered in every cell of a
+``GEOFENCE_INDEX_CELL_DEGREES`` grid that its bounding box touches, so a
+lookup runs haversine only against the few fences sharing the point's cell.
+Circles spanning more than ``MAX_CELLS_PER_FENCE`` cells are kept on a short
+list checked on every lookup instead.
+
+The index is built per process on first use. Commits in this process that
+add, move, resize, deactivate or delete an account patch it directly; changes
+committed by other processes are picked up at most
+``GEOFENCE_INDEX_REFRESH_SECONDS`` later by re-reading accounts whose
+``updated_at`` moved, with a full rebuild when the active-account count
+shows rows were deleted. Builds and refreshes read every shard.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, NamedTuple, Optional
+
+from flask import Flask, current_app, has_app_context
+from sqlalchemy import event, func, select
+
+from ..database import db
+from ..models import AccountGroup
+from .geofence import Geofence, distances_to_fences
+from .sharding import each_shard
+
+PENDING_FENCES = 'geofence_index_changes'
+METERS_PER_DEGREE = 111_320
+MAX_CELLS_PER_FENCE = 64
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+
+class GeofenceMatch(NamedTuple):
+    account_group_id: str
+    name: str
+    distance_meters: float
+
+
+class GeofenceIndex:
+    def __init__(self, cell_degrees: float):
+        self.cell_degrees = cell_degrees
+        self._lon_cells = max(1, math.ceil(360 / cell_degrees))
+        self._fences: dict[str, Geofence] = {}
+        self._names: dict[str, str] = {}
+        self._cells: dict[tuple[int, int], set[str]] = {}
+        self._cells_of: dict[str, list[tuple[int, int]]] = {}
+        self._oversized: set[str] = set()
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.synced_at: Optional[datetime] = None
+        self.checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._fences)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees) % self._lon_cells
+
+    def _covering_cells(self, fence: Geofence) -> Optional[list[tuple[int, int]]]:
+        lat_span = fence.radius / METERS_PER_DEGREE
+        south, north = max(fence.lat - lat_span, -90.0), min(fence.lat + lat_span, 90.0)
+        widest = math.cos(math.radians(max(abs(south), abs(north))))
+        if widest < 1e-6:
+            return None
+        lon_span = fence.radius / (METERS_PER_DEGREE * widest)
+        if lon_span >= 180:
+            return None
+        rows = range(math.floor(south / self.cell_degrees), math.floor(north / self.cell_degrees) + 1)
+        columns = range(
+            math.floor((fence.lon - lon_span) / self.cell_degrees),
+            math.floor((fence.lon + lon_span) / self.cell_degrees) + 1,
+        )
+        if len(rows) * len(columns) > MAX_CELLS_PER_FENCE:
+            return None
+        return [(row, column % self._lon_cells) for row in rows for column in columns]
+
+    def _remove(self, account_id: str) -> None:
+        self._fences.pop(account_id, None)
+        self._names.pop(account_id, None)
+        self._oversized.discard(account_id)
+        for key in self._cells_of.pop(account_id, ()):
+            members = self._cells.get(key)
+            if members is not None:
+                members.discard(account_id)
+                if not members:
+                    del self._cells[key]
+
+    def _put(self, account_id: str, name: str, fence: Geofence) -> None:
+        self._remove(account_id)
+        self._fences[account_id] = fence
+        self._names[account_id] = name
+        cells = self._covering_cells(fence)
+        if cells is None:
+            self._oversized.add(account_id)
+            return
+        self._cells_of[account_id] = cells
+        for key in cells:
+            self._cells.setdefault(key, set()).add(account_id)
+
+    def apply(self, upserts: Iterable[tuple[str, str, Geofence]], removals: Iterable[str] = ()) -> None:
+        with self._lock:
+            for account_id in removals:
+                self._remove(account_id)
+            for account_id, name, fence in upserts:
+                self._put(account_id, name, fence)
+
+    def replace(self, fences: Iterable[tuple[str, str, Geofence]], synced_at: datetime) -> None:
+        with self._lock:
+            for account_id in list(self._fences):
+                self._remove(account_id)
+            for account_id, name, fence in fences:
+                self._put(account_id, name, fence)
+            self.loaded = True
+            self.synced_at = synced_at
+
+    def lookup(self, lat: float, lon: float) -> list[GeofenceMatch]:
+        with self._lock:
+            candidates = [self._fences[account_id] for account_id in self._cells.get(self._cell(lat, lon), ())]
+            candidates.extend(self._fences[account_id] for account_id in self._oversized)
+            names = {fence.account_group_id: self._names[fence.account_group_id] for fence in candidates}
+        distances = distances_to_fences([(lat, lon, fence) for fence in candidates])
+        matches = [
+            GeofenceMatch(fence.account_group_id, names[fence.account_group_id], round(distance, 1))
+            for fence, distance in zip(candidates, distances)
+            if distance <= fence.radius
+        ]
+        return sorted(matches, key=lambda match: match.distance_meters)
+
+
+def _fence_rows(statement) -> list[tuple[str, str, Geofence]]:
+    return [
+        (row.id, row.name, Geofence(row.id, row.geofence_lat, row.geofence_lon, row.geofence_radius))
+        for row in db.session.execute(statement)
+    ]
+
+
+def _active_accounts():
+    return select(
+        AccountGroup.id,
+        AccountGroup.name,
+        AccountGroup.geofence_lat,
+        AccountGroup.geofence_lon,
+        AccountGroup.geofence_radius,
+    ).where(AccountGroup.active.isnot(False))
+
+
+def _is_active(account: AccountGroup) -> bool:
+    return account.active is not False
+
+
+def rebuild_index(index: GeofenceIndex) -> None:
+    synced_at = datetime.utcnow()
+    fences = []
+    for _ in each_shard():
+        fences.extend(_fence_rows(_active_accounts()))
+    index.replace(fences, synced_at)
+
+
+def refresh_index(index: GeofenceIndex) -> None:
+    """Fold in accounts other processes changed since the last sync."""
+    synced_at = datetime.utcnow()
+    upserts: list[tuple[str, str, Geofence]] = []
+    removals: list[str] = []
+    active_count = 0
+    for _ in each_shard():
+        changed = db.session.execute(
+            select(AccountGroup.id, AccountGroup.active).where(
+                AccountGroup.updated_at >= index.synced_at - REFRESH_OVERLAP
+            )
+        ).all()
+        removals.extend(row.id for row in changed if row.active is False)
+        active_changed = [row.id for row in changed if row.active is not False]
+        if active_changed:
+            upserts.extend(_fence_rows(_active_accounts().where(AccountGroup.id.in_(active_changed))))
+        active_count += db.session.execute(
+            select(func.count()).select_from(AccountGroup).where(AccountGroup.active.isnot(False))
+        ).scalar_one()
+    index.apply(upserts, removals)
+    # An account mid-move counts twice, which just means rebuilding until the move ends.
+    if active_count != len(index):
+        rebuild_index(index)
+    else:
+        index.synced_at = synced_at
+
+
+def geofence_index(app: Flask) -> GeofenceIndex:
+    index = app.extensions.get('geofence_index')
+    if index is None:
+        index = app.extensions.setdefault(
+            'geofence_index', GeofenceIndex(app.config.get('GEOFENCE_INDEX_CELL_DEGREES', 0.05))
+        )
+    return index
+
+
+def containing_geofences(lat: float, lon: float) -> list[GeofenceMatch]:
+    app = current_app._get_current_object()
+    index = geofence_index(app)
+    now = time.monotonic()
+    if not index.loaded:
+        rebuild_index(index)
+        index.checked_at = now
+    elif now - index.checked_at >= app.config.get('GEOFENCE_INDEX_REFRESH_SECONDS', 30):
+        refresh_index(index)
+        index.checked_at = now
+    return index.lookup(lat, lon)
+
+
+def _collect_account_changes(session, flush_context) -> None:
+    upserts: dict[str, tuple[str, str, Geofence]] = {}
+    removals: set[str] = set()
+    for obj in (*session.new, *session.dirty):
+        if not isinstance(obj, AccountGroup):
+            continue
+        if _is_active(obj):
+            upserts[obj.id] = (obj.id, obj.name, Geofence(obj.id, obj.geofence_lat, obj.geofence_lon, obj.geofence_radius))
+        else:
+            removals.add(obj.id)
+    removals.update(obj.id for obj in session.deleted if isinstance(obj, AccountGroup))
+    if upserts or removals:
+        pending_upserts, pending_removals = session.info.setdefault(PENDING_FENCES, ({}, set()))
+        for account_id in removals:
+            pending_upserts.pop(account_id, None)
+        pending_upserts.update(upserts)
+        pending_removals.difference_update(upserts)
+        pending_removals.update(removals)
+
+
+def _apply_after_commit(session) -> None:
+    pending = session.info.pop(PENDING_FENCES, None)
+    if not pending or not has_app_context():
+        return
+    index = current_app.extensions.get('geofence_index')
+    if index is not None and index.loaded:
+        upserts, removals = pending
+        index.apply(upserts.values(), removals)
+
+
+def _discard_pending(session, *args) -> None:
+    session.info.pop(PENDING_FENCES, None)
+
+
+def register_geofence_listeners() -> None:
+    if event.contains(db.session, 'after_flush', _collect_account_changes):
+        return
+    event.listen(db.session, 'after_flush', _collect_account_changes)
+    event.listen(db.session, 'after_commit', _apply_after_commit)
+    event.listen(db.session, 'after_soft_rollback', _discard_pending)
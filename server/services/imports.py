@@ -0,0 +1,321 @@
+"""Streaming CSV imports.
+
+Uploads are decoded and parsed straight off the request stream one row at a
+time. Only the first few rows are kept for the preview and only the first
+``MAX_REPORTED_ERRORS`` messages are retained, so memory stays flat however
+large the file is. Valid rows are buffered into chunks that are written with
+one multi-row INSERT per table and committed chunk by chunk.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import uuid
+from datetime import datetime
+from typing import IO, Callable, Iterable, Optional
+
+from sqlalchemy import and_, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..database import db
+from ..models import Assignment, Kid, Shift, StaffMember, staff_account_association
+from ..utils.ratios import parse_ratio
+from .auth import supported_roles
+from .notifications import enqueue_emails
+from .principals import invalidate_principals
+from .rollups import refresh_rollups, shift_rollup_keys, staff_rollup_keys
+from .sharding import staff_written
+
+SUPPORTED_ENTITIES = {'staff', 'kids', 'assignments'}
+PREVIEW_ROWS = 5
+MAX_REPORTED_ERRORS = 100
+DEFAULT_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 10_000
+TRUTHY = {'1', 'true', 'yes', 'y'}
+# Ownership is granted at signup, never by a bulk upload.
+NON_IMPORTABLE_ROLES = {'Owner_admin'}
+
+
+class ImportReport:
+    def __init__(self, max_errors: int = MAX_REPORTED_ERRORS, preview_rows: int = PREVIEW_ROWS):
+        self.rows = 0
+        self.preview: list[dict] = []
+        self.errors: list[str] = []
+        self.error_count = 0
+        self.persisted = 0
+        self.max_errors = max_errors
+        self.preview_rows = preview_rows
+
+    def add_row(self, row: dict) -> None:
+        self.rows += 1
+        if len(self.preview) < self.preview_rows:
+            self.preview.append(row)
+
+    def add_error(self, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+    def as_dict(self) -> dict:
+        return {
+            'rows': self.rows,
+            'preview': self.preview,
+            'errors': self.errors,
+            'error_count': self.error_count,
+            'errors_truncated': self.error_count > len(self.errors),
+            'persisted': self.persisted,
+        }
+
+
+def open_csv_reader(stream: IO[bytes]) -> csv.DictReader:
+    """Wrap a byte stream in a DictReader that decodes it incrementally."""
+    return csv.DictReader(io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8-sig', newline=''))
+
+
+def row_error(entity: str, index: int, row: dict) -> Optional[str]:
+    if entity == 'staff' and (not row.get('email') or not row.get('full_name')):
+        return f'Row {index} invalid: missing email or name'
+    if entity == 'staff':
+        role = (row.get('role') or '').strip()
+        if role and (role not in supported_roles() or role in NON_IMPORTABLE_ROLES):
+            return f'Row {index} invalid: unsupported role {role}'
+    if entity == 'kids' and not row.get('name'):
+        return f'Row {index} invalid: missing kid name'
+    if entity == 'assignments' and not row.get('shift_id'):
+        return f'Row {index} invalid: missing shift_id'
+    return None
+
+
+def _flag(value: Optional[str]) -> bool:
+    return (value or '').strip().lower() in TRUTHY
+
+
+def _int_or_default(value: Optional[str], default: int) -> int:
+    try:
+        return int(value) if value not in (None, '') else default
+    except ValueError:
+        return default
+
+
+def _persist_staff(chunk: list[tuple[int, dict]], account_id: str, report: ImportReport) -> None:
+    """Create new staff in ``account_id`` and update its existing members.
+
+    Emails registered to staff outside the account are reported, never touched.
+    A blank or missing ``role`` keeps an existing member's role.
+    """
+    now = datetime.utcnow()
+    by_email: dict[str, tuple[int, dict]] = {}
+    for index, row in chunk:
+        by_email[row['email'].strip().lower()] = (index, row)
+    membership = select(staff_account_association.c.staff_id).where(
+        staff_account_association.c.account_group_id == account_id
+    )
+    existing = {
+        row.email.lower(): row
+        for row in db.session.execute(
+            select(StaffMember.id, StaffMember.email, StaffMember.role, StaffMember.id.in_(membership).label('member'))
+            .where(StaffMember.email.in_(by_email))
+        )
+    }
+    created: list[dict] = []
+    renamed: list[dict] = []
+    promoted: list[dict] = []
+    for email, (index, row) in by_email.items():
+        role = (row.get('role') or '').strip()
+        current = existing.get(email)
+        if current is None:
+            created.append(
+                {
+                    'id': str(uuid.uuid4()),
+                    'full_name': row['full_name'].strip(),
+                    'email': email,
+                    'role': role or 'Staff',
+                    'status': row.get('status') or 'active',
+                    'invited_at': now,
+                }
+            )
+        elif not current.member:
+            report.add_error(f'Row {index} invalid: {email} is registered to another account')
+        elif role and role != current.role:
+            promoted.append({'id': current.id, 'full_name': row['full_name'].strip(), 'role': role})
+        else:
+            renamed.append({'id': current.id, 'full_name': row['full_name'].strip()})
+    if created:
+        db.session.execute(insert(StaffMember.__table__), created)
+        db.session.execute(
+            insert(staff_account_association),
+            [{'staff_id': row['id'], 'account_group_id': account_id} for row in created],
+        )
+    for updates in (renamed, promoted):
+        if updates:
+            db.session.execute(update(StaffMember), updates)
+    staff_ids = [row['id'] for row in (*created, *renamed, *promoted)]
+    invalidate_principals(staff_ids)
+    staff_written(row['id'] for row in (*renamed, *promoted))
+    # Bulk writes bypass the ORM hooks; role rollups group by the role just changed.
+    refresh_rollups(staff_rollup_keys(row['id'] for row in promoted))
+    written = [email for email in by_email if email not in existing or existing[email].member]
+    enqueue_emails('shift_update', [(email, {'preview': True}) for email in written])
+    report.persisted += len(staff_ids)
+
+
+def _persist_kids(chunk: list[tuple[int, dict]], account_id: str, report: ImportReport) -> None:
+    shift_ids = {row['shift_id'] for _, row in chunk if row.get('shift_id')}
+    assignment_ids = {row['assignment_id'] for _, row in chunk if row.get('assignment_id')}
+    # Rows may only attach kids to this account's own shifts and assignments.
+    known_shifts: set[str] = set()
+    if shift_ids:
+        known_shifts = set(
+            db.session.execute(
+                select(Shift.id).where(Shift.id.in_(shift_ids), Shift.account_group_id == account_id)
+            ).scalars()
+        )
+    known_assignments: set[str] = set()
+    if assignment_ids:
+        known_assignments = set(
+            db.session.execute(
+                select(Assignment.id)
+                .join(Shift, and_(Shift.id == Assignment.shift_id, Shift.account_group_id == account_id))
+                .where(Assignment.id.in_(assignment_ids))
+            ).scalars()
+        )
+    rows = []
+    for index, row in chunk:
+        shift_id = row.get('shift_id') or None
+        assignment_id = row.get('assignment_id') or None
+        if shift_id and shift_id not in known_shifts:
+            report.add_error(f'Row {index} invalid: unknown shift_id')
+            continue
+        if assignment_id and assignment_id not in known_assignments:
+            report.add_error(f'Row {index} invalid: unknown assignment_id')
+            continue
+        ratio = row.get('ratio') or '1:1'
+        ratio_staff, ratio_kids = parse_ratio(ratio)
+        rows.append(
+            {
+                'full_name': row['name'],
+                'ratio': ratio,
+                'ratio_staff': ratio_staff,
+                'ratio_kids': ratio_kids,
+                'special_instructions': row.get('instructions') or None,
+                'requires_personal_trainer': _flag(row.get('requires_personal_trainer')),
+                'account_group_id': account_id,
+                'shift_id': shift_id,
+                'assignment_id': assignment_id,
+            }
+        )
+    if rows:
+        db.session.execute(Kid.__table__.insert(), rows)
+        refresh_rollups(shift_rollup_keys(row['shift_id'] for row in rows if row['shift_id']))
+    report.persisted += len(rows)
+
+
+def _persist_assignments(chunk: list[tuple[int, dict]], account_id: str, report: ImportReport) -> None:
+    shift_ids = {row['shift_id'] for _, row in chunk}
+    staff_ids = {row['staff_id'] for _, row in chunk if row.get('staff_id')}
+    known_ids = set(
+        db.session.execute(
+            select(Shift.id).where(Shift.id.in_(shift_ids), Shift.account_group_id == account_id)
+        ).scalars()
+    )
+    # Rows may only assign members of this account.
+    members: set[str] = set()
+    if staff_ids:
+        members = set(
+            db.session.execute(
+                select(staff_account_association.c.staff_id).where(
+                    staff_account_association.c.staff_id.in_(staff_ids),
+                    staff_account_association.c.account_group_id == account_id,
+                )
+            ).scalars()
+        )
+    rows = []
+    for index, row in chunk:
+        staff_id = row.get('staff_id') or None
+        if row['shift_id'] not in known_ids:
+            report.add_error(f'Row {index} invalid: unknown shift_id')
+            continue
+        if staff_id and staff_id not in members:
+            report.add_error(f'Row {index} invalid: unknown staff_id')
+            continue
+        rows.append(
+            {
+                'shift_id': row['shift_id'],
+                'staff_id': staff_id,
+                'title': row.get('title') or 'Kid assignment',
+                'difficulty_rating': _int_or_default(row.get('difficulty_rating'), 2),
+                'instructions': row.get('instructions') or None,
+                'requires_one_on_one': _flag(row.get('requires_one_on_one')),
+            }
+        )
+    if rows:
+        db.session.execute(Assignment.__table__.insert(), rows)
+        refresh_rollups(shift_rollup_keys({row['shift_id'] for row in rows}))
+    report.persisted += len(rows)
+
+
+PERSISTERS = {
+    'staff': _persist_staff,
+    'kids': _persist_kids,
+    'assignments': _persist_assignments,
+}
+
+
+def _flush_chunk(
+    entity: str,
+    chunk: list[tuple[int, dict]],
+    account_id: Optional[str],
+    report: ImportReport,
+    checkpoint: Optional[Callable[[ImportReport], None]] = None,
+) -> None:
+    try:
+        PERSISTERS[entity](chunk, account_id, report)
+        if checkpoint:
+            checkpoint(report)
+        db.session.commit()
+    except SQLAlchemyError as exc:
+        db.session.rollback()
+        report.add_error(f'Rows {chunk[0][0]}-{chunk[-1][0]} not saved: {exc.__class__.__name__}')
+
+
+def import_rows(
+    entity: str,
+    rows: Iterable[dict],
+    account_id: Optional[str] = None,
+    dry_run: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    report: Optional[ImportReport] = None,
+    progress: Optional[Callable[[ImportReport], None]] = None,
+    checkpoint: Optional[Callable[[ImportReport], None]] = None,
+    skip_rows: int = 0,
+) -> ImportReport:
+    """Validate ``rows`` and, unless ``dry_run``, persist them ``chunk_size`` at a time.
+
+    ``progress`` is called with the running report after every chunk.
+    ``checkpoint`` runs inside each chunk's transaction, so whatever it records
+    commits together with the rows; a resumed import passes the recorded
+    ``report.rows`` back as ``skip_rows`` to continue after them.
+    """
+    report = report or ImportReport()
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    chunk: list[tuple[int, dict]] = []
+    for index, row in enumerate(rows, start=1):
+        if index <= skip_rows:
+            continue
+        report.add_row(row)
+        error = row_error(entity, index, row)
+        if error:
+            report.add_error(error)
+        elif not dry_run:
+            chunk.append((index, row))
+        if len(chunk) >= chunk_size or (dry_run and index % chunk_size == 0):
+            if chunk:
+                _flush_chunk(entity, chunk, account_id, report, checkpoint)
+                chunk = []
+            if progress:
+                progress(report)
+    if chunk:
+        _flush_chunk(entity, chunk, account_id, report, checkpoint)
+    if progress:
+        progress(report)
+    return report
@@ -0,0 +1,242 @@
+"""Background import jobs backed by the ``import_jobs`` table.
+
+An asynchronous import spools the request body to a file and inserts a queued
+job row; the table itself is the queue, so no external broker is needed. Each
+worker process runs one daemon thread that claims queued jobs with a
+conditional UPDATE (so two workers never run the same job), streams the spooled
+file through :func:`import_rows`, and records progress after every chunk.
+Jobs whose heartbeat goes stale, e.g. because their worker was killed, are
+claimed again and resume after the last row offset committed with a chunk, so
+rows that were already saved are not inserted twice. Jobs of an account that
+is moving to another shard are not claimed, and a running one stops before
+its next chunk commits and goes back to the queue, to resume on the account's
+new shard.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import IO, Optional
+
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_, select, update
+
+from ..database import db
+from ..models import ImportJob
+from .imports import ImportReport, import_rows, open_csv_reader
+from .sharding import AccountMoving, each_shard, moving_account_ids, outside_moves
+
+LOG = logging.getLogger('staffmonitr.jobs')
+
+STALE_AFTER = timedelta(minutes=10)
+COPY_BUFFER_BYTES = 64 * 1024
+
+_runner_lock = threading.Lock()
+_runners: dict[int, 'ImportJobRunner'] = {}
+
+
+def spool_dir(app: Flask) -> str:
+    path = app.config.get('IMPORT_SPOOL_DIR') or os.path.join(app.instance_path, 'import-spool')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue_import(
+    stream: IO[bytes], entity: str, account_id: Optional[str], dry_run: bool, chunk_size: int
+) -> ImportJob:
+    app = current_app._get_current_object()
+    upload_path = os.path.join(spool_dir(app), f'{uuid.uuid4().hex}.csv')
+    with open(upload_path, 'wb') as spool:
+        shutil.copyfileobj(stream, spool, COPY_BUFFER_BYTES)
+    job = ImportJob(
+        entity=entity,
+        account_group_id=account_id,
+        dry_run=dry_run,
+        chunk_size=chunk_size,
+        upload_path=upload_path,
+    )
+    db.session.add(job)
+    db.session.commit()
+    wake_runner(app)
+    return job
+
+
+def job_payload(job: ImportJob) -> dict:
+    return {
+        'id': job.id,
+        'entity': job.entity,
+        'status': job.status,
+        'dry_run': job.dry_run,
+        'rows_processed': job.rows_processed,
+        'persisted': job.persisted,
+        'error_count': job.error_count,
+        'errors': job.errors or [],
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _claim_next_job() -> Optional[str]:
+    now = datetime.utcnow()
+    claimable = and_(
+        or_(
+            ImportJob.status == 'queued',
+            and_(ImportJob.status == 'running', ImportJob.heartbeat_at < now - STALE_AFTER),
+        ),
+        outside_moves(ImportJob.account_group_id),
+    )
+    candidates = db.session.execute(
+        select(ImportJob.id).where(claimable).order_by(ImportJob.created_at).limit(5)
+    ).scalars().all()
+    for job_id in candidates:
+        claimed = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, claimable)
+            .values(status='running', heartbeat_at=now)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return job_id
+    return None
+
+
+def _store_progress(job_id: str, report: ImportReport, **values) -> None:
+    db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job_id)
+        .values(
+            rows_processed=report.rows,
+            persisted=report.persisted,
+            error_count=report.error_count,
+            errors=list(report.errors),
+            heartbeat_at=datetime.utcnow(),
+            **values,
+        )
+    )
+
+
+def _record_progress(job_id: str, report: ImportReport, **values) -> None:
+    _store_progress(job_id, report, **values)
+    db.session.commit()
+
+
+def _checkpoint(job_id: str, account_id: Optional[str], report: ImportReport) -> None:
+    if account_id in moving_account_ids():
+        raise AccountMoving(account_id)
+    _store_progress(job_id, report)
+
+
+def _resume_report(job: ImportJob) -> ImportReport:
+    """Seed a report with the counts a previous runner committed for ``job``."""
+    report = ImportReport()
+    report.rows = job.rows_processed or 0
+    report.persisted = job.persisted or 0
+    report.error_count = job.error_count or 0
+    report.errors = list(job.errors or [])
+    return report
+
+
+def _discard_upload(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        LOG.warning('Could not remove spooled upload %s', path)
+
+
+def run_next_job() -> Optional[str]:
+    """Claim and run one queued job in the current app context; returns its id."""
+    job_id = _claim_next_job()
+    if not job_id:
+        return None
+    job = db.session.get(ImportJob, job_id)
+    account_id = job.account_group_id
+    upload_path = job.upload_path
+    report = _resume_report(job)
+    try:
+        with open(upload_path, 'rb') as upload:
+            import_rows(
+                job.entity,
+                open_csv_reader(upload),
+                account_id=account_id,
+                dry_run=job.dry_run,
+                chunk_size=job.chunk_size,
+                report=report,
+                progress=lambda current: _record_progress(job_id, current),
+                checkpoint=lambda current: _checkpoint(job_id, account_id, current),
+                skip_rows=report.rows,
+            )
+    except AccountMoving:
+        # The chunk in flight rolled back; the committed offset survives the move.
+        db.session.rollback()
+        db.session.execute(update(ImportJob).where(ImportJob.id == job_id).values(status='queued'))
+        db.session.commit()
+        LOG.info('Import job %s paused while its account moves', job_id)
+    except Exception as exc:  # the job row is the only place a failure can be reported
+        LOG.exception('Import job %s failed', job_id)
+        db.session.rollback()
+        report.add_error(f'Import aborted: {exc}')
+        _record_progress(job_id, report, status='failed', finished_at=datetime.utcnow())
+        _discard_upload(upload_path)
+    else:
+        _record_progress(job_id, report, status='succeeded', finished_at=datetime.utcnow())
+        _discard_upload(upload_path)
+    return job_id
+
+
+class ImportJobRunner(threading.Thread):
+    def __init__(self, app: Flask):
+        super().__init__(name='import-job-runner', daemon=True)
+        self.app = app
+        self.poll_seconds = app.config.get('IMPORT_RUNNER_POLL_SECONDS', 5)
+        self._wakeup = threading.Event()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def run(self) -> None:
+        while True:
+            ran = None
+            try:
+                with self.app.app_context():
+                    for _ in each_shard(self.app):
+                        ran = run_next_job() or ran
+                    db.session.remove()
+            except Exception:
+                LOG.exception('Import job runner iteration failed')
+            if not ran:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+
+
+def ensure_runner(app: Flask) -> ImportJobRunner:
+    """Start this process's runner for ``app`` if it is not running yet."""
+    with _runner_lock:
+        runner = _runners.get(id(app))
+        if runner is None or not runner.is_alive():
+            runner = ImportJobRunner(app)
+            runner.start()
+            _runners[id(app)] = runner
+        return runner
+
+
+def wake_runner(app: Flask) -> None:
+    """Nudge this process's runner, starting it lazily unless autostart is off."""
+    if app.config.get('IMPORT_RUNNER_AUTOSTART', True):
+        ensure_runner(app).wake()
+
+
+jobs_cli = AppGroup('imports', help='Run background import jobs.')
+
+
+@jobs_cli.command('worker')
+def worker_command() -> None:
+    """Process queued import jobs in the foreground until interrupted."""
+    runner = ImportJobRunner(current_app._get_current_object())
+    click.echo('Processing import jobs; press Ctrl+C to stop')
+    runner.run()
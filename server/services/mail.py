@@ -0,0 +1,134 @@
+"""Mail transports used by the notification dispatcher.
+
+``MAIL_TRANSPORT`` picks one per app: ``log`` (the default) only writes each
+message to the log, ``smtp`` relays through ``MAIL_SMTP_HOST`` over a single
+connection per batch, and ``local`` keeps messages in an in-memory mailbox
+that tests and local development can inspect.
+"""
+from __future__ import annotations
+
+import logging
+import smtplib
+import threading
+from email.message import EmailMessage
+from typing import Optional
+
+from flask import Flask
+
+LOG = logging.getLogger('staffmonitr.mail')
+
+EMAIL_SUBJECTS = {
+    'shift_update': 'Shift update alert',
+    'assignment_change': 'Assignment change',
+    'open_shift': 'Open shift offered',
+}
+DEFAULT_SUBJECT = 'Staffmonitr notification'
+
+
+def render_email(sender: str, recipient: str, subject_key: str, payload: dict, event_count: int = 1) -> EmailMessage:
+    """Build the message; ``event_count`` > 1 turns it into a digest of coalesced events."""
+    subject = EMAIL_SUBJECTS.get(subject_key, DEFAULT_SUBJECT)
+    lines = [f'{key}: {value}' for key, value in sorted(payload.items())]
+    if event_count > 1:
+        subject = f'{subject} ({event_count} updates)'
+        lines.insert(0, f'{event_count} updates were combined into this message; the latest is shown below.')
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content('\n'.join(lines) or subject)
+    return message
+
+
+class LogTransport:
+    def send_batch(self, messages: list[EmailMessage]) -> list[Optional[str]]:
+        for message in messages:
+            LOG.info('Sending email to %s | %s', message['To'], message['Subject'])
+        return [None] * len(messages)
+
+
+class SMTPTransport:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = False,
+        timeout: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send_batch(self, messages: list[EmailMessage]) -> list[Optional[str]]:
+        """Send every message over one connection; returns an error (or None) per message.
+
+        Connection-level failures propagate so the whole batch is retried.
+        """
+        errors: list[Optional[str]] = []
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as client:
+            if self.starttls:
+                client.starttls()
+            if self.username:
+                client.login(self.username, self.password or '')
+            for message in messages:
+                try:
+                    client.send_message(message)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as exc:
+                    errors.append(str(exc))
+                else:
+                    errors.append(None)
+        return errors
+
+
+class LocalMailbox:
+    """SMTP stand-in that records messages instead of delivering them.
+
+    Recipients in ``refuse`` are rejected, and ``offline`` fails whole batches
+    the way an unreachable relay would, so retry paths can be exercised.
+    """
+
+    def __init__(self):
+        self.messages: list[EmailMessage] = []
+        self.refuse: set[str] = set()
+        self.offline = False
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages: list[EmailMessage]) -> list[Optional[str]]:
+        if self.offline:
+            raise ConnectionRefusedError('local mailbox is offline')
+        errors: list[Optional[str]] = []
+        with self._lock:
+            for message in messages:
+                if message['To'] in self.refuse:
+                    errors.append(f"{message['To']} refused")
+                else:
+                    self.messages.append(message)
+                    errors.append(None)
+        return errors
+
+
+def get_transport(app: Flask):
+    transport = app.extensions.get('mail_transport')
+    if transport is None:
+        kind = app.config.get('MAIL_TRANSPORT', 'log')
+        if kind == 'smtp':
+            transport = SMTPTransport(
+                app.config.get('MAIL_SMTP_HOST', 'localhost'),
+                app.config.get('MAIL_SMTP_PORT', 25),
+                username=app.config.get('MAIL_SMTP_USERNAME'),
+                password=app.config.get('MAIL_SMTP_PASSWORD'),
+                starttls=app.config.get('MAIL_SMTP_STARTTLS', False),
+            )
+        elif kind == 'local':
+            transport = LocalMailbox()
+        elif kind == 'log':
+            transport = LogTransport()
+        else:
+            raise ValueError(f'Unknown MAIL_TRANSPORT {kind!r}')
+        app.extensions['mail_transport'] = transport
+    return transport
@@ -1,28 +1,160 @@
-import logging
-from datetime import datetime
+"""Notification producers.
 
-LOG = logging.getLogger('staffmonitr.notifications')
+Nothing is delivered from inside a request. Each notification is added to the
+``notification_outbox`` table on the caller's session, so it commits or rolls
+back together with the change that caused it, and the dispatcher in
+:mod:`.outbox` delivers it afterwards.
 
-EMAIL_SUBJECTS = {
-    'shift_update': 'Shift update alert',
-    'assignment_change': 'Assignment change',
-    'open_shift': 'Open shift offered',
-}
+The first notification for a (recipient, subject, entity) is due at once.
+Further events for the same key within ``NOTIFY_COALESCE_SECONDS`` of the
+last message are held until that window ends and merged into one waiting
+row, which is delivered once as a digest of everything it absorbed.
+"""
+from __future__ import annotations
 
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
 
-def send_email(recipient: str, subject_key: str, payload: dict) -> None:
-    subject = EMAIL_SUBJECTS.get(subject_key, 'Staffmonitr notification')
-    LOG.info('Sending email to %s | %s | payload=%s', recipient, subject, payload)
+from flask import current_app
+from sqlalchemy import func, select
+
+from ..database import db
+from ..models import NotificationOutbox
+
+WAKE_DISPATCHER = 'wake_notification_dispatcher'
+
+
+def coalesce_key(audience: str, subject_key: str, entity_key: Optional[str]) -> Optional[str]:
+    return f'{audience}|{subject_key}|{entity_key}' if entity_key else None
+
+
+def broadcast_audience(account_id: str, roles: Optional[Sequence[str]]) -> str:
+    return f"account:{account_id}:{','.join(sorted(roles or []))}"
+
+
+def _coalesce_window() -> timedelta:
+    return timedelta(seconds=current_app.config.get('NOTIFY_COALESCE_SECONDS', 0))
+
+
+def _enqueue(
+    audience: str,
+    subject_key: str,
+    payload: dict,
+    entity_key: Optional[str],
+    **columns,
+) -> NotificationOutbox:
+    now = datetime.utcnow()
+    window = _coalesce_window()
+    key = coalesce_key(audience, subject_key, entity_key)
+    due_at = now
+    if key and window:
+        waiting = db.session.execute(
+            select(NotificationOutbox)
+            .where(
+                NotificationOutbox.coalesce_key == key,
+                NotificationOutbox.status == 'pending',
+                NotificationOutbox.attempts == 0,
+                NotificationOutbox.next_attempt_at > now,
+            )
+            .limit(1)
+            .with_for_update()
+        ).scalar_one_or_none()
+        if waiting is not None:
+            waiting.event_count += 1
+            waiting.payload = payload
+            return waiting
+        last_due = db.session.execute(
+            select(func.max(NotificationOutbox.next_attempt_at)).where(NotificationOutbox.coalesce_key == key)
+        ).scalar_one()
+        if last_due is not None and last_due + window > now:
+            due_at = last_due + window
+    entry = NotificationOutbox(
+        subject_key=subject_key,
+        payload=payload,
+        entity_key=entity_key,
+        coalesce_key=key,
+        next_attempt_at=due_at,
+        **columns,
+    )
+    db.session.add(entry)
+    db.session.info[WAKE_DISPATCHER] = True
+    return entry
+
+
+def enqueue_email(
+    recipient: str, subject_key: str, payload: dict, entity_key: Optional[str] = None
+) -> NotificationOutbox:
+    return _enqueue(recipient, subject_key, payload, entity_key, recipient=recipient)
+
+
+def enqueue_emails(subject_key: str, messages: Sequence[tuple[str, dict]]) -> None:
+    """Add many ``(recipient, payload)`` notifications with one multi-row INSERT."""
+    if not messages:
+        return
+    db.session.execute(
+        NotificationOutbox.__table__.insert(),
+        [{'recipient': recipient, 'subject_key': subject_key, 'payload': payload} for recipient, payload in messages],
+    )
+    db.session.info[WAKE_DISPATCHER] = True
 
 
 def notify_shift_change(staff_email: str, shift_id: str) -> None:
-    send_email(staff_email, 'shift_update', {'shift_id': shift_id, 'timestamp': datetime.utcnow().isoformat()})
+    enqueue_email(
+        staff_email,
+        'shift_update',
+        {'shift_id': shift_id, 'timestamp': datetime.utcnow().isoformat()},
+        entity_key=f'shift:{shift_id}',
+    )
 
 
 def notify_assignment_change(staff_email: str, assignment_id: str) -> None:
-    send_email(staff_email, 'assignment_change', {'assignment_id': assignment_id, 'timestamp': datetime.utcnow().isoformat()})
+    enqueue_email(
+        staff_email,
+        'assignment_change',
+        {'assignment_id': assignment_id, 'timestamp': datetime.utcnow().isoformat()},
+        entity_key=f'assignment:{assignment_id}',
+    )
+
+
+def broadcast_open_shift(open_shift_id: str, account_id: str, roles: Optional[Sequence[str]] = None) -> None:
+    """Queue one outbox row for the account's staff (optionally only ``roles``).
+
+    The dispatcher resolves the audience into batched push calls for staff
+    with registered devices and email for the rest, so the caller's cost does
+    not grow with the account's headcount.
+    """
+    _enqueue(
+        broadcast_audience(account_id, roles),
+        'open_shift',
+        {'shift_id': open_shift_id},
+        f'shift:{open_shift_id}',
+        channel='broadcast',
+        account_group_id=account_id,
+        audience_roles=sorted(roles) if roles else None,
+    )
+
 
+def notification_stats(since: Optional[datetime] = None) -> dict:
+    """Delivery counts per status plus how many events coalescing suppressed.
 
-def broadcast_open_shift(open_shift_id: str, audience: list[str]) -> None:
-    for recipient in audience:
-        send_email(recipient, 'open_shift', {'shift_id': open_shift_id})
+    Broadcast rows already fanned out are left out; their recipients' rows
+    carry the same event counts.
+    """
+    statement = (
+        select(
+            NotificationOutbox.status,
+            func.count(),
+            func.coalesce(func.sum(NotificationOutbox.event_count), 0),
+        )
+        .where(NotificationOutbox.status != 'expanded')
+        .group_by(NotificationOutbox.status)
+    )
+    if since:
+        statement = statement.where(NotificationOutbox.created_at >= since)
+    messages = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+    events = suppressed = 0
+    for status, count, event_total in db.session.execute(statement):
+        messages[status] = count
+        events += event_total
+        suppressed += event_total - count
+    return {'messages': messages, 'events': events, 'suppressed': suppressed}
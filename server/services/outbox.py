@@ -0,0 +1,358 @@
+"""Background delivery of the notification outbox.
+
+Each worker process runs one daemon dispatcher thread. A pass first fans
+pending broadcasts out into push rows of up to ``PUSH_BATCH_SIZE`` device
+tokens each, plus an email row for every recipient without a device. It then
+claims a batch of due rows with a single conditional UPDATE, sends the email
+rows to the mail transport as one batch and each push row as one multicast
+call, and records the outcome. Failed rows are retried with exponential
+backoff until ``NOTIFY_MAX_ATTEMPTS`` is reached; rows whose claim goes stale,
+e.g. because their worker died mid-send, become claimable again, so delivery
+is at least once. Rows of an account that is moving to another shard are left
+alone until the move ends.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+import click
+from flask import Flask, current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import and_, event, or_, select, update
+
+from ..database import db
+from ..models import NotificationOutbox, PushToken, StaffMember, staff_account_association
+from .mail import get_transport, render_email
+from .notifications import WAKE_DISPATCHER, coalesce_key
+from .push import UNREGISTERED, forget_tokens, get_push_transport, prune_stale_tokens, render_push
+from .sharding import each_shard, outside_moves
+
+LOG = logging.getLogger('staffmonitr.outbox')
+
+STALE_AFTER = timedelta(minutes=5)
+FANOUT_CHUNK_SIZE = 1000
+LAST_ERROR_LENGTH = 255
+
+_dispatcher_lock = threading.Lock()
+_dispatchers: dict[int, 'NotificationDispatcher'] = {}
+
+
+class DispatchResult(NamedTuple):
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+
+
+def retry_delay(attempts: int, base_seconds: float, max_seconds: float) -> timedelta:
+    return timedelta(seconds=min(base_seconds * 2 ** (attempts - 1), max_seconds))
+
+
+def _fan_out(broadcast, push_batch_size: int) -> None:
+    """Insert push rows of up to ``push_batch_size`` tokens and email rows for staff without a device."""
+    audience = (
+        select(StaffMember.email, PushToken.token)
+        .join(staff_account_association, staff_account_association.c.staff_id == StaffMember.id)
+        .outerjoin(PushToken, PushToken.staff_id == StaffMember.id)
+        .where(staff_account_association.c.account_group_id == broadcast.account_group_id)
+    )
+    if broadcast.audience_roles:
+        audience = audience.where(StaffMember.role.in_(broadcast.audience_roles))
+    shared = {
+        'account_group_id': broadcast.account_group_id,
+        'subject_key': broadcast.subject_key,
+        'payload': broadcast.payload,
+        'entity_key': broadcast.entity_key,
+        'event_count': broadcast.event_count,
+    }
+    tokens: list[str] = []
+
+    def flush_tokens() -> None:
+        db.session.execute(
+            NotificationOutbox.__table__.insert(),
+            [{**shared, 'channel': 'push', 'device_tokens': tokens[:push_batch_size]}],
+        )
+        del tokens[:push_batch_size]
+
+    result = db.session.execute(audience.execution_options(yield_per=FANOUT_CHUNK_SIZE))
+    for rows in result.partitions():
+        emails = []
+        for email, token in rows:
+            if token is None:
+                emails.append(email)
+            else:
+                tokens.append(token)
+        if emails:
+            db.session.execute(
+                NotificationOutbox.__table__.insert(),
+                [
+                    {
+                        **shared,
+                        'recipient': email,
+                        'coalesce_key': coalesce_key(email, broadcast.subject_key, broadcast.entity_key),
+                    }
+                    for email in emails
+                ],
+            )
+        while len(tokens) >= push_batch_size:
+            flush_tokens()
+    if tokens:
+        flush_tokens()
+
+
+def expand_broadcasts(limit: int = 10) -> int:
+    """Replace due broadcast rows with push batches and per-recipient email rows."""
+    now = datetime.utcnow()
+    push_batch_size = current_app.config.get('PUSH_BATCH_SIZE', 500)
+    broadcasts = db.session.execute(
+        select(
+            NotificationOutbox.id,
+            NotificationOutbox.subject_key,
+            NotificationOutbox.payload,
+            NotificationOutbox.account_group_id,
+            NotificationOutbox.audience_roles,
+            NotificationOutbox.entity_key,
+            NotificationOutbox.event_count,
+        )
+        .where(
+            NotificationOutbox.channel == 'broadcast',
+            NotificationOutbox.status == 'pending',
+            NotificationOutbox.next_attempt_at <= now,
+            outside_moves(NotificationOutbox.account_group_id),
+        )
+        .order_by(NotificationOutbox.next_attempt_at)
+        .limit(limit)
+    ).all()
+    expanded = 0
+    for broadcast in broadcasts:
+        claimed = db.session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id == broadcast.id, NotificationOutbox.status == 'pending')
+            .values(status='expanded')
+        )
+        if claimed.rowcount != 1:
+            db.session.rollback()
+            continue
+        _fan_out(broadcast, push_batch_size)
+        db.session.commit()
+        expanded += 1
+    return expanded
+
+
+def _claimable(now: datetime):
+    return and_(
+        NotificationOutbox.channel != 'broadcast',
+        outside_moves(NotificationOutbox.account_group_id),
+        or_(
+            and_(NotificationOutbox.status == 'pending', NotificationOutbox.next_attempt_at <= now),
+            and_(NotificationOutbox.status == 'sending', NotificationOutbox.claimed_at < now - STALE_AFTER),
+        ),
+    )
+
+
+def _claim_batch(batch_size: int) -> list:
+    now = datetime.utcnow()
+    due_ids = db.session.execute(
+        select(NotificationOutbox.id)
+        .where(_claimable(now))
+        .order_by(NotificationOutbox.next_attempt_at)
+        .limit(batch_size)
+    ).scalars().all()
+    if not due_ids:
+        return []
+    token = str(uuid.uuid4())
+    db.session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(due_ids), _claimable(now))
+        .values(status='sending', claim_token=token, claimed_at=now)
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(
+            NotificationOutbox.id,
+            NotificationOutbox.channel,
+            NotificationOutbox.recipient,
+            NotificationOutbox.device_tokens,
+            NotificationOutbox.subject_key,
+            NotificationOutbox.payload,
+            NotificationOutbox.attempts,
+            NotificationOutbox.event_count,
+        ).where(NotificationOutbox.claim_token == token)
+    ).all()
+
+
+def _deliver_emails(app: Flask, rows: list) -> list[Optional[str]]:
+    sender = app.config.get('MAIL_SENDER', 'noreply@staffmonitr.local')
+    messages = [
+        render_email(sender, row.recipient, row.subject_key, row.payload or {}, row.event_count)
+        for row in rows
+    ]
+    try:
+        return get_transport(app).send_batch(messages)
+    except Exception as exc:  # the relay itself failed; retry the whole batch
+        LOG.warning('Mail transport failed for a batch of %d: %s', len(rows), exc)
+        return [f'{exc.__class__.__name__}: {exc}'] * len(rows)
+
+
+def _deliver_push(app: Flask, row) -> tuple[Optional[str], Optional[list[str]]]:
+    """Send one push batch; returns an error and the tokens to retry, if any."""
+    tokens = row.device_tokens or []
+    message = render_push(row.subject_key, row.payload or {}, row.event_count)
+    try:
+        results = get_push_transport(app).send_multicast(tokens, message)
+    except Exception as exc:
+        LOG.warning('Push transport failed for %d devices: %s', len(tokens), exc)
+        return f'{exc.__class__.__name__}: {exc}', None
+    forget_tokens([token for token, result in zip(tokens, results) if result == UNREGISTERED])
+    retry = [token for token, result in zip(tokens, results) if result not in (None, UNREGISTERED)]
+    if retry:
+        return f'{len(retry)} of {len(tokens)} devices failed', retry
+    return None, None
+
+
+def dispatch_batch() -> DispatchResult:
+    """Deliver one batch of due notifications in the current app context."""
+    app = current_app._get_current_object()
+    expand_broadcasts()
+    batch = _claim_batch(app.config.get('NOTIFY_BATCH_SIZE', 100))
+    if not batch:
+        return DispatchResult()
+    emails = [row for row in batch if row.channel == 'email']
+    outcomes = [(row, error, None) for row, error in zip(emails, _deliver_emails(app, emails) if emails else [])]
+    outcomes += [(row, *_deliver_push(app, row)) for row in batch if row.channel == 'push']
+
+    now = datetime.utcnow()
+    sent_ids = [row.id for row, error, _ in outcomes if error is None]
+    if sent_ids:
+        db.session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(sent_ids))
+            .values(status='sent', sent_at=now, claim_token=None, last_error=None)
+        )
+    max_attempts = app.config.get('NOTIFY_MAX_ATTEMPTS', 6)
+    base = app.config.get('NOTIFY_RETRY_BASE_SECONDS', 30)
+    ceiling = app.config.get('NOTIFY_RETRY_MAX_SECONDS', 3600)
+    retried = failed = 0
+    for row, error, retry_tokens in outcomes:
+        if error is None:
+            continue
+        attempts = row.attempts + 1
+        exhausted = attempts >= max_attempts
+        values = {
+            'status': 'failed' if exhausted else 'pending',
+            'attempts': attempts,
+            'next_attempt_at': now + retry_delay(attempts, base, ceiling),
+            'claim_token': None,
+            'last_error': error[:LAST_ERROR_LENGTH],
+        }
+        if retry_tokens is not None:
+            values['device_tokens'] = retry_tokens
+        db.session.execute(update(NotificationOutbox).where(NotificationOutbox.id == row.id).values(**values))
+        if exhausted:
+            failed += 1
+        else:
+            retried += 1
+    db.session.commit()
+    return DispatchResult(len(sent_ids), retried, failed)
+
+
+def drain_outbox(max_batches: Optional[int] = None) -> DispatchResult:
+    """Dispatch batches until nothing is due (or ``max_batches`` have run)."""
+    totals = DispatchResult()
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        result = dispatch_batch()
+        if result == DispatchResult():
+            break
+        totals = DispatchResult(*(total + value for total, value in zip(totals, result)))
+        batches += 1
+    return totals
+
+
+class NotificationDispatcher(threading.Thread):
+    def __init__(self, app: Flask):
+        super().__init__(name='notification-dispatcher', daemon=True)
+        self.app = app
+        self.poll_seconds = app.config.get('NOTIFY_POLL_SECONDS', 5)
+        self._wakeup = threading.Event()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def run(self) -> None:
+        while True:
+            try:
+                with self.app.app_context():
+                    for shard in each_shard(self.app):
+                        try:
+                            drain_outbox()
+                        except Exception:
+                            # One unreachable shard must not hold up delivery on the others.
+                            LOG.exception('Notification dispatcher pass failed on shard %s', shard)
+                            db.session.rollback()
+                    db.session.remove()
+            except Exception:
+                LOG.exception('Notification dispatcher pass failed')
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+
+def ensure_dispatcher(app: Flask) -> NotificationDispatcher:
+    """Start this process's dispatcher for ``app`` if it is not running yet."""
+    with _dispatcher_lock:
+        dispatcher = _dispatchers.get(id(app))
+        if dispatcher is None or not dispatcher.is_alive():
+            dispatcher = NotificationDispatcher(app)
+            dispatcher.start()
+            _dispatchers[id(app)] = dispatcher
+        return dispatcher
+
+
+def wake_dispatcher(app: Flask) -> None:
+    if app.config.get('NOTIFY_DISPATCHER_AUTOSTART', True):
+        ensure_dispatcher(app).wake()
+
+
+def _wake_after_commit(session) -> None:
+    if session.info.pop(WAKE_DISPATCHER, False) and has_app_context():
+        wake_dispatcher(current_app._get_current_object())
+
+
+def _discard_wake(session, *args) -> None:
+    session.info.pop(WAKE_DISPATCHER, None)
+
+
+def register_outbox_listeners() -> None:
+    if event.contains(db.session, 'after_commit', _wake_after_commit):
+        return
+    event.listen(db.session, 'after_commit', _wake_after_commit)
+    event.listen(db.session, 'after_soft_rollback', _discard_wake)
+
+
+outbox_cli = AppGroup('notifications', help='Deliver queued notifications.')
+
+
+@outbox_cli.command('dispatch')
+@click.option('--once', is_flag=True, help='Drain what is due now and exit.')
+def dispatch_command(once: bool) -> None:
+    """Deliver outbox notifications in the foreground."""
+    if once:
+        result = drain_outbox()
+        click.echo(f'Sent {result.sent}, retrying {result.retried}, failed {result.failed}')
+        return
+    dispatcher = NotificationDispatcher(current_app._get_current_object())
+    click.echo('Dispatching notifications; press Ctrl+C to stop')
+    dispatcher.run()
+
+
+@outbox_cli.command('prune-tokens')
+@click.option('--days', type=int, default=None, help='Drop tokens not refreshed for this many days.')
+def prune_tokens_command(days: Optional[int]) -> None:
+    """Delete push tokens whose devices have not re-registered recently."""
+    max_age = timedelta(days=days or current_app.config.get('PUSH_TOKEN_TTL_DAYS', 60))
+    pruned = prune_stale_tokens(max_age)
+    db.session.commit()
+    click.echo(f'Pruned {pruned} stale push tokens')
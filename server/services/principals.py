@@ -0,0 +1,178 @@
+"""Per-process cache of the principal behind each access token.
+
+``require_auth`` resolves a bearer token to a :class:`Principal` holding the
+staff member's role, status and account ids. A resolved token is kept for
+``AUTH_PRINCIPAL_TTL_SECONDS`` (never past the token's own ``exp``), so
+repeat requests with the same token skip both signature verification and the
+database. Commits that change a staff member's role or status, delete them,
+or add or remove an account membership drop that member's cached tokens in
+this process; other worker processes pick the change up when their entries
+expire, so the TTL bounds how stale a role can be anywhere. Requests pinned
+to an account's shard cache under a per-shard key, since every shard keeps
+its own copy of the member and their memberships.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Optional
+
+from flask import Flask, current_app, has_app_context
+from sqlalchemy import event, inspect, select
+
+from ..database import DEFAULT_SHARD, current_shard, db
+from ..models import AccountGroup, StaffMember, staff_account_association
+
+PENDING_STAFF = 'principal_invalidations'
+ALL_STAFF = '*'
+
+
+class Principal(NamedTuple):
+    id: str
+    role: str
+    status: str
+    account_ids: frozenset
+    # Each shard holds its own copy of a staff member with that shard's memberships.
+    shard: str = DEFAULT_SHARD
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self._tokens_by_staff: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._drop(token)
+                return None
+            return principal
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, time.monotonic() + token_exp - time.time())
+        with self._lock:
+            self._drop(token)
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+            self._entries[token] = (principal, expires_at)
+            self._tokens_by_staff.setdefault(principal.id, set()).add(token)
+
+    def invalidate(self, staff_ids: Iterable[str]) -> None:
+        with self._lock:
+            for staff_id in staff_ids:
+                for token in self._tokens_by_staff.pop(staff_id, ()):
+                    self._entries.pop(token, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_staff.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_staff.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_staff[entry[0].id]
+
+
+def principal_cache(app: Flask) -> PrincipalCache:
+    cache = app.extensions.get('principal_cache')
+    if cache is None:
+        cache = app.extensions.setdefault(
+            'principal_cache',
+            PrincipalCache(
+                app.config.get('AUTH_PRINCIPAL_TTL_SECONDS', 30),
+                app.config.get('AUTH_PRINCIPAL_CACHE_SIZE', 10000),
+            ),
+        )
+    return cache
+
+
+def load_principal(staff_id: str) -> Optional[Principal]:
+    """Role, status and account ids for one staff member in a single round-trip."""
+    rows = db.session.execute(
+        select(StaffMember.id, StaffMember.role, StaffMember.status, staff_account_association.c.account_group_id)
+        .outerjoin(staff_account_association, staff_account_association.c.staff_id == StaffMember.id)
+        .where(StaffMember.id == staff_id)
+    ).all()
+    if not rows:
+        return None
+    first = rows[0]
+    return Principal(
+        first.id,
+        first.role,
+        first.status,
+        frozenset(row.account_group_id for row in rows if row.account_group_id),
+        current_shard(),
+    )
+
+
+def invalidate_principals(staff_ids: Iterable[str]) -> None:
+    """Drop the given members' cached tokens once the current transaction commits."""
+    db.session.info.setdefault(PENDING_STAFF, set()).update(staff_ids)
+
+
+def _collect_changes(session, flush_context) -> None:
+    pending = session.info.setdefault(PENDING_STAFF, set())
+    for obj in session.deleted:
+        if isinstance(obj, StaffMember):
+            pending.add(obj.id)
+        elif isinstance(obj, AccountGroup):
+            pending.add(ALL_STAFF)
+    for obj in session.dirty:
+        state = inspect(obj)
+        if isinstance(obj, StaffMember):
+            attrs = state.attrs
+            if (
+                attrs.role.history.has_changes()
+                or attrs.status.history.has_changes()
+                or attrs.accounts.history.has_changes()
+            ):
+                pending.add(obj.id)
+        elif isinstance(obj, AccountGroup):
+            added, _, deleted = state.attrs.staff.history
+            pending.update(member.id for member in (*added, *deleted) if member.id)
+    if not pending:
+        session.info.pop(PENDING_STAFF, None)
+
+
+def _invalidate_after_commit(session) -> None:
+    staff_ids = session.info.pop(PENDING_STAFF, None)
+    if not staff_ids or not has_app_context():
+        return
+    cache = principal_cache(current_app._get_current_object())
+    if ALL_STAFF in staff_ids:
+        cache.clear()
+    else:
+        cache.invalidate(staff_ids)
+
+
+def _discard_pending(session, *args) -> None:
+    session.info.pop(PENDING_STAFF, None)
+
+
+def register_principal_listeners() -> None:
+    if event.contains(db.session, 'after_flush', _collect_changes):
+        return
+    event.listen(db.session, 'after_flush', _collect_changes)
+    event.listen(db.session, 'after_commit', _invalidate_after_commit)
+    event.listen(db.session, 'after_soft_rollback', _discard_pending)
@@ -0,0 +1,134 @@
+"""Push-token registry and push transports.
+
+Tokens are upserted on registration, so a device re-registering (or moving to
+another staff member) updates its row instead of adding a duplicate. Tokens
+the transport reports as unregistered are deleted as soon as a send learns
+about them; tokens not refreshed within ``PUSH_TOKEN_TTL_DAYS`` are pruned by
+``flask notifications prune-tokens``.
+
+``PUSH_TRANSPORT`` picks the transport: ``log`` (the default), ``local`` for
+the in-memory stub, or ``package.module:ClassName`` for a provider adapter.
+A transport's ``send_multicast(tokens, message)`` delivers one message to up
+to ``PUSH_BATCH_SIZE`` devices in a single call and returns an error (or
+None) per token, using :data:`UNREGISTERED` for tokens that are gone for good.
+"""
+from __future__ import annotations
+
+import importlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Sequence
+
+from flask import Flask
+from sqlalchemy import delete, select
+
+from ..database import db, dialect_insert
+from ..models import PushToken
+from .mail import DEFAULT_SUBJECT, EMAIL_SUBJECTS
+from .sharding import staff_written
+
+LOG = logging.getLogger('staffmonitr.push')
+
+UNREGISTERED = 'unregistered'
+PUSH_BODIES = {
+    'shift_update': 'A shift you are assigned to changed.',
+    'assignment_change': 'One of your assignments changed.',
+    'open_shift': 'An open shift is available to claim.',
+}
+
+
+class PushMessage(NamedTuple):
+    title: str
+    body: str
+    data: dict
+
+
+def render_push(subject_key: str, payload: dict, event_count: int = 1) -> PushMessage:
+    title = EMAIL_SUBJECTS.get(subject_key, DEFAULT_SUBJECT)
+    if event_count > 1:
+        title = f'{title} ({event_count} updates)'
+    body = PUSH_BODIES.get(subject_key, title)
+    return PushMessage(title, body, {key: str(value) for key, value in payload.items()})
+
+
+def register_token(staff_id: str, token: str, platform: Optional[str] = None) -> None:
+    statement = dialect_insert(PushToken.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['token'],
+        set_={
+            'staff_id': statement.excluded.staff_id,
+            'platform': statement.excluded.platform,
+            'last_seen_at': statement.excluded.last_seen_at,
+        },
+    )
+    db.session.execute(
+        statement,
+        {'staff_id': staff_id, 'token': token, 'platform': platform, 'last_seen_at': datetime.utcnow()},
+    )
+    staff_written([staff_id])
+
+
+def forget_tokens(tokens: Sequence[str]) -> int:
+    if not tokens:
+        return 0
+    staff_written(db.session.execute(select(PushToken.staff_id).where(PushToken.token.in_(tokens))).scalars())
+    return db.session.execute(delete(PushToken).where(PushToken.token.in_(tokens))).rowcount
+
+
+def prune_stale_tokens(max_age: timedelta) -> int:
+    cutoff = datetime.utcnow() - max_age
+    return db.session.execute(delete(PushToken).where(PushToken.last_seen_at < cutoff)).rowcount
+
+
+class LogPushTransport:
+    def send_multicast(self, tokens: Sequence[str], message: PushMessage) -> list[Optional[str]]:
+        LOG.info('Sending push to %d devices | %s', len(tokens), message.title)
+        return [None] * len(tokens)
+
+
+class LocalPushGateway:
+    """Push stand-in that records each multicast call instead of delivering it.
+
+    Tokens in ``unregistered`` are reported as gone, tokens in ``unavailable``
+    fail transiently, and ``offline`` fails whole calls.
+    """
+
+    def __init__(self):
+        self.calls: list[tuple[list[str], PushMessage]] = []
+        self.unregistered: set[str] = set()
+        self.unavailable: set[str] = set()
+        self.offline = False
+        self._lock = threading.Lock()
+
+    def send_multicast(self, tokens: Sequence[str], message: PushMessage) -> list[Optional[str]]:
+        if self.offline:
+            raise ConnectionRefusedError('local push gateway is offline')
+        with self._lock:
+            self.calls.append((list(tokens), message))
+        results: list[Optional[str]] = []
+        for token in tokens:
+            if token in self.unregistered:
+                results.append(UNREGISTERED)
+            elif token in self.unavailable:
+                results.append('unavailable')
+            else:
+                results.append(None)
+        return results
+
+
+def get_push_transport(app: Flask):
+    transport = app.extensions.get('push_transport')
+    if transport is None:
+        kind = app.config.get('PUSH_TRANSPORT', 'log')
+        if kind == 'log':
+            transport = LogPushTransport()
+        elif kind == 'local':
+            transport = LocalPushGateway()
+        elif ':' in kind:
+            module_name, class_name = kind.split(':', 1)
+            transport = getattr(importlib.import_module(module_name), class_name)()
+        else:
+            raise ValueError(f'Unknown PUSH_TRANSPORT {kind!r}')
+        app.extensions['push_transport'] = transport
+    return transport
@@ -0,0 +1,183 @@
+"""Kid-ratio staffing engine.
+
+Each kid carries its parsed ratio in ``ratio_staff``/``ratio_kids``. The staff
+a shift needs is derived per ratio group (kids with a personal trainer need
+one staff member each; every other group of ``n`` kids at ``s:k`` needs
+``ceil(n * s / k)``) and compared with the distinct staff and leads assigned.
+All of that is computed with grouped SQL over the whole window, so a request
+costs a handful of set-based queries regardless of how many shifts it spans.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, distinct, func, or_, select, update
+
+from ..database import db
+from ..models import Assignment, Kid, Shift, StaffMember
+from ..utils.ratios import parse_ratio
+
+LEAD_ROLES = ('Lead', 'Assistant Lead')
+
+
+class ShiftRatio(NamedTuple):
+    shift_id: str
+    account_group_id: str
+    site: str
+    start_time: datetime
+    kids: int
+    required_staff: int
+    assigned_staff: int
+    leads_required: int
+    assigned_leads: int
+
+    @property
+    def staff_gap(self) -> int:
+        return max(self.required_staff - self.assigned_staff, 0)
+
+    @property
+    def lead_gap(self) -> int:
+        return max(self.leads_required - self.assigned_leads, 0)
+
+    @property
+    def compliant(self) -> bool:
+        return not (self.staff_gap or self.lead_gap)
+
+
+def _window_criteria(account_id: Optional[str], start: Optional[datetime], end: Optional[datetime]) -> list:
+    criteria = []
+    if account_id:
+        criteria.append(Shift.account_group_id == account_id)
+    if start:
+        criteria.append(Shift.start_time >= start)
+    if end:
+        criteria.append(Shift.start_time < end)
+    return criteria
+
+
+def evaluate_shift_ratios(
+    account_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    gaps_only: bool = False,
+) -> list[ShiftRatio]:
+    """Evaluate every shift in the window; ``gaps_only`` filters compliant shifts out in SQL."""
+    criteria = _window_criteria(account_id, start, end)
+    shift_ids = select(Shift.id).where(*criteria)
+
+    personal = func.coalesce(Kid.requires_personal_trainer, False)
+    ratio_groups = (
+        select(
+            Kid.shift_id,
+            Kid.ratio_staff,
+            Kid.ratio_kids,
+            personal.label('personal'),
+            func.count().label('kids'),
+        )
+        .where(Kid.shift_id.in_(shift_ids))
+        .group_by(Kid.shift_id, Kid.ratio_staff, Kid.ratio_kids, personal)
+        .subquery()
+    )
+    # Integer ceil(n * s / k) without relying on a dialect-specific CEIL.
+    group_need = case(
+        (ratio_groups.c.personal, ratio_groups.c.kids),
+        else_=(ratio_groups.c.kids * ratio_groups.c.ratio_staff + ratio_groups.c.ratio_kids - 1)
+        // ratio_groups.c.ratio_kids,
+    )
+    kid_need = (
+        select(
+            ratio_groups.c.shift_id,
+            func.sum(ratio_groups.c.kids).label('kids'),
+            func.sum(group_need).label('required'),
+        )
+        .group_by(ratio_groups.c.shift_id)
+        .subquery()
+    )
+    staffing = (
+        select(
+            Assignment.shift_id,
+            func.count(distinct(Assignment.staff_id)).label('staff'),
+            func.count(distinct(case((StaffMember.role.in_(LEAD_ROLES), Assignment.staff_id)))).label('leads'),
+        )
+        .outerjoin(StaffMember, StaffMember.id == Assignment.staff_id)
+        .where(Assignment.shift_id.in_(shift_ids))
+        .group_by(Assignment.shift_id)
+        .subquery()
+    )
+    kid_required = func.coalesce(kid_need.c.required, 0)
+    ratio_min = func.coalesce(Shift.ratio_min, 0)
+    required = case((kid_required > ratio_min, kid_required), else_=ratio_min)
+    staffed = func.coalesce(staffing.c.staff, 0)
+    leads_required = func.coalesce(Shift.leads_required, 0)
+    leads = func.coalesce(staffing.c.leads, 0)
+    statement = (
+        select(
+            Shift.id,
+            Shift.account_group_id,
+            Shift.site,
+            Shift.start_time,
+            func.coalesce(kid_need.c.kids, 0).label('kids'),
+            required.label('required'),
+            staffed.label('staff'),
+            leads_required.label('leads_required'),
+            leads.label('leads'),
+        )
+        .outerjoin(kid_need, kid_need.c.shift_id == Shift.id)
+        .outerjoin(staffing, staffing.c.shift_id == Shift.id)
+        .where(*criteria)
+        .order_by(Shift.start_time, Shift.id)
+    )
+    if gaps_only:
+        statement = statement.where(or_(required > staffed, leads_required > leads))
+    return [ShiftRatio(*row) for row in db.session.execute(statement)]
+
+
+def count_shifts(
+    account_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> int:
+    return db.session.execute(
+        select(func.count(Shift.id)).where(*_window_criteria(account_id, start, end))
+    ).scalar_one()
+
+
+def ratio_gap_payload(ratio: ShiftRatio) -> dict:
+    return {
+        'shift_id': ratio.shift_id,
+        'account_group_id': ratio.account_group_id,
+        'site': ratio.site,
+        'start_time': ratio.start_time.isoformat(),
+        'kids': ratio.kids,
+        'requiredStaff': ratio.required_staff,
+        'assignedStaff': ratio.assigned_staff,
+        'staffGap': ratio.staff_gap,
+        'leadsRequired': ratio.leads_required,
+        'assignedLeads': ratio.assigned_leads,
+        'leadGap': ratio.lead_gap,
+    }
+
+
+def backfill_kid_ratios() -> int:
+    """Populate ratio_staff/ratio_kids from the ratio strings, one UPDATE per distinct ratio."""
+    updated = 0
+    for (ratio,) in db.session.execute(select(distinct(Kid.ratio))).all():
+        staff, kids = parse_ratio(ratio)
+        result = db.session.execute(
+            update(Kid).where(Kid.ratio == ratio).values(ratio_staff=staff, ratio_kids=kids)
+        )
+        updated += result.rowcount
+    return updated
+
+
+ratios_cli = AppGroup('ratios', help='Maintain parsed kid ratios.')
+
+
+@ratios_cli.command('backfill')
+def backfill_command() -> None:
+    updated = backfill_kid_ratios()
+    db.session.commit()
+    click.echo(f'Parsed ratios for {updated} kids')
@@ -0,0 +1,166 @@
+"""Set-based queries behind the /api/reports endpoints."""
+from __future__ import annotations
+
+from datetime import datetime, time
+from typing import Optional
+
+from sqlalchemy import case, func, select
+
+from ..database import db
+from ..models import Assignment, DailyRoleRollup, DailyShiftRollup, Shift, StaffMember
+
+GROUP_BY_PERIODS = ('day', 'week')
+HARD_DIFFICULTY = 4
+UNASSIGNED_ROLE = 'Unassigned'
+
+
+def period_bucket(column, group_by: str):
+    """Truncate a timestamp column to the start of its day or ISO week."""
+    if group_by not in GROUP_BY_PERIODS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_PERIODS)}")
+    if db.engine.dialect.name == 'sqlite':
+        if group_by == 'day':
+            return func.date(column)
+        # SQLite has no date_trunc; step forward to Sunday, then back to Monday.
+        return func.date(column, 'weekday 0', '-6 days')
+    return func.date(func.date_trunc(group_by, column))
+
+
+def _format_period(value) -> str:
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _day_aligned(*values: Optional[datetime]) -> bool:
+    return all(value is None or value.time() == time.min for value in values)
+
+
+def _raw_utilization_columns(account_id: Optional[str], since: Optional[datetime]):
+    per_shift = (
+        select(
+            Shift.id,
+            Shift.start_time,
+            func.coalesce(Shift.ratio_min, 1).label('ratio_min'),
+            func.coalesce(Shift.open_shift, False).label('open_shift'),
+            func.count(Assignment.id).label('assignment_count'),
+        )
+        .outerjoin(Assignment, Assignment.shift_id == Shift.id)
+        .group_by(Shift.id)
+    )
+    if account_id:
+        per_shift = per_shift.where(Shift.account_group_id == account_id)
+    if since:
+        per_shift = per_shift.where(Shift.start_time >= since)
+    per_shift = per_shift.subquery()
+
+    totals = [
+        func.count().label('total_shifts'),
+        func.coalesce(
+            func.sum(case((per_shift.c.ratio_min <= per_shift.c.assignment_count, 1), else_=0)), 0
+        ).label('ratio_compliant'),
+        func.coalesce(func.sum(case((per_shift.c.open_shift, 1), else_=0)), 0).label('open_shifts'),
+        func.coalesce(func.sum(per_shift.c.assignment_count), 0).label('assignments'),
+    ]
+    return per_shift.c.start_time, totals, []
+
+
+def _rollup_utilization_columns(account_id: Optional[str], since: Optional[datetime]):
+    totals = [
+        func.coalesce(func.sum(DailyShiftRollup.shift_count), 0).label('total_shifts'),
+        func.coalesce(func.sum(DailyShiftRollup.ratio_compliant_count), 0).label('ratio_compliant'),
+        func.coalesce(func.sum(DailyShiftRollup.open_shift_count), 0).label('open_shifts'),
+        func.coalesce(func.sum(DailyShiftRollup.assignment_count), 0).label('assignments'),
+    ]
+    criteria = []
+    if account_id:
+        criteria.append(DailyShiftRollup.account_group_id == account_id)
+    if since:
+        criteria.append(DailyShiftRollup.day >= since.date())
+    return DailyShiftRollup.day, totals, criteria
+
+
+def staff_utilization_summary(
+    account_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    group_by: Optional[str] = None,
+) -> dict:
+    # Day-aligned windows are answered from the rollups; anything finer falls
+    # back to aggregating the raw shift rows.
+    if _day_aligned(since):
+        period_column, totals, criteria = _rollup_utilization_columns(account_id, since)
+    else:
+        period_column, totals, criteria = _raw_utilization_columns(account_id, since)
+    if group_by:
+        bucket = period_bucket(period_column, group_by).label('period')
+        statement = select(bucket, *totals).where(*criteria).group_by(bucket).order_by(bucket)
+    else:
+        statement = select(*totals).where(*criteria)
+    rows = db.session.execute(statement).all()
+
+    def summarize(row) -> dict:
+        return {
+            'total_shifts': row.total_shifts,
+            'ratio_compliant': row.ratio_compliant,
+            'open_shifts': row.open_shifts,
+            'averages': {
+                'assignments_per_shift': round(row.assignments / (row.total_shifts or 1), 2),
+            },
+        }
+
+    if not group_by:
+        return summarize(rows[0])
+    breakdown = [{'period': _format_period(row.period), **summarize(row)} for row in rows]
+    overall = {
+        'total_shifts': sum(item['total_shifts'] for item in breakdown),
+        'ratio_compliant': sum(item['ratio_compliant'] for item in breakdown),
+        'open_shifts': sum(item['open_shifts'] for item in breakdown),
+    }
+    assignments = sum(row.assignments for row in rows)
+    overall['averages'] = {'assignments_per_shift': round(assignments / (overall['total_shifts'] or 1), 2)}
+    overall['group_by'] = group_by
+    overall['breakdown'] = breakdown
+    return overall
+
+
+def ratio_compliance_by_role(
+    account_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> dict[str, dict[str, int]]:
+    if _day_aligned(start, end):
+        statement = (
+            select(
+                DailyRoleRollup.role.label('role'),
+                func.sum(DailyRoleRollup.assignment_count).label('count'),
+                func.sum(DailyRoleRollup.hard_count).label('hard'),
+            )
+            .group_by(DailyRoleRollup.role)
+        )
+        if account_id:
+            statement = statement.where(DailyRoleRollup.account_group_id == account_id)
+        if start:
+            statement = statement.where(DailyRoleRollup.day >= start.date())
+        if end:
+            statement = statement.where(DailyRoleRollup.day < end.date())
+        return {row.role: {'count': row.count, 'hard': row.hard} for row in db.session.execute(statement)}
+
+    role = func.coalesce(StaffMember.role, UNASSIGNED_ROLE).label('role')
+    statement = (
+        select(
+            role,
+            func.count(Assignment.id).label('count'),
+            func.coalesce(
+                func.sum(case((Assignment.difficulty_rating >= HARD_DIFFICULTY, 1), else_=0)), 0
+            ).label('hard'),
+        )
+        .select_from(Assignment)
+        .join(Shift, Shift.id == Assignment.shift_id)
+        .outerjoin(StaffMember, StaffMember.id == Assignment.staff_id)
+        .group_by(role)
+    )
+    if account_id:
+        statement = statement.where(Shift.account_group_id == account_id)
+    if start:
+        statement = statement.where(Shift.start_time >= start)
+    if end:
+        statement = statement.where(Shift.start_time < end)
+    return {row.role: {'count': row.count, 'hard': row.hard} for row in db.session.execute(statement)}
@@ -0,0 +1,212 @@
+"""Per-account, per-day rollups that back the /api/reports endpoints.
+
+ORM writes to shifts, assignments and kids mark the (account, day) buckets they
+touch. A staff member's role change marks the days they are assigned on as
+well, because the role rollups group by it. Just before the transaction
+commits, those buckets are recomputed from the raw rows of that single day, so
+the rollups commit atomically with the change that caused them. Bulk Core
+inserts bypass those hooks and call ``refresh_rollups(shift_rollup_keys(...))``
+themselves; ``flask rollups rebuild`` backfills from scratch.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Iterable, Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, delete, event, func, inspect, select
+
+from ..database import db
+from ..models import Assignment, DailyRoleRollup, DailyShiftRollup, Kid, Shift, StaffMember
+from .reporting import HARD_DIFFICULTY, UNASSIGNED_ROLE, period_bucket
+
+PENDING_KEYS = 'rollup_keys'
+PENDING_SHIFT_IDS = 'rollup_shift_ids'
+PENDING_STAFF_IDS = 'rollup_staff_ids'
+
+RollupKey = tuple[str, date]
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _shift_criteria(account_id: Optional[str] = None, day: Optional[date] = None) -> list:
+    criteria = []
+    if account_id:
+        criteria.append(Shift.account_group_id == account_id)
+    if day:
+        start = datetime.combine(day, datetime.min.time())
+        criteria.extend([Shift.start_time >= start, Shift.start_time < start + timedelta(days=1)])
+    return criteria
+
+
+def _shift_rollup_rows(criteria: list) -> list[dict]:
+    shift_ids = select(Shift.id).where(*criteria)
+    assignment_counts = (
+        select(Assignment.shift_id, func.count().label('total'))
+        .where(Assignment.shift_id.in_(shift_ids))
+        .group_by(Assignment.shift_id)
+        .subquery()
+    )
+    kid_counts = (
+        select(Kid.shift_id, func.count().label('total'))
+        .where(Kid.shift_id.in_(shift_ids))
+        .group_by(Kid.shift_id)
+        .subquery()
+    )
+    assigned = func.coalesce(assignment_counts.c.total, 0)
+    day = period_bucket(Shift.start_time, 'day').label('day')
+    statement = (
+        select(
+            Shift.account_group_id,
+            day,
+            func.count(Shift.id).label('shift_count'),
+            func.sum(assigned).label('assignment_count'),
+            func.sum(case((Shift.open_shift, 1), else_=0)).label('open_shift_count'),
+            func.sum(case((func.coalesce(Shift.ratio_min, 1) <= assigned, 1), else_=0)).label('ratio_compliant_count'),
+            func.sum(func.coalesce(kid_counts.c.total, 0)).label('kid_count'),
+        )
+        .outerjoin(assignment_counts, assignment_counts.c.shift_id == Shift.id)
+        .outerjoin(kid_counts, kid_counts.c.shift_id == Shift.id)
+        .where(*criteria)
+        .group_by(Shift.account_group_id, day)
+    )
+    return [{**row._asdict(), 'day': _as_date(row.day)} for row in db.session.execute(statement)]
+
+
+def _role_rollup_rows(criteria: list) -> list[dict]:
+    day = period_bucket(Shift.start_time, 'day').label('day')
+    role = func.coalesce(StaffMember.role, UNASSIGNED_ROLE).label('role')
+    statement = (
+        select(
+            Shift.account_group_id,
+            day,
+            role,
+            func.count(Assignment.id).label('assignment_count'),
+            func.sum(case((Assignment.difficulty_rating >= HARD_DIFFICULTY, 1), else_=0)).label('hard_count'),
+        )
+        .select_from(Assignment)
+        .join(Shift, Shift.id == Assignment.shift_id)
+        .outerjoin(StaffMember, StaffMember.id == Assignment.staff_id)
+        .where(*criteria)
+        .group_by(Shift.account_group_id, day, role)
+    )
+    return [{**row._asdict(), 'day': _as_date(row.day)} for row in db.session.execute(statement)]
+
+
+def _replace_rows(
+    account_id: Optional[str], day: Optional[date], shift_rows: list[dict], role_rows: list[dict]
+) -> None:
+    for model in (DailyShiftRollup, DailyRoleRollup):
+        statement = delete(model)
+        if account_id:
+            statement = statement.where(model.account_group_id == account_id)
+        if day:
+            statement = statement.where(model.day == day)
+        db.session.execute(statement)
+    if shift_rows:
+        db.session.execute(DailyShiftRollup.__table__.insert(), shift_rows)
+    if role_rows:
+        db.session.execute(DailyRoleRollup.__table__.insert(), role_rows)
+
+
+def refresh_rollups(keys: Iterable[RollupKey]) -> None:
+    """Recompute the given (account_group_id, day) buckets from raw rows."""
+    for account_id, day in sorted(set(keys)):
+        criteria = _shift_criteria(account_id, day)
+        _replace_rows(account_id, day, _shift_rollup_rows(criteria), _role_rollup_rows(criteria))
+
+
+def rebuild_rollups(account_id: Optional[str] = None) -> int:
+    """Drop and recompute every bucket, optionally for a single account."""
+    criteria = _shift_criteria(account_id)
+    shift_rows = _shift_rollup_rows(criteria)
+    _replace_rows(account_id, None, shift_rows, _role_rollup_rows(criteria))
+    return len(shift_rows)
+
+
+def _attribute_values(obj, attribute: str) -> set:
+    history = inspect(obj).attrs[attribute].history
+    values = set(history.deleted) | {getattr(obj, attribute)}
+    return {value for value in values if value is not None}
+
+
+def _collect_pending(session, flush_context) -> None:
+    keys = session.info.setdefault(PENDING_KEYS, set())
+    shift_ids = session.info.setdefault(PENDING_SHIFT_IDS, set())
+    staff_ids = session.info.setdefault(PENDING_STAFF_IDS, set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Shift):
+            for account_id in _attribute_values(obj, 'account_group_id'):
+                for start_time in _attribute_values(obj, 'start_time'):
+                    keys.add((account_id, _as_date(start_time)))
+        elif isinstance(obj, (Assignment, Kid)):
+            shift_ids.update(_attribute_values(obj, 'shift_id'))
+        elif isinstance(obj, StaffMember) and obj not in session.new:
+            if obj in session.deleted or inspect(obj).attrs.role.history.has_changes():
+                staff_ids.add(obj.id)
+
+
+def shift_rollup_keys(shift_ids: Iterable[str]) -> set[RollupKey]:
+    shift_ids = set(shift_ids)
+    if not shift_ids:
+        return set()
+    rows = db.session.execute(
+        select(Shift.account_group_id, Shift.start_time).where(Shift.id.in_(shift_ids))
+    ).all()
+    return {(row.account_group_id, row.start_time.date()) for row in rows}
+
+
+def staff_rollup_keys(staff_ids: Iterable[str]) -> set[RollupKey]:
+    """Buckets holding assignments of the given staff members."""
+    staff_ids = set(staff_ids)
+    if not staff_ids:
+        return set()
+    rows = db.session.execute(
+        select(Shift.account_group_id, Shift.start_time)
+        .join(Assignment, Assignment.shift_id == Shift.id)
+        .where(Assignment.staff_id.in_(staff_ids))
+        .distinct()
+    ).all()
+    return {(row.account_group_id, row.start_time.date()) for row in rows}
+
+
+def _apply_pending(session) -> None:
+    session.flush()
+    keys = session.info.pop(PENDING_KEYS, set())
+    keys |= shift_rollup_keys(session.info.pop(PENDING_SHIFT_IDS, set()))
+    keys |= staff_rollup_keys(session.info.pop(PENDING_STAFF_IDS, set()))
+    if keys:
+        refresh_rollups(keys)
+
+
+def _discard_pending(session, *args) -> None:
+    session.info.pop(PENDING_KEYS, None)
+    session.info.pop(PENDING_SHIFT_IDS, None)
+    session.info.pop(PENDING_STAFF_IDS, None)
+
+
+def register_rollup_listeners() -> None:
+    if event.contains(db.session, 'after_flush', _collect_pending):
+        return
+    event.listen(db.session, 'after_flush', _collect_pending)
+    event.listen(db.session, 'before_commit', _apply_pending)
+    event.listen(db.session, 'after_soft_rollback', _discard_pending)
+
+
+rollups_cli = AppGroup('rollups', help='Maintain the report rollup tables.')
+
+
+@rollups_cli.command('rebuild')
+@click.option('--account-id', default=None, help='Only rebuild buckets for this account group.')
+def rebuild_command(account_id: Optional[str]) -> None:
+    buckets = rebuild_rollups(account_id)
+    db.session.commit()
+    click.echo(f'Rebuilt {buckets} daily rollup buckets')
@@ -0,0 +1,622 @@
+"""Tenant sharding: which database holds each account group, and routing to it.
+
+Every shard carries the full schema and holds everything that belongs to the
+account groups placed on it, including copies of their staff members. A
+commit that changes a staff member (name, email, role, status, password or
+push tokens) copies the member's row and tokens to every other shard that
+holds a copy, so sign-in and token resolution see the same member wherever
+they find it; sign-in and ``/api/auth/me`` list the memberships of every
+copy. The default database (``DATABASE_URL``) is the shard named ``default``
+and also holds the ``account_shards`` directory; accounts without a row there
+live on the default shard. Extra shards come from ``DATABASE_SHARD_URLS``.
+
+A request is pinned to the shard of the account it addresses: the
+``account_id`` URL or query parameter, the ``X-Account-Id`` header, or the
+``account_group_id``/``account_id`` field of a JSON body. A request that only
+names a row of its own -- a ``shift_id``, ``assignment_id`` or ``job_id`` in
+the URL, a ``shift_id`` or ``assignment_id`` in the JSON body, or the
+``assignment_id`` of the first of its ``points`` -- is routed to the account
+that owns the row, found by looking it up on each shard in turn. Requests
+that name neither run on the default shard, except that sign-in and token
+resolution go on to search the other shards for the staff member. Listings
+across every account (``GET /api/accounts``, open shifts without
+``account_id``) only see the default shard. Each process caches the directory
+for ``SHARD_MAP_TTL_SECONDS``.
+
+``flask shards move`` relocates one account group. It marks the account
+``moving``, so writes addressed to it or to its rows get 503 until the move
+ends, and waits one map TTL for every process to see that; background writers
+(the import runner, the check-in flusher and the outbox dispatcher) leave a
+moving account's rows alone for as long. It then copies the tenant's rows to
+the target in ``SHARD_MOVE_BATCH_SIZE`` batches and points the directory at
+the target. After a second TTL for readers still on the old entry, it deletes
+the rows from the source. Change-feed events are not copied: subscribers that
+reconnect are told to reset.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable, Iterator, NamedTuple, Optional, TypeVar
+
+import click
+from flask import Flask, current_app, has_app_context, jsonify, request
+from flask.cli import AppGroup
+from sqlalchemy import Table, bindparam, delete, event, exists, insert, or_, select, true, union, update
+from sqlalchemy.engine import Connection, Engine
+
+from ..database import DEFAULT_SHARD, DIRECTORY, SHARD, current_shard, db, dialect_insert, shard_bind
+from ..models import (
+    AccountGroup,
+    AccountShard,
+    Assignment,
+    ChangeEvent,
+    CheckIn,
+    DailyRoleRollup,
+    DailyShiftRollup,
+    ImportJob,
+    Invitation,
+    Kid,
+    NotificationOutbox,
+    OpenShiftRequest,
+    PresenceInterval,
+    PushToken,
+    Shift,
+    StaffMember,
+    Tombstone,
+    staff_account_association,
+)
+from .principals import principal_cache
+
+LOG = logging.getLogger('staffmonitr.sharding')
+
+ACTIVE = 'active'
+MOVING = 'moving'
+ACCOUNT_HEADER = 'X-Account-Id'
+# session.info flag: the request addressed an account, so its shard is authoritative.
+PINNED = 'shard_pinned'
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+# session.info key: staff members written in this transaction, whose other copies must follow.
+STAFF_WRITES = 'staff_writes'
+
+T = TypeVar('T')
+
+
+class ShardMoveError(ValueError):
+    pass
+
+
+class AccountMoving(RuntimeError):
+    """A background writer reached an account that started moving to another shard."""
+
+
+class ShardEntry(NamedTuple):
+    shard: str
+    state: str
+
+
+class ShardMap:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[str, ShardEntry] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def lookup(self, account_id: str) -> Optional[ShardEntry]:
+        self._refresh()
+        return self._entries.get(account_id)
+
+    def moving(self) -> frozenset:
+        self._refresh()
+        return frozenset(account_id for account_id, entry in self._entries.items() if entry.state == MOVING)
+
+    def _refresh(self) -> None:
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+        if stale:
+            self.reload()
+
+    def reload(self) -> None:
+        entries = {
+            row.account_group_id: ShardEntry(row.shard, row.state)
+            for row in db.session.execute(
+                select(AccountShard.account_group_id, AccountShard.shard, AccountShard.state)
+            )
+        }
+        with self._lock:
+            self._entries = entries
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+
+
+def shard_map(app: Flask) -> ShardMap:
+    cache = app.extensions.get('shard_map')
+    if cache is None:
+        cache = app.extensions.setdefault('shard_map', ShardMap(app.config.get('SHARD_MAP_TTL_SECONDS', 30)))
+    return cache
+
+
+def shard_names(app: Optional[Flask] = None) -> list[str]:
+    config = (app or current_app).config
+    return [DEFAULT_SHARD, *(config.get('SQLALCHEMY_SHARD_URIS') or {})]
+
+
+def account_placement(account_id: Optional[str], app: Optional[Flask] = None) -> Optional[ShardEntry]:
+    """Directory entry of ``account_id``; ``None`` for accounts on the default shard."""
+    app = app or current_app._get_current_object()
+    if not account_id or not app.config.get('SQLALCHEMY_SHARD_URIS'):
+        return None
+    return shard_map(app).lookup(account_id)
+
+
+def moving_account_ids(app: Optional[Flask] = None) -> frozenset:
+    """Accounts being moved right now, whose rows background writers must not touch."""
+    app = app or current_app._get_current_object()
+    if not app.config.get('SQLALCHEMY_SHARD_URIS'):
+        return frozenset()
+    return shard_map(app).moving()
+
+
+def outside_moves(column):
+    """Filter on an account id column that skips accounts being moved."""
+    moving = moving_account_ids()
+    if not moving:
+        return true()
+    return or_(column.is_(None), column.notin_(moving))
+
+
+def use_shard(name: Optional[str]) -> None:
+    """Route the current session's tenant tables to shard ``name``."""
+    if name and name != DEFAULT_SHARD:
+        db.session.info[SHARD] = name
+    else:
+        db.session.info.pop(SHARD, None)
+
+
+def each_shard(app: Optional[Flask] = None) -> Iterator[str]:
+    """Route the session to every shard in turn, restoring its routing afterwards."""
+    previous = current_shard()
+    try:
+        for name in shard_names(app):
+            use_shard(name)
+            yield name
+    finally:
+        use_shard(previous)
+
+
+def engine_for(name: str) -> Engine:
+    return db.engine if name == DEFAULT_SHARD else db.engines[shard_bind(name)]
+
+
+def locate(find: Callable[[], Optional[T]]) -> Optional[T]:
+    """Run ``find`` on the session's shard, then on the others unless the request is pinned.
+
+    The session stays routed to the shard where ``find`` returned something.
+    """
+    found = find()
+    if found is not None or db.session.info.get(PINNED):
+        return found
+    home = current_shard()
+    for name in shard_names():
+        if name == home:
+            continue
+        use_shard(name)
+        found = find()
+        if found is not None:
+            return found
+    use_shard(home)
+    return None
+
+
+def gather(find: Callable[[], list[T]]) -> list[T]:
+    """Concatenate what ``find`` returns on every shard, or on the pinned shard only."""
+    if db.session.info.get(PINNED):
+        return find()
+    found: list[T] = []
+    for _ in each_shard():
+        found.extend(find())
+    return found
+
+
+def addressed_account_id() -> Optional[str]:
+    account_id = (
+        (request.view_args or {}).get('account_id')
+        or request.args.get('account_id')
+        or request.headers.get(ACCOUNT_HEADER)
+    )
+    if account_id or not request.is_json:
+        return account_id
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        account_id = payload.get('account_group_id') or payload.get('account_id')
+        return account_id if isinstance(account_id, str) else None
+    return None
+
+
+def _shift_owner(shift_id: str):
+    return select(Shift.account_group_id).where(Shift.id == shift_id)
+
+
+def _assignment_owner(assignment_id: str):
+    return (
+        select(Shift.account_group_id)
+        .join(Assignment, Assignment.shift_id == Shift.id)
+        .where(Assignment.id == assignment_id)
+    )
+
+
+def _job_owner(job_id: str):
+    return select(ImportJob.account_group_id).where(ImportJob.id == job_id)
+
+
+# Rows a request may name instead of its account, and how to find their owner.
+ROW_OWNERS = {'shift_id': _shift_owner, 'assignment_id': _assignment_owner, 'job_id': _job_owner}
+
+
+def addressed_row() -> Optional[tuple[str, str]]:
+    """The ``(kind, id)`` of the row a request names in its URL or JSON body, if any."""
+    view_args = request.view_args or {}
+    for name in ROW_OWNERS:
+        if view_args.get(name):
+            return name, view_args[name]
+    payload = request.get_json(silent=True) if request.is_json else None
+    if isinstance(payload, dict):
+        points = payload.get('points')
+        # Check-in batches are routed by their first ping's assignment.
+        if isinstance(points, list) and points and isinstance(points[0], dict):
+            payload = points[0]
+        for name in ('shift_id', 'assignment_id'):
+            value = payload.get(name)
+            if isinstance(value, str) and value:
+                return name, value
+    return None
+
+
+def row_account_id(kind: str, row_id: str) -> Optional[str]:
+    """Account that owns the row, looked up on every shard until one has it."""
+    statement = ROW_OWNERS[kind](row_id)
+    for _ in each_shard():
+        account_id = db.session.execute(statement).scalar()
+        if account_id:
+            return account_id
+    return None
+
+
+def route_request():
+    # Sessions can outlive a request (the test client shares one), so start unrouted.
+    db.session.info.pop(PINNED, None)
+    use_shard(DEFAULT_SHARD)
+    account_id = addressed_account_id()
+    if not account_id:
+        row = addressed_row()
+        account_id = row_account_id(*row) if row else None
+    if not account_id:
+        return None
+    entry = shard_map(current_app._get_current_object()).lookup(account_id)
+    if entry is not None:
+        if entry.state == MOVING and request.method not in SAFE_METHODS:
+            return (
+                jsonify({'error': 'Account is being moved to another database, retry shortly'}),
+                503,
+                {'Retry-After': '5'},
+            )
+        use_shard(entry.shard)
+    db.session.info[PINNED] = True
+    return None
+
+
+def staff_written(staff_ids) -> None:
+    """Copy these staff members to their other shards once the transaction commits.
+
+    Flushed changes to ``StaffMember`` objects are picked up on their own; call
+    this after Core statements that write staff rows or push tokens.
+    """
+    db.session.info.setdefault(STAFF_WRITES, set()).update(staff_id for staff_id in staff_ids if staff_id)
+
+
+def sync_staff_copies(staff_ids, source: str) -> int:
+    """Overwrite other shards' copies of the staff members with ``source``'s rows and push tokens.
+
+    Members deleted on ``source`` are left alone elsewhere, where they may still
+    belong to accounts. Returns the number of copies updated.
+    """
+    ids = sorted(staff_ids)
+    staff_table, token_table = StaffMember.__table__, PushToken.__table__
+    with engine_for(source).connect() as connection:
+        rows = {
+            row['id']: dict(row)
+            for row in connection.execute(select(staff_table).where(staff_table.c.id.in_(ids))).mappings()
+        }
+        tokens = [
+            dict(row)
+            for row in connection.execute(select(token_table).where(token_table.c.staff_id.in_(rows))).mappings()
+        ]
+    if not rows:
+        return 0
+    copy_staff = update(staff_table).where(staff_table.c.id == bindparam('copy_id'))
+    updated = 0
+    for name in shard_names():
+        if name == source:
+            continue
+        with engine_for(name).begin() as connection:
+            held = connection.execute(select(staff_table.c.id).where(staff_table.c.id.in_(rows))).scalars().all()
+            if not held:
+                continue
+            copies = [
+                {**{key: value for key, value in rows[staff_id].items() if key != 'id'}, 'copy_id': staff_id}
+                for staff_id in held
+            ]
+            connection.execute(copy_staff, copies)
+            held_tokens = [token for token in tokens if token['staff_id'] in held]
+            connection.execute(
+                delete(token_table).where(
+                    or_(
+                        token_table.c.staff_id.in_(held),
+                        token_table.c.token.in_([token['token'] for token in held_tokens]),
+                    )
+                )
+            )
+            if held_tokens:
+                connection.execute(insert(token_table), held_tokens)
+            updated += len(held)
+    return updated
+
+
+def _collect_staff_writes(session, flush_context) -> None:
+    written = {
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, StaffMember) and session.is_modified(obj, include_collections=False)
+    }
+    if written:
+        session.info.setdefault(STAFF_WRITES, set()).update(written)
+
+
+def _sync_after_commit(session) -> None:
+    staff_ids = session.info.pop(STAFF_WRITES, None)
+    if not staff_ids or not has_app_context() or not current_app.config.get('SQLALCHEMY_SHARD_URIS'):
+        return
+    try:
+        sync_staff_copies(staff_ids, session.info.get(SHARD) or DEFAULT_SHARD)
+    except Exception:
+        # The commit stands; the copies catch up on the member's next write.
+        LOG.exception('Could not copy staff members %s to their other shards', sorted(staff_ids))
+
+
+def _discard_staff_writes(session, *args) -> None:
+    session.info.pop(STAFF_WRITES, None)
+
+
+def register_shard_routing(app: Flask) -> None:
+    if not app.config.get('SQLALCHEMY_SHARD_URIS'):
+        return
+    app.before_request(route_request)
+    if event.contains(db.session, 'after_flush', _collect_staff_writes):
+        return
+    event.listen(db.session, 'after_flush', _collect_staff_writes)
+    event.listen(db.session, 'after_commit', _sync_after_commit)
+    event.listen(db.session, 'after_soft_rollback', _discard_staff_writes)
+
+
+class MoveStep(NamedTuple):
+    table: Table
+    where: Callable[[str, list[str]], object]
+    # Integer-keyed rows get fresh ids on the target; shared rows may already be there.
+    renumber: bool = False
+    shared: bool = False
+
+
+def _shift_ids(account_id: str):
+    return select(Shift.id).where(Shift.account_group_id == account_id)
+
+
+def _assignment_ids(account_id: str):
+    return select(Assignment.id).where(Assignment.shift_id.in_(_shift_ids(account_id)))
+
+
+# Parents before children; purges run it in reverse.
+MOVE_PLAN = [
+    MoveStep(AccountGroup.__table__, lambda account_id, staff_ids: AccountGroup.id == account_id),
+    MoveStep(StaffMember.__table__, lambda account_id, staff_ids: StaffMember.id.in_(staff_ids), shared=True),
+    MoveStep(
+        staff_account_association,
+        lambda account_id, staff_ids: staff_account_association.c.account_group_id == account_id,
+    ),
+    MoveStep(PushToken.__table__, lambda account_id, staff_ids: PushToken.staff_id.in_(staff_ids), shared=True),
+    MoveStep(Shift.__table__, lambda account_id, staff_ids: Shift.account_group_id == account_id),
+    MoveStep(Assignment.__table__, lambda account_id, staff_ids: Assignment.shift_id.in_(_shift_ids(account_id))),
+    MoveStep(Kid.__table__, lambda account_id, staff_ids: Kid.account_group_id == account_id),
+    MoveStep(
+        OpenShiftRequest.__table__,
+        lambda account_id, staff_ids: OpenShiftRequest.shift_id.in_(_shift_ids(account_id)),
+    ),
+    MoveStep(Invitation.__table__, lambda account_id, staff_ids: Invitation.account_group_id == account_id),
+    MoveStep(DailyShiftRollup.__table__, lambda account_id, staff_ids: DailyShiftRollup.account_group_id == account_id),
+    MoveStep(DailyRoleRollup.__table__, lambda account_id, staff_ids: DailyRoleRollup.account_group_id == account_id),
+    MoveStep(ImportJob.__table__, lambda account_id, staff_ids: ImportJob.account_group_id == account_id),
+    MoveStep(
+        NotificationOutbox.__table__,
+        lambda account_id, staff_ids: NotificationOutbox.account_group_id == account_id,
+    ),
+    MoveStep(
+        Tombstone.__table__,
+        lambda account_id, staff_ids: Tombstone.account_group_id == account_id,
+        renumber=True,
+    ),
+    MoveStep(
+        CheckIn.__table__,
+        lambda account_id, staff_ids: CheckIn.assignment_id.in_(_assignment_ids(account_id)),
+        renumber=True,
+    ),
+    MoveStep(
+        PresenceInterval.__table__,
+        lambda account_id, staff_ids: PresenceInterval.shift_id.in_(_shift_ids(account_id)),
+        renumber=True,
+    ),
+]
+
+
+class MoveReport(NamedTuple):
+    source: str
+    target: str
+    rows: dict[str, int]
+
+
+def _tenant_staff(account_id: str):
+    """Members of the account plus anyone its shifts reference, so foreign keys hold on the target."""
+    shift_ids = _shift_ids(account_id)
+    return union(
+        select(staff_account_association.c.staff_id).where(
+            staff_account_association.c.account_group_id == account_id
+        ),
+        select(Assignment.staff_id).where(Assignment.shift_id.in_(shift_ids), Assignment.staff_id.isnot(None)),
+        select(OpenShiftRequest.staff_id).where(
+            OpenShiftRequest.shift_id.in_(shift_ids), OpenShiftRequest.staff_id.isnot(None)
+        ),
+    )
+
+
+def _copy(
+    source: Connection, target: Connection, step: MoveStep, account_id: str, staff_ids: list[str], batch_size: int
+) -> int:
+    result = source.execution_options(yield_per=batch_size).execute(
+        select(step.table).where(step.where(account_id, staff_ids)).order_by(*step.table.primary_key.columns)
+    )
+    statement = (
+        dialect_insert(step.table, target.engine).on_conflict_do_nothing() if step.shared else insert(step.table)
+    )
+    copied = 0
+    for rows in result.mappings().partitions():
+        values = [dict(row) for row in rows]
+        if step.renumber:
+            for value in values:
+                del value['id']
+        target.execute(statement, values)
+        copied += len(values)
+    return copied
+
+
+def _purge(connection: Connection, account_id: str, staff_ids: list[str]) -> None:
+    """Delete the tenant's rows, and its staff copies nothing else on this shard refers to."""
+    connection.execute(delete(ChangeEvent.__table__).where(ChangeEvent.account_group_id == account_id))
+    for step in reversed(MOVE_PLAN):
+        if not step.shared:
+            connection.execute(delete(step.table).where(step.where(account_id, staff_ids)))
+    orphaned = connection.execute(
+        select(StaffMember.id).where(
+            StaffMember.id.in_(staff_ids),
+            ~exists().where(staff_account_association.c.staff_id == StaffMember.id),
+            ~exists().where(Assignment.staff_id == StaffMember.id),
+            ~exists().where(OpenShiftRequest.staff_id == StaffMember.id),
+        )
+    ).scalars().all()
+    if orphaned:
+        connection.execute(delete(PushToken.__table__).where(PushToken.staff_id.in_(orphaned)))
+        connection.execute(delete(StaffMember.__table__).where(StaffMember.id.in_(orphaned)))
+
+
+def _set_entry(account_id: str, shard: str, state: str) -> None:
+    entry = db.session.get(AccountShard, account_id)
+    if shard == DEFAULT_SHARD and state == ACTIVE:
+        if entry is not None:
+            db.session.delete(entry)
+    else:
+        if entry is None:
+            entry = AccountShard(account_group_id=account_id)
+            db.session.add(entry)
+        entry.shard, entry.state = shard, state
+    db.session.commit()
+    shard_map(current_app._get_current_object()).invalidate()
+
+
+def move_account(account_id: str, target: str, settle_seconds: Optional[float] = None) -> MoveReport:
+    """Relocate one account group's rows to shard ``target`` and repoint the directory.
+
+    Safe to re-run after an interruption: leftovers on the target are purged
+    before copying, and the directory only changes once the copy committed.
+    """
+    app = current_app._get_current_object()
+    if target not in shard_names(app):
+        raise ShardMoveError(f'Unknown shard {target!r}')
+    entry = db.session.get(AccountShard, account_id)
+    source = entry.shard if entry is not None else DEFAULT_SHARD
+    if source == target:
+        raise ShardMoveError(f'Account {account_id} already lives on shard {target!r}')
+    source_engine, target_engine = engine_for(source), engine_for(target)
+    with source_engine.connect() as connection:
+        if connection.execute(select(AccountGroup.id).where(AccountGroup.id == account_id)).first() is None:
+            raise ShardMoveError(f'Account {account_id} not found on shard {source!r}')
+    settle = app.config.get('SHARD_MAP_TTL_SECONDS', 30) if settle_seconds is None else settle_seconds
+    batch_size = app.config.get('SHARD_MOVE_BATCH_SIZE', 1000)
+
+    _set_entry(account_id, source, MOVING)
+    time.sleep(settle)
+    rows: dict[str, int] = {}
+    try:
+        with source_engine.connect() as source_connection, target_engine.begin() as target_connection:
+            staff_ids = source_connection.execute(_tenant_staff(account_id)).scalars().all()
+            _purge(target_connection, account_id, staff_ids)
+            for step in MOVE_PLAN:
+                rows[step.table.name] = _copy(
+                    source_connection, target_connection, step, account_id, staff_ids, batch_size
+                )
+    except Exception:
+        _set_entry(account_id, source, ACTIVE)
+        raise
+    _set_entry(account_id, target, ACTIVE)
+    # Cached principals remember the shard their staff member was found on.
+    principal_cache(app).clear()
+    time.sleep(settle)
+    with source_engine.begin() as connection:
+        _purge(connection, account_id, staff_ids)
+    return MoveReport(source, target, rows)
+
+
+def init_shards() -> list[str]:
+    """Create missing tables on every shard but the default one; returns their names."""
+    tables = [table for table in db.metadata.sorted_tables if not table.info.get(DIRECTORY)]
+    names = shard_names()[1:]
+    for name in names:
+        db.metadata.create_all(engine_for(name), tables=tables)
+    return names
+
+
+shards_cli = AppGroup('shards', help='Place account groups on shard databases.')
+
+
+@shards_cli.command('init')
+def init_command() -> None:
+    """Create any missing tables on every configured shard."""
+    for name in init_shards():
+        click.echo(f'Initialised shard {name}')
+
+
+@shards_cli.command('list')
+def list_command() -> None:
+    """Show the account groups placed off the default shard."""
+    entries = db.session.execute(select(AccountShard).order_by(AccountShard.shard, AccountShard.account_group_id))
+    for entry in entries.scalars():
+        click.echo(f'{entry.account_group_id}\t{entry.shard}\t{entry.state}')
+
+
+@shards_cli.command('move')
+@click.argument('account_id')
+@click.argument('target')
+@click.option(
+    '--settle-seconds',
+    type=float,
+    default=None,
+    help='How long to wait for cached shard maps to expire (default: SHARD_MAP_TTL_SECONDS).',
+)
+def move_command(account_id: str, target: str, settle_seconds: Optional[float]) -> None:
+    """Move ACCOUNT_ID's rows to shard TARGET."""
+    try:
+        report = move_account(account_id, target, settle_seconds)
+    except ShardMoveError as exc:
+        raise click.ClickException(str(exc)) from exc
+    copied = ', '.join(f'{count} {table}' for table, count in report.rows.items() if count)
+    click.echo(f'Moved {account_id} from {report.source} to {report.target} ({copied or "no rows"})')
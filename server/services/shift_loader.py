@@ -0,0 +1,103 @@
+"""Batch loading of shift trees in a fixed number of flat queries.
+
+The shift listings used to chain ``joinedload`` across assignments, assignment
+kids and shift kids, which multiplies rows per shift. Here each table is read
+once, keyed by id, and grouped in Python so the query count stays constant no
+matter how many shifts are selected.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import NamedTuple
+
+from sqlalchemy import Select, or_, select
+from sqlalchemy.engine import Row
+
+from ..database import db
+from ..models import Assignment, Kid, Shift, StaffMember
+
+SHIFT_COLUMNS = (
+    Shift.id,
+    Shift.account_group_id,
+    Shift.site,
+    Shift.start_time,
+    Shift.end_time,
+    Shift.ratio_min,
+    Shift.leads_required,
+    Shift.difficulty,
+    Shift.is_special,
+    Shift.open_shift,
+)
+
+ASSIGNMENT_COLUMNS = (
+    Assignment.id,
+    Assignment.shift_id,
+    Assignment.staff_id,
+    Assignment.title,
+    Assignment.difficulty_rating,
+    Assignment.instructions,
+    Assignment.requires_one_on_one,
+    StaffMember.role.label('staff_role'),
+)
+
+KID_COLUMNS = (
+    Kid.id,
+    Kid.full_name,
+    Kid.ratio,
+    Kid.requires_personal_trainer,
+    Kid.special_instructions,
+    Kid.banned_staff,
+    Kid.shift_id,
+    Kid.assignment_id,
+    Kid.account_group_id,
+)
+
+
+class ShiftBatch(NamedTuple):
+    shifts: list[Row]
+    assignments_by_shift: dict[str, list[Row]]
+    kids_by_shift: dict[str, list[Row]]
+    kids_by_assignment: dict[str, list[Row]]
+
+
+def shift_select() -> Select:
+    """Base select for shift rows; callers add filters, ordering and limits."""
+    return select(*SHIFT_COLUMNS)
+
+
+def load_shift_batch(shift_query: Select) -> ShiftBatch:
+    """Run ``shift_query`` and fetch its assignments, staff roles and kids.
+
+    Issues exactly three queries. Child tables are filtered with the shift
+    query itself as a subquery, so no id lists are bound as parameters.
+    """
+    shifts = db.session.execute(shift_query).all()
+    if not shifts:
+        return ShiftBatch([], {}, {}, {})
+
+    shift_ids = shift_query.with_only_columns(Shift.id)
+    assignment_rows = db.session.execute(
+        select(*ASSIGNMENT_COLUMNS)
+        .outerjoin(StaffMember, StaffMember.id == Assignment.staff_id)
+        .where(Assignment.shift_id.in_(shift_ids))
+        .order_by(Assignment.created_at, Assignment.id)
+    ).all()
+    assignment_ids = select(Assignment.id).where(Assignment.shift_id.in_(shift_ids))
+    kid_rows = db.session.execute(
+        select(*KID_COLUMNS)
+        .where(or_(Kid.shift_id.in_(shift_ids), Kid.assignment_id.in_(assignment_ids)))
+        .order_by(Kid.created_at, Kid.id)
+    ).all()
+
+    loaded_ids = {shift.id for shift in shifts}
+    assignments_by_shift: dict[str, list[Row]] = defaultdict(list)
+    for assignment in assignment_rows:
+        assignments_by_shift[assignment.shift_id].append(assignment)
+    kids_by_shift: dict[str, list[Row]] = defaultdict(list)
+    kids_by_assignment: dict[str, list[Row]] = defaultdict(list)
+    for kid in kid_rows:
+        if kid.shift_id in loaded_ids:
+            kids_by_shift[kid.shift_id].append(kid)
+        if kid.assignment_id:
+            kids_by_assignment[kid.assignment_id].append(kid)
+    return ShiftBatch(shifts, assignments_by_shift, kids_by_shift, kids_by_assignment)
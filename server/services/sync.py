@@ -0,0 +1,193 @@
+"""Delta sync of an account's shifts, assignments and kids.
+
+Clients keep the ``watermark`` from their last sync and send it back as
+``since``; they receive only rows whose ``updated_at`` moved past it, plus
+tombstones for rows deleted since. Rows are stamped at flush time but only
+become visible at commit, so each sync re-reads ``SYNC_OVERLAP_SECONDS``
+before the watermark; clients apply rows as idempotent upserts. Tombstones
+are kept for ``SYNC_TOMBSTONE_DAYS``, and a client whose watermark is older
+than that gets a full snapshot flagged with ``reset``.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, select, update
+
+from ..database import db
+from ..models import Assignment, Kid, Shift, Tombstone
+from ..utils.serializers import kid_payload
+
+TOMBSTONE_ENTITIES = {Shift: 'shifts', Assignment: 'assignments', Kid: 'kids'}
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _shift_rows(account_id: str, floor: Optional[datetime]) -> list[dict]:
+    statement = select(
+        Shift.id,
+        Shift.site,
+        Shift.start_time,
+        Shift.end_time,
+        Shift.ratio_min,
+        Shift.leads_required,
+        Shift.is_special,
+        Shift.difficulty,
+        Shift.open_shift,
+        Shift.updated_at,
+    ).where(Shift.account_group_id == account_id)
+    if floor:
+        statement = statement.where(Shift.updated_at >= floor)
+    return [
+        {
+            'id': row.id,
+            'account_group_id': account_id,
+            'site': row.site,
+            'start_time': _iso(row.start_time),
+            'end_time': _iso(row.end_time),
+            'ratio_min': row.ratio_min,
+            'leadsRequired': row.leads_required,
+            'is_special': row.is_special,
+            'difficulty': row.difficulty,
+            'openShift': row.open_shift,
+            'updated_at': _iso(row.updated_at),
+        }
+        for row in db.session.execute(statement.order_by(Shift.updated_at, Shift.id))
+    ]
+
+
+def _assignment_rows(account_id: str, floor: Optional[datetime]) -> list[dict]:
+    statement = select(
+        Assignment.id,
+        Assignment.shift_id,
+        Assignment.staff_id,
+        Assignment.title,
+        Assignment.difficulty_rating,
+        Assignment.instructions,
+        Assignment.requires_one_on_one,
+        Assignment.updated_at,
+    ).where(Assignment.shift_id.in_(select(Shift.id).where(Shift.account_group_id == account_id)))
+    if floor:
+        statement = statement.where(Assignment.updated_at >= floor)
+    return [
+        {
+            'id': row.id,
+            'shift_id': row.shift_id,
+            'staff_id': row.staff_id,
+            'title': row.title,
+            'difficulty_rating': row.difficulty_rating,
+            'instructions': row.instructions,
+            'requires_one_on_one': row.requires_one_on_one,
+            'updated_at': _iso(row.updated_at),
+        }
+        for row in db.session.execute(statement.order_by(Assignment.updated_at, Assignment.id))
+    ]
+
+
+def _kid_rows(account_id: str, floor: Optional[datetime]) -> list[dict]:
+    statement = select(
+        Kid.id,
+        Kid.full_name,
+        Kid.ratio,
+        Kid.requires_personal_trainer,
+        Kid.special_instructions,
+        Kid.banned_staff,
+        Kid.shift_id,
+        Kid.assignment_id,
+        Kid.account_group_id,
+        Kid.updated_at,
+    ).where(Kid.account_group_id == account_id)
+    if floor:
+        statement = statement.where(Kid.updated_at >= floor)
+    return [
+        {**kid_payload(row), 'updated_at': _iso(row.updated_at)}
+        for row in db.session.execute(statement.order_by(Kid.updated_at, Kid.id))
+    ]
+
+
+def sync_delta(account_id: str, since: Optional[datetime] = None) -> dict:
+    config = current_app.config
+    now = datetime.utcnow()
+    since = _as_utc(since) if since else None
+    reset = since is not None and since < now - timedelta(days=config.get('SYNC_TOMBSTONE_DAYS', 30))
+    floor = None if since is None or reset else since - timedelta(seconds=config.get('SYNC_OVERLAP_SECONDS', 5))
+
+    deleted: dict[str, list[str]] = {entity: [] for entity in TOMBSTONE_ENTITIES.values()}
+    if floor:
+        tombstones = db.session.execute(
+            select(Tombstone.entity, Tombstone.entity_id)
+            .where(Tombstone.account_group_id == account_id, Tombstone.deleted_at >= floor)
+            .order_by(Tombstone.id)
+        )
+        for entity, entity_id in tombstones:
+            deleted[entity].append(entity_id)
+    return {
+        'watermark': now.isoformat(),
+        'full': floor is None,
+        'reset': reset,
+        'shifts': _shift_rows(account_id, floor),
+        'assignments': _assignment_rows(account_id, floor),
+        'kids': _kid_rows(account_id, floor),
+        'deleted': deleted,
+    }
+
+
+def _record_tombstones(session, flush_context, instances) -> None:
+    with session.no_autoflush:
+        for obj in list(session.deleted):
+            entity = TOMBSTONE_ENTITIES.get(type(obj))
+            if entity is None:
+                continue
+            if isinstance(obj, Assignment):
+                shift = obj.shift or session.get(Shift, obj.shift_id)
+                account_id = shift.account_group_id if shift else None
+            else:
+                account_id = obj.account_group_id
+            if account_id:
+                session.add(Tombstone(entity=entity, entity_id=obj.id, account_group_id=account_id))
+
+
+def register_sync_listeners() -> None:
+    if event.contains(db.session, 'before_flush', _record_tombstones):
+        return
+    event.listen(db.session, 'before_flush', _record_tombstones)
+
+
+sync_cli = AppGroup('sync', help='Maintain delta sync metadata.')
+
+
+@sync_cli.command('backfill')
+def backfill_command() -> None:
+    """Stamp updated_at from created_at on rows written before it was set on insert."""
+    stamped = 0
+    for model in TOMBSTONE_ENTITIES:
+        result = db.session.execute(
+            update(model)
+            .where(model.updated_at.is_(None))
+            .values(updated_at=model.created_at)
+            .execution_options(synchronize_session=False)
+        )
+        stamped += result.rowcount
+    db.session.commit()
+    click.echo(f'Stamped updated_at on {stamped} rows')
+
+
+@sync_cli.command('prune')
+def prune_command() -> None:
+    """Drop tombstones older than SYNC_TOMBSTONE_DAYS."""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config.get('SYNC_TOMBSTONE_DAYS', 30))
+    pruned = db.session.execute(delete(Tombstone).where(Tombstone.deleted_at < cutoff)).rowcount
+    db.session.commit()
+    click.echo(f'Pruned {pruned} tombstones')
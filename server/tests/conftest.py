@@ -0,0 +1,11 @@
+import os
+
+# Flask-SQLAlchemy binds its engine inside create_app(), so overriding
+# SQLALCHEMY_DATABASE_URI afterwards has no effect. Point the factory at a
+# private in-memory database before the config module is imported so tests
+# never touch the checked-in instance database.
+os.environ['DATABASE_URL'] = 'sqlite://'
+# Tests drive the notification dispatcher and check-in flusher explicitly instead of racing
+# background threads on the shared in-memory connection.
+os.environ['NOTIFY_DISPATCHER_AUTOSTART'] = 'false'
+os.environ['CHECKIN_FLUSHER_AUTOSTART'] = 'false'
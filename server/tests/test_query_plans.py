@@ -0,0 +1,138 @@
+"""Query-plan regression tests for hot read paths.
+
+Each test captures the SELECTs a route issues and runs ``EXPLAIN QUERY PLAN``
+for them on SQLite. A plan step that scans a hot table without an index
+(``SCAN shifts`` rather than ``SEARCH shifts USING INDEX ...``) fails the
+test, so a dropped index or a rewritten filter that can no longer use one is
+caught before it reaches a large tenant.
+"""
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from flask_migrate import downgrade, upgrade
+from sqlalchemy import event, inspect, text
+
+from server.app import create_app
+from server.database import db
+from server.models import AccountGroup, Assignment, Kid, Shift, StaffMember
+
+HOT_TABLES = {
+    'shifts',
+    'assignments',
+    'kids',
+    'staff_account_association',
+    'change_events',
+    'tombstones',
+    'presence_intervals',
+    'checkins',
+    'notification_outbox',
+}
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+@pytest.fixture
+def seeded_app():
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Plan Group', timezone='UTC')
+        other = AccountGroup(name='Other Group', timezone='UTC')
+        staff = StaffMember(full_name='Plan Staff', email='plan@example.com', role='Staff')
+        account.staff.append(staff)
+        base = datetime(2025, 8, 1, 8, 0)
+        rows = [account, other, staff]
+        for day in range(3):
+            for group in (account, other):
+                shift = Shift(
+                    account_group=group,
+                    site='Plan Site',
+                    start_time=base + timedelta(days=day),
+                    end_time=base + timedelta(days=day, hours=4),
+                    open_shift=day == 1,
+                )
+                assignment = Assignment(shift=shift, staff=staff, title='Plan')
+                kid = Kid(full_name=f'Kid {day}', account_group=group, shift=shift, assignment=assignment)
+                rows.extend([shift, assignment, kid])
+        db.session.add_all(rows)
+        db.session.commit()
+        yield app, account.id, rows[3].id
+        db.session.remove()
+        db.drop_all()
+
+
+def _full_scans(app, request):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = request(app.test_client())
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+
+    scans = []
+    with db.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+            for step in plan:
+                match = FULL_SCAN.match(step[-1])
+                if match and match.group(1) in HOT_TABLES:
+                    scans.append((step[-1], statement))
+    assert statements
+    return scans
+
+
+def test_shift_listing_uses_indexes(seeded_app):
+    app, account_id, _ = seeded_app
+    with app.app_context():
+        assert _full_scans(app, lambda client: client.get('/api/shifts', query_string={'account_id': account_id})) == []
+        windowed = {'account_id': account_id, 'from': '2025-08-01T00:00:00', 'to': '2025-08-03T00:00:00', 'limit': 1}
+        assert _full_scans(app, lambda client: client.get('/api/shifts', query_string=windowed)) == []
+
+
+def test_open_shifts_and_rosters_use_indexes(seeded_app):
+    app, account_id, _ = seeded_app
+    with app.app_context():
+        assert _full_scans(app, lambda client: client.get('/api/assignments/open')) == []
+        assert _full_scans(app, lambda client: client.get(f'/api/accounts/{account_id}/kids')) == []
+
+
+def test_sync_and_presence_use_indexes(seeded_app):
+    app, account_id, shift_id = seeded_app
+    with app.app_context():
+        since = (datetime.utcnow() - timedelta(minutes=1)).isoformat()
+        delta = {'account_id': account_id, 'since': since}
+        assert _full_scans(app, lambda client: client.get('/api/sync', query_string=delta)) == []
+        assert _full_scans(app, lambda client: client.get(f'/api/shifts/{shift_id}/presence')) == []
+
+
+def test_index_migration_restores_hot_path_indexes():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        upgrade()
+        downgrade(revision='0001_schema_catchup')
+        assert 'ix_shifts_account_start' not in {index['name'] for index in inspect(db.engine).get_indexes('shifts')}
+        upgrade()
+        assert {'ix_kids_account_name', 'ix_kids_shift', 'ix_kids_assignment'} <= {
+            index['name'] for index in inspect(db.engine).get_indexes('kids')
+        }
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP TABLE alembic_version'))
+        db.drop_all()
+
+
+def test_migrations_bootstrap_an_empty_database(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'empty.db')})
+    with app.app_context():
+        upgrade()
+        inspector = inspect(db.engine)
+        assert set(db.metadata.tables) <= set(inspector.get_table_names())
+        assert {'ratio_staff', 'ratio_kids'} <= {column['name'] for column in inspector.get_columns('kids')}
+        assert 'ix_shifts_account_start' in {index['name'] for index in inspector.get_indexes('shifts')}
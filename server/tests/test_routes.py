@@ -1,8 +1,40 @@
-from datetime import datetime, timedelta
+import gzip
+import json
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, insert, select, update
 
 from server.app import create_app
-from server.database import db
-from server.models import AccountGroup, Assignment, Kid, Shift, StaffMember
+from server.database import REPLICA_BIND, db, shard_bind
+from server.models import (
+    AccountGroup,
+    AccountShard,
+    Assignment,
+    CheckIn,
+    DailyShiftRollup,
+    ImportJob,
+    Kid,
+    NotificationOutbox,
+    PushToken,
+    Shift,
+    StaffMember,
+    staff_account_association,
+)
+from server.services import jobs
+from server.services.auth import create_access_token, password_pool
+from server.services.checkins import checkin_buffer, flush_checkins
+from server.services.geofence_index import geofence_index
+from server.services.jobs import STALE_AFTER, run_next_job
+from server.services.mail import get_transport
+from server.services.outbox import drain_outbox
+from server.services.principals import principal_cache
+from server.services.push import get_push_transport
+from server.services.sharding import each_shard, init_shards, move_account, use_shard
+
+
+def bearer(staff):
+    return {'Authorization': f"Bearer {create_access_token(staff.id, staff.role)['token']}"}
 
 
 def test_root_endpoint(tmp_path, monkeypatch):
@@ -60,12 +92,59 @@ def test_shifts_return_nested_assignments(tmp_path):
         client = app.test_client()
         response = client.get(f'/api/shifts?account_id={account.id}')
         assert response.status_code == 200
-        payload = response.get_json()
+        payload = response.get_json()['shifts']
         assert payload and payload[0]['assignments']
         assert payload[0]['assignments'][0]['kids']
         assert payload[0]['kids']
 
 
+def test_shifts_keyset_pagination_and_window(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'pages.db')
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Paged Group', timezone='UTC')
+        db.session.add(account)
+        db.session.flush()
+        base = datetime(2024, 1, 1, 8, 0)
+        for day in range(5):
+            for _ in range(2):
+                db.session.add(
+                    Shift(
+                        account_group_id=account.id,
+                        site='Main Hall',
+                        start_time=base + timedelta(days=day),
+                        end_time=base + timedelta(days=day, hours=4),
+                    )
+                )
+        db.session.commit()
+        client = app.test_client()
+
+        seen = []
+        cursor = None
+        while True:
+            params = {'account_id': account.id, 'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            payload = client.get('/api/shifts', query_string=params).get_json()
+            assert len(payload['shifts']) <= 3
+            seen.extend(shift['id'] for shift in payload['shifts'])
+            cursor = payload['next_cursor']
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen)) == 10
+
+        windowed = client.get(
+            '/api/shifts',
+            query_string={'account_id': account.id, 'from': '2024-01-02T00:00:00', 'to': '2024-01-04T00:00:00'},
+        ).get_json()
+        assert len(windowed['shifts']) == 4
+        assert windowed['next_cursor'] is None
+
+        assert client.get('/api/shifts', query_string={'cursor': 'not-a-cursor'}).status_code == 400
+
+
 def test_auth_signup_login_and_me(tmp_path):
     app = create_app()
     app.config['TESTING'] = True
@@ -172,3 +251,1309 @@ def test_notifications_endpoints(tmp_path):
 
         notify_resp = client.post(f'/api/notifications/assignment/{assignment.id}')
         assert notify_resp.status_code == 200
+
+
+def test_open_shifts_use_fixed_query_count(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'open.db')
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Open Group', timezone='UTC')
+        staff = StaffMember(full_name='Open Lead', email='open-lead@test.local', role='Lead')
+        account.staff.append(staff)
+        db.session.add(account)
+        for index in range(3):
+            shift = Shift(
+                account_group=account,
+                site='Annex',
+                start_time=datetime.utcnow() + timedelta(days=index),
+                end_time=datetime.utcnow() + timedelta(days=index, hours=4),
+                open_shift=True,
+            )
+            filled = Assignment(shift=shift, staff=staff, title='Filled', difficulty_rating=2)
+            pending = Assignment(shift=shift, title='Pending', difficulty_rating=2)
+            kid = Kid(full_name=f'Open Kid {index}', account_group=account, shift=shift, assignment=filled)
+            db.session.add_all([shift, filled, pending, kid])
+        db.session.commit()
+        shift_ids = {shift.id for shift in account.shifts}
+
+        statements = []
+
+        def counter(*args, **kwargs):
+            statements.append(1)
+
+        event.listen(db.engine, 'before_cursor_execute', counter)
+        try:
+            response = app.test_client().get('/api/assignments/open')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', counter)
+        assert response.status_code == 200
+        assert len(statements) == 3
+        ours = [item for item in response.get_json() if item['id'] in shift_ids]
+        assert len(ours) == 3
+        for item in ours:
+            assert item['role'] == 'Lead'
+            assert item['pendingAssignmentId']
+            filled = next(a for a in item['assignments'] if a['staff_id'])
+            assert filled['kidsCount'] == 1
+
+
+def test_staff_utilization_groups_by_day_for_account(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'reports.db')
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Report Group', timezone='UTC')
+        staff = StaffMember(full_name='Report Staff', email='report-staff@test.local', role='Staff')
+        db.session.add_all([account, staff])
+        base = datetime(2024, 3, 4, 9, 0)
+        two_hours = {'account_group': account, 'site': 'Gym', 'start_time': base, 'end_time': base + timedelta(hours=2)}
+        covered = Shift(**two_hours, ratio_min=1)
+        short = Shift(**two_hours, ratio_min=2)
+        later = Shift(
+            account_group=account,
+            site='Gym',
+            start_time=base + timedelta(days=1),
+            end_time=base + timedelta(days=1, hours=2),
+            ratio_min=1,
+            open_shift=True,
+        )
+        db.session.add_all([covered, short, later])
+        db.session.add_all(
+            [
+                Assignment(shift=covered, staff=staff, title='One'),
+                Assignment(shift=covered, staff=staff, title='Two'),
+                Assignment(shift=short, staff=staff, title='Three'),
+            ]
+        )
+        db.session.commit()
+
+        client = app.test_client()
+        response = client.get(f'/api/reports/staff-utilization?account_id={account.id}&group_by=day')
+        assert response.status_code == 200
+        report = response.get_json()
+        assert report['total_shifts'] == 3
+        assert report['ratio_compliant'] == 1
+        assert report['open_shifts'] == 1
+        assert report['averages']['assignments_per_shift'] == 1.0
+        assert [bucket['period'] for bucket in report['breakdown']] == ['2024-03-04', '2024-03-05']
+        assert report['breakdown'][0]['total_shifts'] == 2
+
+        weekly = client.get(f'/api/reports/staff-utilization?account_id={account.id}&group_by=week').get_json()
+        assert [bucket['period'] for bucket in weekly['breakdown']] == ['2024-03-04']
+        assert client.get('/api/reports/staff-utilization?group_by=month').status_code == 400
+
+
+def test_ratio_compliance_groups_roles_in_window(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'ratios.db')
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Ratio Group', timezone='UTC')
+        lead = StaffMember(full_name='Ratio Lead', email='ratio-lead@test.local', role='Lead')
+        db.session.add_all([account, lead])
+        base = datetime(2024, 5, 1, 9, 0)
+        may = Shift(account_group=account, site='Pool', start_time=base, end_time=base + timedelta(hours=3))
+        june = Shift(
+            account_group=account,
+            site='Pool',
+            start_time=base + timedelta(days=31),
+            end_time=base + timedelta(days=31, hours=3),
+        )
+        db.session.add_all(
+            [
+                may,
+                june,
+                Assignment(shift=may, staff=lead, title='Hard', difficulty_rating=5),
+                Assignment(shift=may, staff=lead, title='Easy', difficulty_rating=1),
+                Assignment(shift=may, title='Open', difficulty_rating=4),
+                Assignment(shift=june, staff=lead, title='Later', difficulty_rating=5),
+            ]
+        )
+        db.session.commit()
+
+        response = app.test_client().get(
+            '/api/reports/ratio-compliance',
+            query_string={'account_id': account.id, 'from': '2024-05-01T00:00:00', 'to': '2024-06-01T00:00:00'},
+        )
+        assert response.status_code == 200
+        assert response.get_json()['by_role'] == {
+            'Lead': {'count': 2, 'hard': 1},
+            'Unassigned': {'count': 1, 'hard': 1},
+        }
+
+
+def test_report_rollups_follow_writes_and_rebuild(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'rollups.db')
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Rollup Group', timezone='UTC')
+        staff = StaffMember(full_name='Rollup Staff', email='rollup-staff@test.local', role='Trainer')
+        db.session.add_all([account, staff])
+        db.session.commit()
+        client = app.test_client()
+
+        shift_id = client.post(
+            '/api/shifts',
+            json={
+                'account_group_id': account.id,
+                'start_time': '2024-07-01T09:00:00',
+                'end_time': '2024-07-01T13:00:00',
+                'ratio_min': 1,
+            },
+        ).get_json()['id']
+        client.post(
+            '/api/assignments',
+            json={'shift_id': shift_id, 'staff_id': staff.id, 'difficulty_rating': 5, 'kids': [{'name': 'Rollup Kid'}]},
+        )
+        client.patch(f'/api/shifts/{shift_id}', json={'openShift': True})
+
+        rollup = db.session.get(DailyShiftRollup, (account.id, date(2024, 7, 1)))
+        assert (rollup.shift_count, rollup.assignment_count, rollup.open_shift_count) == (1, 1, 1)
+        assert (rollup.ratio_compliant_count, rollup.kid_count) == (1, 1)
+        by_role = client.get(f'/api/reports/ratio-compliance?account_id={account.id}').get_json()['by_role']
+        assert by_role == {'Trainer': {'count': 1, 'hard': 1}}
+        staff.role = 'Lead'
+        db.session.commit()
+        by_role = client.get(f'/api/reports/ratio-compliance?account_id={account.id}').get_json()['by_role']
+        assert by_role == {'Lead': {'count': 1, 'hard': 1}}
+
+        db.session.execute(DailyShiftRollup.__table__.delete())
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['rollups', 'rebuild', '--account-id', account.id])
+        assert 'Rebuilt 1 daily rollup buckets' in result.output
+        report = client.get(f'/api/reports/staff-utilization?account_id={account.id}').get_json()
+        assert report['total_shifts'] == 1
+        assert report['open_shifts'] == 1
+
+
+def test_ratio_gaps_use_kid_ratios_and_leads(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Gap Group', timezone='UTC')
+        lead = StaffMember(full_name='Gap Lead', email='gap-lead@test.local', role='Lead')
+        helper = StaffMember(full_name='Gap Helper', email='gap-helper@test.local', role='Staff')
+        db.session.add_all([account, lead, helper])
+        base = datetime(2024, 8, 1, 9, 0)
+        busy = Shift(
+            account_group=account, site='Camp', start_time=base, end_time=base + timedelta(hours=4), ratio_min=1
+        )
+        calm = Shift(
+            account_group=account,
+            site='Camp',
+            start_time=base + timedelta(days=1),
+            end_time=base + timedelta(days=1, hours=4),
+            ratio_min=1,
+        )
+        db.session.add_all(
+            [
+                busy,
+                calm,
+                Assignment(shift=busy, staff=helper, title='Floor'),
+                Assignment(shift=calm, staff=lead, title='Lead'),
+                Kid(full_name='Solo', ratio='1:1', requires_personal_trainer=True, account_group=account, shift=busy),
+                Kid(full_name='Trio A', ratio='1:3', account_group=account, shift=busy),
+                Kid(full_name='Trio B', ratio='1:3', account_group=account, shift=busy),
+                Kid(full_name='Trio C', ratio='1:3', account_group=account, shift=busy),
+                Kid(full_name='Trio D', ratio='1:3', account_group=account, shift=busy),
+                Kid(full_name='Calm', ratio='1:4', account_group=account, shift=calm),
+            ]
+        )
+        db.session.commit()
+
+        response = app.test_client().get(f'/api/reports/ratio-gaps?account_id={account.id}')
+        assert response.status_code == 200
+        report = response.get_json()
+        assert report['shifts_evaluated'] == 2
+        assert report['shifts_with_gaps'] == 1
+        gap = report['gaps'][0]
+        assert gap['shift_id'] == busy.id
+        # One personal trainer plus ceil(4 / 3) for the 1:3 group.
+        assert (gap['requiredStaff'], gap['assignedStaff'], gap['staffGap']) == (3, 1, 2)
+        assert (gap['leadsRequired'], gap['assignedLeads'], gap['leadGap']) == (1, 0, 1)
+
+
+def test_coverage_timeline_sweeps_overlapping_shifts(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Coverage Group', timezone='UTC')
+        first = StaffMember(full_name='Early', email='early@test.local', role='Staff')
+        second = StaffMember(full_name='Late', email='late@test.local', role='Staff')
+        db.session.add_all([account, first, second])
+        base = datetime(2024, 9, 2, 8, 0)
+        morning = Shift(account_group=account, site='Hall', start_time=base, end_time=base + timedelta(minutes=45))
+        overlap = Shift(
+            account_group=account,
+            site='Hall',
+            start_time=base + timedelta(minutes=30),
+            end_time=base + timedelta(hours=1),
+        )
+        db.session.add_all(
+            [
+                morning,
+                overlap,
+                Assignment(shift=morning, staff=first, title='Open'),
+                Assignment(shift=overlap, staff=second, title='Relief'),
+                Kid(full_name='Early Kid', account_group=account, shift=morning),
+                Kid(full_name='Late Kid A', account_group=account, shift=overlap),
+                Kid(full_name='Late Kid B', account_group=account, shift=overlap),
+            ]
+        )
+        db.session.commit()
+
+        response = app.test_client().get(
+            '/api/reports/coverage',
+            query_string={'account_id': account.id, 'from': '2024-09-02T08:00:00', 'to': '2024-09-02T09:15:00'},
+        )
+        assert response.status_code == 200
+        buckets = [(bucket['staff'], bucket['kids']) for bucket in response.get_json()['buckets']]
+        assert buckets == [(1, 1), (1, 1), (2, 3), (1, 2), (0, 0)]
+
+
+def test_import_streams_rows_and_caps_errors(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Dry Run Group', timezone='UTC')
+        admin = StaffMember(full_name='Dry Run Admin', email='dry-admin@test.local', role='Admin')
+        account.staff.append(admin)
+        db.session.add(account)
+        db.session.commit()
+        client = app.test_client()
+        url = f'/api/imports/kids?dry_run=1&account_id={account.id}'
+        headers = bearer(admin)
+        lines = ['name,ratio'] + [f'Kid {index},1:2' for index in range(300)] + [',1:1'] * 150
+        response = client.post(url, data='\n'.join(lines), content_type='text/csv', headers=headers)
+        assert response.status_code == 422
+        result = response.get_json()
+        assert result['rows'] == 450
+        assert len(result['preview']) == 5
+        assert result['error_count'] == 150
+        assert len(result['errors']) == 100
+        assert result['errors_truncated'] is True
+
+        assert client.post(url, data='', content_type='text/csv', headers=headers).status_code == 400
+        valid = client.post(url, data='name\nSolo', content_type='text/csv', headers=headers)
+        assert valid.status_code == 200
+        assert valid.get_json()['rows'] == 1
+        assert Kid.query.count() == 0
+
+        assert client.post(url, data='name\nSolo', content_type='text/csv').status_code == 401
+        staff = StaffMember(full_name='Dry Run Staff', email='dry-staff@test.local', role='Staff')
+        account.staff.append(staff)
+        db.session.commit()
+        assert client.post(url, data='name\nSolo', headers=bearer(staff)).status_code == 403
+
+
+def test_import_persists_in_chunks_and_upserts_staff(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Import Group', timezone='UTC')
+        other = AccountGroup(name='Other Import Group', timezone='UTC')
+        existing = StaffMember(full_name='Old Name', email='dup@test.local', role='Staff')
+        admin = StaffMember(full_name='Kept Admin', email='admin@test.local', role='Admin')
+        outsider = StaffMember(full_name='Outsider', email='outsider@test.local', role='Staff')
+        account.staff.extend([existing, admin])
+        other.staff.append(outsider)
+        db.session.add_all([account, other])
+        shift, other_shift = (
+            Shift(
+                account_group=group,
+                site='Import Hall',
+                start_time=datetime(2024, 10, 1, 9, 0),
+                end_time=datetime(2024, 10, 1, 12, 0),
+            )
+            for group in (account, other)
+        )
+        db.session.add_all([shift, other_shift])
+        db.session.commit()
+        client = app.test_client()
+        headers = bearer(admin)
+
+        staff_csv = (
+            'full_name,email,role\nNew Name,DUP@test.local,Lead\nRenamed Admin,admin@test.local,\n'
+            'Hijacked,outsider@test.local,Admin\nBoss,boss@test.local,Owner_admin\n'
+        ) + '\n'.join(f'Person {index},person{index}@test.local,Staff' for index in range(7))
+        response = client.post(
+            f'/api/imports/staff?account_id={account.id}&chunk_size=3',
+            data=staff_csv,
+            content_type='text/csv',
+            headers=headers,
+        )
+        assert response.status_code == 422
+        assert response.get_json()['persisted'] == 9
+        assert response.get_json()['errors'] == [
+            'Row 3 invalid: outsider@test.local is registered to another account',
+            'Row 4 invalid: unsupported role Owner_admin',
+        ]
+        db.session.expire_all()
+        members = {member.email: (member.full_name, member.role) for member in account.staff}
+        assert len(members) == 9
+        assert members['dup@test.local'] == ('New Name', 'Lead')
+        assert members['admin@test.local'] == ('Renamed Admin', 'Admin')
+        assert (db.session.get(StaffMember, outsider.id).full_name, [group.id for group in outsider.accounts]) == (
+            'Outsider',
+            [other.id],
+        )
+
+        kids_csv = (
+            'name,ratio,shift_id,account_group_id\n'
+            f'Imported Kid,1:3,{shift.id},{other.id}\n'
+            f'Stray Kid,1:1,{other_shift.id},'
+        )
+        response = client.post(f'/api/imports/kids?account_id={account.id}', data=kids_csv, headers=headers)
+        assert response.get_json()['errors'] == ['Row 2 invalid: unknown shift_id']
+        kid = Kid.query.filter_by(full_name='Imported Kid').one()
+        assert (kid.ratio_staff, kid.ratio_kids, kid.account_group_id) == (1, 3, account.id)
+        assert Kid.query.filter_by(full_name='Stray Kid').count() == 0
+
+        assignments_csv = (
+            f'shift_id,staff_id,title\n{shift.id},{existing.id},Imported\nmissing-shift,,Ghost\n'
+            f'{shift.id},{outsider.id},Borrowed'
+        )
+        assert client.post('/api/imports/assignments', data=assignments_csv, headers=headers).status_code == 400
+        response = client.post(
+            f'/api/imports/assignments?account_id={account.id}', data=assignments_csv, headers=headers
+        )
+        assert response.status_code == 422
+        assert response.get_json()['persisted'] == 1
+        assert response.get_json()['errors'] == ['Row 2 invalid: unknown shift_id', 'Row 3 invalid: unknown staff_id']
+        rollup = db.session.get(DailyShiftRollup, (account.id, date(2024, 10, 1)))
+        assert (rollup.assignment_count, rollup.kid_count) == (1, 1)
+
+        assert client.post('/api/imports/kids', data=kids_csv, headers=headers).status_code == 400
+        foreign = client.post(f'/api/imports/kids?account_id={other.id}', data=kids_csv, headers=headers)
+        assert foreign.status_code == 403
+
+
+def test_async_import_job_reports_progress(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['IMPORT_RUNNER_AUTOSTART'] = False
+    app.config['IMPORT_SPOOL_DIR'] = str(tmp_path / 'spool')
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Async Group', timezone='UTC')
+        admin = StaffMember(full_name='Async Admin', email='async-admin@test.local', role='Admin')
+        account.staff.append(admin)
+        db.session.add(account)
+        db.session.commit()
+        client = app.test_client()
+        headers = bearer(admin)
+
+        kids_csv = 'name,ratio\n' + '\n'.join(f'Async Kid {index},1:2' for index in range(25)) + '\n,1:1'
+        job_url = f'/api/imports/kids?async=true&chunk_size=10&account_id={account.id}'
+        response = client.post(job_url, data=kids_csv, headers=headers)
+        assert response.status_code == 202
+        job = response.get_json()
+        assert job['status'] == 'queued'
+
+        assert run_next_job() == job['id']
+        assert run_next_job() is None
+        status = client.get(f"/api/imports/jobs/{job['id']}", headers=headers).get_json()
+        assert status['status'] == 'succeeded'
+        assert (status['rows_processed'], status['persisted'], status['error_count']) == (26, 25, 1)
+        assert not list((tmp_path / 'spool').iterdir())
+
+        # A runner killed after its first chunk leaves a stale job that resumes after the committed rows.
+        kids_csv = 'name,ratio\n' + '\n'.join(f'Resumed Kid {index},1:2' for index in range(25))
+        job = client.post(job_url, data=kids_csv, headers=headers).get_json()
+        record_progress = jobs._record_progress
+
+        def killed(*args, **kwargs):
+            raise KeyboardInterrupt
+
+        jobs._record_progress = killed
+        try:
+            run_next_job()
+        except KeyboardInterrupt:
+            db.session.rollback()
+        finally:
+            jobs._record_progress = record_progress
+        db.session.execute(
+            update(ImportJob).values(heartbeat_at=datetime.utcnow() - STALE_AFTER - timedelta(minutes=1))
+        )
+        db.session.commit()
+        assert Kid.query.filter(Kid.full_name.like('Resumed Kid%')).count() == 10
+
+        assert run_next_job() == job['id']
+        status = client.get(f"/api/imports/jobs/{job['id']}", headers=headers).get_json()
+        assert (status['status'], status['rows_processed'], status['persisted']) == ('succeeded', 25, 25)
+        assert Kid.query.filter(Kid.full_name.like('Resumed Kid%')).count() == 25
+
+        # A job that fails outright does not leave its upload behind.
+        job = client.post(job_url, data='name,ratio\nDoomed Kid,1:1', headers=headers).get_json()
+        import_rows = jobs.import_rows
+
+        def broken(*args, **kwargs):
+            raise RuntimeError('disk on fire')
+
+        jobs.import_rows = broken
+        try:
+            assert run_next_job() == job['id']
+        finally:
+            jobs.import_rows = import_rows
+        status = client.get(f"/api/imports/jobs/{job['id']}", headers=headers).get_json()
+        assert (status['status'], status['errors']) == ('failed', ['Import aborted: disk on fire'])
+        assert not list((tmp_path / 'spool').iterdir())
+
+
+def test_exports_stream_projected_rows(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Export Group', timezone='UTC')
+        other = AccountGroup(name='Other Group', timezone='UTC')
+        viewer = StaffMember(full_name='Export Viewer', email='viewer@export.test', role='Staff')
+        account.staff.append(viewer)
+        db.session.add_all([account, other])
+        base = datetime(2024, 11, 4, 9, 0)
+        db.session.add_all(
+            [
+                Shift(account_group=account, site='North', start_time=base, end_time=base + timedelta(hours=2)),
+                Shift(
+                    account_group=account,
+                    site='South',
+                    start_time=base + timedelta(days=7),
+                    end_time=base + timedelta(days=7, hours=2),
+                ),
+                Shift(account_group=other, site='Elsewhere', start_time=base, end_time=base + timedelta(hours=2)),
+                Kid(full_name='Export Kid', ratio='1:2', account_group=account),
+            ]
+        )
+        db.session.commit()
+        client = app.test_client()
+
+        headers = bearer(viewer)
+        response = client.get(
+            '/api/exports/shifts',
+            query_string={'account_id': account.id, 'fields': 'site,start_time', 'to': '2024-11-05T00:00:00'},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert response.get_data(as_text=True).splitlines() == ['site,start_time', 'North,2024-11-04T09:00:00']
+
+        ndjson = client.get(
+            '/api/exports/kids',
+            query_string={'account_id': account.id, 'format': 'ndjson', 'fields': 'name,ratio'},
+            headers=headers,
+        )
+        assert ndjson.get_data(as_text=True) == '{"name": "Export Kid", "ratio": "1:2"}\n'
+        invalid = client.get(
+            '/api/exports/kids', query_string={'account_id': account.id, 'fields': 'password_hash'}, headers=headers
+        )
+        assert invalid.status_code == 400
+        assert client.get('/api/exports/shifts', headers=headers).status_code == 400
+        assert client.get('/api/exports/shifts', query_string={'account_id': account.id}).status_code == 401
+        foreign = client.get('/api/exports/shifts', query_string={'account_id': other.id}, headers=headers)
+        assert foreign.status_code == 403
+
+
+def test_checkpointed_export_resumes_after_last_chunk():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Audit Group', timezone='UTC')
+        other = AccountGroup(name='Other Audit Group', timezone='UTC')
+        auditor = StaffMember(full_name='Auditor', email='auditor@audit.test', role='Staff')
+        outsider = StaffMember(full_name='Outside Auditor', email='outsider@audit.test', role='Staff')
+        account.staff.append(auditor)
+        other.staff.append(outsider)
+        db.session.add_all([account, other])
+        created = datetime(2024, 12, 1, 8, 0)
+        kids = [
+            Kid(
+                full_name=f'Audit Kid {index}',
+                ratio='1:1',
+                account_group=account,
+                created_at=created + timedelta(minutes=index // 2),
+            )
+            for index in range(7)
+        ]
+        db.session.add_all(kids)
+        db.session.commit()
+        client = app.test_client()
+        headers = bearer(auditor)
+
+        first = client.get(
+            '/api/exports/kids/chunks',
+            query_string={'account_id': account.id, 'fields': 'name', 'limit': 3},
+            headers=headers,
+        )
+        assert first.status_code == 200
+        assert first.headers['X-Export-Complete'] == 'false'
+        lines = gzip.decompress(first.data).decode().splitlines()
+        assert lines[0] == 'name' and len(lines) == 4
+        checkpoint = first.headers['X-Export-Checkpoint']
+
+        # Rows written mid-export fall after the pinned high-water mark.
+        db.session.add(
+            Kid(full_name='Late Kid', ratio='1:1', account_group=account, created_at=created + timedelta(days=1))
+        )
+        db.session.commit()
+
+        received = lines[1:]
+        bodies = [first.data]
+        for _ in range(2):
+            resumed = client.get(
+                '/api/exports/kids/chunks', query_string={'checkpoint': checkpoint, 'limit': 3}, headers=headers
+            )
+            bodies.append(resumed.data)
+            received += gzip.decompress(resumed.data).decode().splitlines()
+            checkpoint = resumed.headers['X-Export-Checkpoint']
+        assert resumed.headers['X-Export-Complete'] == 'true'
+        assert sorted(received) == sorted(kid.full_name for kid in kids)
+        assert gzip.decompress(b''.join(bodies)).decode().splitlines() == ['name'] + received
+
+        # The final checkpoint has nothing left to send.
+        retry = client.get('/api/exports/kids/chunks', query_string={'checkpoint': checkpoint}, headers=headers)
+        assert retry.headers['X-Export-Rows'] == '0'
+        assert client.get('/api/exports/kids/chunks?checkpoint=bogus', headers=headers).status_code == 400
+        assert client.get('/api/exports/kids/chunks', headers=headers).status_code == 400
+
+        # Another account's member cannot start the export or replay its checkpoint.
+        outside = bearer(outsider)
+        started = client.get('/api/exports/kids/chunks', query_string={'account_id': account.id}, headers=outside)
+        assert started.status_code == 403
+        replayed = client.get('/api/exports/kids/chunks', query_string={'checkpoint': checkpoint}, headers=outside)
+        assert replayed.status_code == 403
+        assert client.get('/api/exports/kids/chunks', query_string={'checkpoint': checkpoint}).status_code == 401
+
+
+def test_notification_outbox_dispatches_in_batches_with_retries():
+    app = create_app()
+    app.config.update(
+        TESTING=True, MAIL_TRANSPORT='local', NOTIFY_BATCH_SIZE=2, NOTIFY_MAX_ATTEMPTS=2, NOTIFY_COALESCE_SECONDS=0
+    )
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Outbox Group', timezone='UTC')
+        lead = StaffMember(full_name='Lead', email='lead@outbox.test', role='Lead')
+        team = [
+            StaffMember(full_name=f'Staff {index}', email=f'staff{index}@outbox.test', role='Staff')
+            for index in range(3)
+        ]
+        account.staff.extend([lead, *team])
+        shift = Shift(
+            account_group=account,
+            site='Outbox Site',
+            start_time=datetime(2025, 1, 6, 9, 0),
+            end_time=datetime(2025, 1, 6, 13, 0),
+        )
+        db.session.add_all([account, lead, *team, shift, Assignment(shift=shift, staff=lead, title='Lead')])
+        db.session.commit()
+        mailbox = get_transport(app)
+        mailbox.refuse.add('staff2@outbox.test')
+        client = app.test_client()
+
+        response = client.patch(f'/api/shifts/{shift.id}', json={'openShift': True})
+        assert response.status_code == 200
+        # The request only wrote outbox rows: one direct, one broadcast.
+        assert mailbox.messages == []
+        assert NotificationOutbox.query.count() == 2
+
+        result = drain_outbox()
+        assert (result.sent, result.retried) == (4, 1)
+        recipients = sorted(message['To'] for message in mailbox.messages)
+        assert recipients == ['lead@outbox.test', 'lead@outbox.test', 'staff0@outbox.test', 'staff1@outbox.test']
+
+        refused = NotificationOutbox.query.filter_by(recipient='staff2@outbox.test').one()
+        assert (refused.status, refused.attempts) == ('pending', 1)
+        assert refused.next_attempt_at > datetime.utcnow()
+        refused.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert drain_outbox().failed == 1
+        assert NotificationOutbox.query.filter_by(status='failed').count() == 1
+        assert NotificationOutbox.query.filter_by(status='expanded').count() == 1
+
+
+def test_notifications_coalesce_inside_window():
+    app = create_app()
+    app.config.update(TESTING=True, MAIL_TRANSPORT='local', NOTIFY_COALESCE_SECONDS=60)
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Busy Group', timezone='UTC')
+        lead = StaffMember(full_name='Busy Lead', email='lead@busy.test', role='Lead')
+        admin = StaffMember(full_name='Busy Admin', email='admin@busy.test', role='Admin')
+        requester = StaffMember(full_name='Requester', email='requester@busy.test', role='Staff')
+        account.staff.extend([lead, admin, requester])
+        shift = Shift(
+            account_group=account,
+            site='Busy Site',
+            start_time=datetime(2025, 2, 3, 9, 0),
+            end_time=datetime(2025, 2, 3, 13, 0),
+        )
+        open_slot = Assignment(shift=shift, title='Open slot')
+        lead_slot = Assignment(shift=shift, staff=lead, title='Lead')
+        db.session.add_all([account, lead, admin, requester, shift, lead_slot, open_slot])
+        db.session.commit()
+        client = app.test_client()
+
+        for ratio in (2, 3, 4):
+            assert client.patch(f'/api/shifts/{shift.id}', json={'ratio_min': ratio}).status_code == 200
+        for _ in range(2):
+            response = client.post(f'/api/assignments/{open_slot.id}/request', json={'staff_id': requester.id})
+            assert response.status_code == 200
+
+        stats = client.get('/api/notifications/stats').get_json()
+        # Three shift updates, two admin broadcasts, two requester notices.
+        assert stats['events'] == 7
+        assert stats['messages']['pending'] == 6
+        assert stats['suppressed'] == 1
+        # The first event for each key goes out at once; the repeats wait for the window.
+        assert drain_outbox().sent == 3
+        transport = get_transport(app)
+        first = {message['To']: message['Subject'] for message in transport.messages}
+        assert first == {
+            'lead@busy.test': 'Shift update alert',
+            'admin@busy.test': 'Open shift offered',
+            'requester@busy.test': 'Assignment change',
+        }
+        assert drain_outbox().sent == 0
+
+        NotificationOutbox.query.update({'next_attempt_at': datetime.utcnow()})
+        db.session.commit()
+        assert drain_outbox().sent == 3
+        digests = {message['To']: message['Subject'] for message in transport.messages[3:]}
+        assert digests == {
+            'lead@busy.test': 'Shift update alert (2 updates)',
+            'admin@busy.test': 'Open shift offered',
+            'requester@busy.test': 'Assignment change',
+        }
+        stats = client.get('/api/notifications/stats').get_json()
+        assert (stats['messages']['sent'], stats['suppressed']) == (6, 1)
+
+
+def test_open_shift_broadcast_fans_out_to_push_batches():
+    app = create_app()
+    app.config.update(
+        TESTING=True, MAIL_TRANSPORT='local', PUSH_TRANSPORT='local', PUSH_BATCH_SIZE=2, NOTIFY_COALESCE_SECONDS=0
+    )
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Push Group', timezone='UTC')
+        team = [
+            StaffMember(full_name=f'Pusher {index}', email=f'push{index}@push.test', role='Staff') for index in range(4)
+        ]
+        account.staff.extend(team)
+        shift = Shift(
+            account_group=account,
+            site='Push Site',
+            start_time=datetime(2025, 3, 3, 9, 0),
+            end_time=datetime(2025, 3, 3, 13, 0),
+        )
+        db.session.add_all([account, *team, shift])
+        db.session.commit()
+        client = app.test_client()
+
+        for index, staff in enumerate(team[:3]):
+            payload = {'staff_id': staff.id, 'token': f'device-{index}', 'platform': 'ios'}
+            assert client.post('/api/notifications/register', json=payload).status_code == 201
+        # Re-registering a token moves it instead of duplicating it.
+        for member, token in ((team[0], 'device-1'), (team[2], 'device-3')):
+            registered = client.post('/api/notifications/register', json={'staff_id': member.id, 'token': token})
+            assert registered.status_code == 201
+        assert PushToken.query.count() == 4
+        assert PushToken.query.filter_by(token='device-1').one().staff_id == team[0].id
+
+        gateway = get_push_transport(app)
+        gateway.unregistered.add('device-3')
+        gateway.unavailable.add('device-2')
+        assert client.patch(f'/api/shifts/{shift.id}', json={'openShift': True}).status_code == 200
+        result = drain_outbox()
+
+        # Fanned-out rows keep the account, so they are held while it moves between shards.
+        accounts = db.session.execute(select(NotificationOutbox.account_group_id).distinct()).scalars().all()
+        assert accounts == [account.id]
+        assert sorted(len(tokens) for tokens, _ in gateway.calls) == [2, 2]
+        assert gateway.calls[0][1].title == 'Open shift offered'
+        # Staff without a device, including the one whose token moved, get email.
+        emailed = sorted(message['To'] for message in get_transport(app).messages)
+        assert emailed == ['push1@push.test', 'push3@push.test']
+        assert PushToken.query.filter_by(token='device-3').count() == 0
+        assert (result.sent, result.retried) == (3, 1)
+        retry = NotificationOutbox.query.filter_by(channel='push', status='pending').one()
+        assert retry.device_tokens == ['device-2']
+
+        assert client.delete('/api/notifications/register', json={'token': 'device-0'}).status_code == 204
+        assert PushToken.query.count() == 2
+
+
+def _sse_events(body: str) -> list[tuple[int, str, dict]]:
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        if 'event' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_account_change_stream_replays_compact_deltas():
+    app = create_app()
+    app.config.update(TESTING=True, SSE_HOLD_SECONDS=0, SSE_REPLAY_LIMIT=4, NOTIFY_COALESCE_SECONDS=0)
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Live Group', timezone='UTC')
+        db.session.add(account)
+        db.session.commit()
+        client = app.test_client()
+
+        ready = client.get(f'/api/accounts/{account.id}/events')
+        assert ready.mimetype == 'text/event-stream'
+        assert ready.get_data(as_text=True).startswith('retry: 3000')
+        [(start_id, kind, _)] = _sse_events(ready.get_data(as_text=True))
+        assert kind == 'ready'
+
+        shift_id = client.post(
+            '/api/shifts',
+            json={
+                'account_group_id': account.id,
+                'start_time': '2025-04-07T09:00:00',
+                'end_time': '2025-04-07T13:00:00',
+            },
+        ).get_json()['id']
+        client.patch(f'/api/shifts/{shift_id}', json={'ratio_min': 3})
+        client.post('/api/assignments', json={'shift_id': shift_id, 'kids': [{'name': 'Streamed Kid'}]})
+
+        events = _sse_events(
+            client.get(
+                f'/api/accounts/{account.id}/events', headers={'Last-Event-ID': str(start_id)}
+            ).get_data(as_text=True)
+        )
+        assert [kind for _, kind, _ in events] == ['shift.created', 'shift.updated', 'assignment.created']
+        assert events[1][2] == {
+            'id': shift_id,
+            'ratio_min': 3,
+            'leads_required': 1,
+            'is_special': False,
+            'openShift': False,
+        }
+        assert events[2][2]['kids'][0]['name'] == 'Streamed Kid'
+
+        resumed = client.get(f'/api/accounts/{account.id}/events', query_string={'last_event_id': events[1][0]})
+        assert [kind for _, kind, _ in _sse_events(resumed.get_data(as_text=True))] == ['assignment.created']
+
+        other = AccountGroup(name='Other Live Group', timezone='UTC')
+        db.session.add(other)
+        db.session.commit()
+        for name in ('One', 'Two'):
+            client.post(f'/api/accounts/{other.id}/kids', json={'name': f'Other {name}'})
+            client.post(f'/api/accounts/{account.id}/kids', json={'name': name})
+        # Other accounts' ids interleave; a subscriber whose last event is still retained is not reset.
+        current = client.get(f'/api/accounts/{account.id}/events', query_string={'last_event_id': events[2][0]})
+        assert [kind for _, kind, _ in _sse_events(current.get_data(as_text=True))] == ['kid.created', 'kid.created']
+        # Only the newest SSE_REPLAY_LIMIT events are kept; stale subscribers must refetch.
+        stale = client.get(f'/api/accounts/{account.id}/events', headers={'Last-Event-ID': str(start_id)})
+        assert [kind for _, kind, _ in _sse_events(stale.get_data(as_text=True))] == ['reset']
+
+
+def test_delta_sync_returns_changes_and_tombstones():
+    app = create_app()
+    app.config.update(TESTING=True, SYNC_OVERLAP_SECONDS=0)
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(name='Sync Group', timezone='UTC')
+        shift = Shift(
+            account_group=account,
+            site='Sync Site',
+            start_time=datetime(2025, 5, 5, 9, 0),
+            end_time=datetime(2025, 5, 5, 13, 0),
+        )
+        assignment = Assignment(shift=shift, title='Synced')
+        quiet_kid = Kid(full_name='Quiet Kid', account_group=account)
+        leaving_kid = Kid(full_name='Leaving Kid', account_group=account, shift=shift)
+        db.session.add_all([account, shift, assignment, quiet_kid, leaving_kid])
+        db.session.commit()
+        client = app.test_client()
+
+        full = client.get('/api/sync', query_string={'account_id': account.id}).get_json()
+        assert full['full'] is True
+        assert (len(full['shifts']), len(full['assignments']), len(full['kids'])) == (1, 1, 2)
+
+        client.patch(f'/api/shifts/{shift.id}', json={'ratio_min': 4})
+        db.session.delete(db.session.get(Kid, leaving_kid.id))
+        db.session.commit()
+
+        delta = client.get('/api/sync', query_string={'account_id': account.id, 'since': full['watermark']}).get_json()
+        assert delta['full'] is False
+        assert [row['ratio_min'] for row in delta['shifts']] == [4]
+        assert delta['assignments'] == [] and delta['kids'] == []
+        assert delta['deleted'] == {'shifts': [], 'assignments': [], 'kids': [leaving_kid.id]}
+
+        stale = client.get(
+            '/api/sync', query_string={'account_id': account.id, 'since': '2000-01-01T00:00:00'}
+        ).get_json()
+        assert stale['reset'] is True and stale['full'] is True
+        assert client.get('/api/sync').status_code == 400
+
+
+def test_require_auth_caches_principal_until_membership_changes():
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        signup = client.post(
+            '/api/auth/signup',
+            json={'full_name': 'Cache Owner', 'email': 'cache-owner@example.com', 'password': 'cachePass123'},
+        ).get_json()
+        headers = {'Authorization': f"Bearer {signup['access_token']}"}
+        account_id = signup['accounts'][0]['id']
+        other = AccountGroup(name='Other Site', timezone='UTC')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+
+        assert client.get('/api/auth/me', headers=headers).status_code == 200
+        assert len(principal_cache(app)) == 1
+
+        statements = []
+
+        def listener(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        denied = client.post(f'/api/accounts/{other_id}/staff', json={}, headers=headers)
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        assert denied.status_code == 403
+        assert statements == []
+
+        owner = db.session.get(StaffMember, signup['staff']['id'])
+        owner.accounts.append(db.session.get(AccountGroup, other_id))
+        db.session.commit()
+        assert len(principal_cache(app)) == 0
+        member = {'full_name': 'Second Site', 'email': 'second-site@example.com', 'password': 'secondPass123'}
+        assert client.post(f'/api/accounts/{other_id}/staff', json=member, headers=headers).status_code == 201
+
+        owner.role = 'Staff'
+        db.session.commit()
+        demoted = client.post(f'/api/accounts/{account_id}/staff', json=member, headers=headers)
+        assert demoted.status_code == 403
+        assert demoted.get_json()['error'] == 'Insufficient permissions'
+
+
+def test_password_pool_sheds_load_and_rehashes_on_login():
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_BCRYPT_ROUNDS=4, PASSWORD_WORKERS=1, PASSWORD_QUEUE_LIMIT=0)
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        credentials = {'email': 'pool-owner@example.com', 'password': 'poolPass123'}
+        assert client.post('/api/auth/signup', json={'full_name': 'Pool Owner', **credentials}).status_code == 201
+
+        started, release = threading.Event(), threading.Event()
+
+        def occupy_worker():
+            started.set()
+            release.wait()
+
+        blocker = threading.Thread(target=password_pool(app).run, args=(occupy_worker,))
+        blocker.start()
+        started.wait()
+        try:
+            busy = client.post('/api/auth/login', json=credentials)
+            assert busy.status_code == 503
+            assert busy.headers['Retry-After'] == '1'
+        finally:
+            release.set()
+            blocker.join()
+
+        app.config['PASSWORD_BCRYPT_ROUNDS'] = 5
+        assert client.post('/api/auth/login', json=credentials).status_code == 200
+        stored = StaffMember.query.filter_by(email=credentials['email']).one().password_hash
+        assert stored.split('$')[2] == '05'
+        assert client.post('/api/auth/login', json=credentials).status_code == 200
+
+
+def test_batch_geofence_validation_resolves_each_fence_once():
+    app = create_app()
+    app.config.update(TESTING=True, GEOFENCE_BATCH_LIMIT=5)
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(
+            name='Fence Group', timezone='UTC', geofence_lat=40.0, geofence_lon=-74.0, geofence_radius=500
+        )
+        shift = Shift(
+            account_group=account,
+            site='Fence Site',
+            start_time=datetime(2025, 6, 1, 9, 0),
+            end_time=datetime(2025, 6, 1, 13, 0),
+        )
+        first, second = Assignment(shift=shift, title='North'), Assignment(shift=shift, title='South')
+        db.session.add_all([account, shift, first, second])
+        db.session.commit()
+        first_id, second_id = first.id, second.id
+        client = app.test_client()
+
+        points = [
+            {'assignment_id': first_id, 'lat': 40.0, 'lon': -74.0, 'timestamp': '2025-06-01T09:00:00'},
+            {'assignment_id': first_id, 'lat': 40.01, 'lon': -74.0, 'timestamp': '2025-06-01T09:01:00'},
+            {'assignment_id': second_id, 'lat': 40.003, 'lon': -74.0},
+            {'assignment_id': 'missing', 'lat': 40.0, 'lon': -74.0},
+            {'assignment_id': first_id, 'lat': 'north'},
+        ]
+        statements = []
+
+        def listener(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        response = client.post('/api/assignments/validate-geofence', json={'points': points})
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        assert response.status_code == 200
+        assert len(statements) == 1
+        results = response.get_json()['results']
+        assert [result.get('allowed') for result in results] == [True, False, True, None, None]
+        assert results[0]['distance_meters'] == 0.0 and 1100 < results[1]['distance_meters'] < 1120
+        assert results[1]['timestamp'] == '2025-06-01T09:01:00'
+        errors = [result.get('error') for result in results[3:]]
+        assert errors == ['Assignment not found', 'lat and lon must be numbers']
+
+        single = client.get(
+            f'/api/assignments/{second_id}/validate-geofence', query_string={'lat': 40.003, 'lon': -74.0}
+        )
+        assert single.get_json() == {'allowed': True}
+        assert client.post('/api/assignments/validate-geofence', json={'points': points * 2}).status_code == 400
+
+
+def test_reverse_geofence_lookup_tracks_account_changes():
+    app = create_app()
+    app.config.update(TESTING=True, GEOFENCE_INDEX_REFRESH_SECONDS=0)
+    with app.app_context():
+        db.create_all()
+        campus = AccountGroup(name='Campus', timezone='UTC', geofence_lat=40.0, geofence_lon=-74.0, geofence_radius=800)
+        annex = AccountGroup(name='Annex', timezone='UTC', geofence_lat=40.004, geofence_lon=-74.0, geofence_radius=800)
+        region = AccountGroup(
+            name='Region', timezone='UTC', geofence_lat=40.0, geofence_lon=-74.0, geofence_radius=400_000
+        )
+        far = AccountGroup(name='Far', timezone='UTC', geofence_lat=34.0, geofence_lon=-118.0, geofence_radius=800)
+        db.session.add_all([campus, annex, region, far])
+        db.session.commit()
+        campus_id, annex_id = campus.id, annex.id
+        client = app.test_client()
+
+        def lookup(lat, lon):
+            response = client.get('/api/geofences/lookup', query_string={'lat': lat, 'lon': lon})
+            return [account['name'] for account in response.get_json()['accounts']]
+
+        assert lookup(40.003, -74.0) == ['Annex', 'Campus', 'Region']
+        assert lookup(34.0, -118.0) == ['Far']
+        assert len(geofence_index(app)) == 4
+
+        db.session.get(AccountGroup, annex_id).geofence_lat = 45.0
+        db.session.delete(db.session.get(AccountGroup, campus_id))
+        db.session.commit()
+        assert lookup(40.003, -74.0) == ['Region']
+        assert lookup(45.0, -74.0) == ['Annex']
+
+        # Rows written by another process are folded in by the periodic refresh.
+        db.session.execute(
+            db.update(AccountGroup)
+            .where(AccountGroup.id == annex_id)
+            .values(active=False, updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+        assert lookup(45.0, -74.0) == []
+        assert client.get('/api/geofences/lookup', query_string={'lat': 'x'}).status_code == 400
+
+
+def test_checkins_buffer_into_presence_intervals():
+    app = create_app()
+    app.config.update(TESTING=True, CHECKIN_GAP_SECONDS=300)
+    with app.app_context():
+        db.create_all()
+        account = AccountGroup(
+            name='Presence Group', timezone='UTC', geofence_lat=40.0, geofence_lon=-74.0, geofence_radius=200
+        )
+        shift = Shift(
+            account_group=account,
+            site='Presence Site',
+            start_time=datetime(2025, 7, 1, 9, 0),
+            end_time=datetime(2025, 7, 1, 13, 0),
+        )
+        assignment = Assignment(shift=shift, title='Floor')
+        db.session.add_all([account, shift, assignment])
+        db.session.commit()
+        assignment_id, shift_id = assignment.id, shift.id
+        client = app.test_client()
+
+        def ping(minute, on_site=True, hour=9):
+            lat = 40.0 if on_site else 40.01
+            timestamp = f'2025-07-01T{hour:02d}:{minute:02d}:00'
+            return {'assignment_id': assignment_id, 'lat': lat, 'lon': -74.0, 'timestamp': timestamp}
+
+        undated = {'assignment_id': assignment_id, 'lat': 40.0, 'lon': -74.0}
+        first = client.post(
+            '/api/checkins', json={'points': [ping(2), ping(0), ping(1), ping(5, False), ping(6), undated]}
+        )
+        assert first.status_code == 202
+        assert first.get_json() == {'accepted': 5, 'rejected': [{'index': 5, 'error': 'timestamp is required'}]}
+        assert CheckIn.query.count() == 0 and len(checkin_buffer(app)) == 5
+        assert flush_checkins(app) == 5
+
+        client.post('/api/checkins', json={'points': [ping(7), ping(0, hour=8), ping(30)]})
+        assert flush_checkins(app) == 3
+        assert CheckIn.query.count() == 8
+
+        presence = client.get(f'/api/shifts/{shift_id}/presence').get_json()
+        [entry] = presence['assignments']
+        spans = [
+            (interval['on_site'], interval['started_at'][11:16], interval['ended_at'][11:16], interval['ping_count'])
+            for interval in entry['intervals']
+        ]
+        assert spans == [
+            (True, '09:00', '09:02', 3),
+            (False, '09:05', '09:05', 1),
+            (True, '09:06', '09:07', 2),
+            (True, '09:30', '09:30', 1),
+        ]
+        assert entry['on_site_seconds'] == 180
+        assert client.get('/api/shifts/missing/presence').status_code == 404
+
+        # A failed inline flush at CHECKIN_BUFFER_LIMIT requeues the buffered pings and refuses new ones.
+        app.config['CHECKIN_BUFFER_LIMIT'] = 1
+        assert client.post('/api/checkins', json={'points': [ping(45)]}).status_code == 202
+
+        def refuse(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO checkins'):
+                raise RuntimeError('database unavailable')
+
+        event.listen(db.engine, 'before_cursor_execute', refuse)
+        try:
+            response = client.post('/api/checkins', json={'points': [ping(46), ping(47)]})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', refuse)
+        assert response.status_code == 503 and response.headers['Retry-After']
+        assert len(checkin_buffer(app)) == 1
+        assert flush_checkins(app) == 1
+
+
+def test_listing_reads_use_replica_until_client_writes(tmp_path):
+    app = create_app(
+        {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'primary.db'),
+            'SQLALCHEMY_REPLICA_URI': 'sqlite:///' + str(tmp_path / 'replica.db'),
+            'REPLICA_STICKY_SECONDS': 30,
+        }
+    )
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        replica = db.engines[REPLICA_BIND]
+        db.metadata.create_all(replica)
+        account = {'id': 'acct-replica', 'name': 'Replica Group', 'timezone': 'UTC'}
+        other = {'id': 'acct-other', 'name': 'Other Replica Group', 'timezone': 'UTC'}
+        start = datetime(2025, 9, 1, 9, 0)
+        shift = {'account_group_id': account['id'], 'start_time': start, 'end_time': start + timedelta(hours=4)}
+        other_shift = {**shift, 'account_group_id': other['id']}
+        db.session.execute(insert(AccountGroup), [account, other])
+        db.session.execute(insert(Shift), [{**shift, 'site': 'Primary Site'}, {**other_shift, 'site': 'Other Primary'}])
+        db.session.commit()
+        with replica.begin() as connection:
+            connection.execute(insert(AccountGroup.__table__), [account, other])
+            connection.execute(
+                insert(Shift.__table__),
+                [
+                    {**shift, 'id': 'replica-shift', 'site': 'Lagging Site'},
+                    {**other_shift, 'id': 'other-replica-shift', 'site': 'Other Lagging'},
+                ],
+            )
+        # Requests share this app context's session; start each from a fresh one as a worker would.
+        db.session.remove()
+        client = app.test_client()
+
+        def listed_sites(reader=client, account_id=account['id']):
+            response = reader.get('/api/shifts', query_string={'account_id': account_id})
+            db.session.remove()
+            return [row['site'] for row in response.get_json()['shifts']]
+
+        assert listed_sites() == ['Lagging Site']
+        created = client.post(
+            '/api/shifts',
+            json={
+                'account_group_id': account['id'],
+                'site': 'New Site',
+                'start_time': '2025-09-02T09:00:00',
+                'end_time': '2025-09-02T13:00:00',
+            },
+        )
+        db.session.remove()
+        assert created.status_code == 201
+        assert 'Set-Cookie' not in created.headers
+        # Stickiness is kept on the server, so a client that sends no cookies still reads its write.
+        assert listed_sites(app.test_client(use_cookies=False)) == ['Primary Site', 'New Site']
+        assert listed_sites(account_id=other['id']) == ['Other Lagging']
+        replica.dispose()
+
+
+def test_account_moves_between_shards_and_requests_follow_it(tmp_path):
+    app = create_app(
+        {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'default.db'),
+            'SQLALCHEMY_SHARD_URIS': {'east': 'sqlite:///' + str(tmp_path / 'east.db')},
+            'SHARD_MAP_TTL_SECONDS': 0,
+            'CHECKIN_FLUSHER_AUTOSTART': False,
+            'IMPORT_RUNNER_AUTOSTART': False,
+            'IMPORT_SPOOL_DIR': str(tmp_path / 'spool'),
+        }
+    )
+    app.config.update(TESTING=True)
+    with app.app_context():
+        # Binds from other tests' apps linger on the shared extension; create the default schema only.
+        db.create_all(bind_key=None)
+        assert init_shards() == ['east']
+        east = db.engines[shard_bind('east')]
+        client = app.test_client()
+        credentials = {'email': 'owner@east.example', 'password': 'secret123'}
+        signup = client.post(
+            '/api/auth/signup', json={**credentials, 'full_name': 'East Owner', 'account_name': 'East Group'}
+        )
+        account_id = signup.get_json()['accounts'][0]['id']
+        shift = {
+            'account_group_id': account_id,
+            'site': 'East Site',
+            'start_time': '2025-10-01T09:00:00',
+            'end_time': '2025-10-01T13:00:00',
+        }
+        shift_id = client.post('/api/shifts', json=shift).get_json()['id']
+        db.session.remove()
+
+        def shift_count(engine):
+            with engine.connect() as connection:
+                return connection.execute(select(func.count()).select_from(Shift.__table__)).scalar_one()
+
+        report = move_account(account_id, 'east', settle_seconds=0)
+        db.session.remove()
+        assert (report.source, report.rows['shifts'], report.rows['staff_members']) == ('default', 1, 1)
+        assert (shift_count(db.engine), shift_count(east)) == (0, 1)
+        with db.engine.connect() as connection:
+            assert connection.execute(select(func.count()).select_from(StaffMember.__table__)).scalar_one() == 0
+
+        listed = client.get('/api/shifts', query_string={'account_id': account_id})
+        assert [row['site'] for row in listed.get_json()['shifts']] == ['East Site']
+        # Sign-in and token resolution name no account, so they search the shards.
+        token = client.post('/api/auth/login', json=credentials).get_json()['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        me = client.get('/api/auth/me', headers=headers)
+        assert [account['id'] for account in me.get_json()['accounts']] == [account_id]
+        db.session.remove()
+        # Requests that only name a shift or assignment are routed to its owner's shard.
+        assert client.patch(f'/api/shifts/{shift_id}', json={'ratio_min': 2}).status_code == 200
+        db.session.remove()
+        assigned = client.post('/api/assignments', json={'shift_id': shift_id, 'title': 'East Floor'})
+        assignment_id = assigned.get_json()['id']
+        db.session.remove()
+        assert client.get(f'/api/assignments/{assignment_id}/validate-geofence').get_json() == {'allowed': True}
+        db.session.remove()
+        ping = {'assignment_id': assignment_id, 'lat': 0.0, 'lon': 0.0, 'timestamp': '2025-10-01T09:05:00'}
+        assert client.post('/api/checkins', json={'points': [ping]}).get_json()['accepted'] == 1
+        db.session.remove()
+        assert flush_checkins(app) == 1
+        db.session.remove()
+        with east.connect() as connection:
+            assert connection.execute(select(func.count()).select_from(CheckIn.__table__)).scalar_one() == 1
+
+        late_ping = {**ping, 'timestamp': '2025-10-01T09:10:00'}
+        assert client.post('/api/checkins', json={'points': [late_ping]}).get_json()['accepted'] == 1
+        db.session.remove()
+        job_url = f'/api/imports/kids?async=true&account_id={account_id}'
+        job = client.post(job_url, data='name,ratio\nMoved Kid,1:1', headers=headers).get_json()
+        db.session.remove()
+
+        db.session.execute(update(AccountShard).values(state='moving'))
+        db.session.commit()
+        db.session.remove()
+        frozen = client.post('/api/shifts', json={**shift, 'site': 'Late Site'})
+        assert frozen.status_code == 503 and frozen.headers['Retry-After']
+        db.session.remove()
+        assert client.patch(f'/api/shifts/{shift_id}', json={'ratio_min': 5}).status_code == 503
+        db.session.remove()
+        assert client.post('/api/checkins', json={'points': [ping]}).status_code == 503
+        db.session.remove()
+        assert client.get('/api/shifts', query_string={'account_id': account_id}).status_code == 200
+        db.session.remove()
+        # Background writers leave the moving account's rows alone until it lands.
+        assert flush_checkins(app) == 0 and len(checkin_buffer(app)) == 1
+        for _ in each_shard(app):
+            assert run_next_job() is None
+        db.session.remove()
+
+        move_account(account_id, 'default', settle_seconds=0)
+        db.session.remove()
+        assert (shift_count(db.engine), shift_count(east)) == (1, 0)
+        assert db.session.execute(select(AccountShard)).first() is None
+        listed = client.get('/api/shifts', query_string={'account_id': account_id})
+        assert [row['ratio_min'] for row in listed.get_json()['shifts']] == [2]
+        assert flush_checkins(app) == 1
+        assert run_next_job() == job['id']
+        assert CheckIn.query.count() == 2 and Kid.query.filter_by(full_name='Moved Kid').count() == 1
+        east.dispose()
+
+
+def test_staff_copies_on_several_shards_stay_in_sync(tmp_path):
+    app = create_app(
+        {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'default.db'),
+            'SQLALCHEMY_SHARD_URIS': {'east': 'sqlite:///' + str(tmp_path / 'east.db')},
+            'SHARD_MAP_TTL_SECONDS': 0,
+        }
+    )
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all(bind_key=None)
+        init_shards()
+        east = db.engines[shard_bind('east')]
+        client = app.test_client()
+        credentials = {'email': 'both@shards.example', 'password': 'secret123'}
+        signup = client.post(
+            '/api/auth/signup', json={**credentials, 'full_name': 'Both Owner', 'account_name': 'East Group'}
+        )
+        staff_id = signup.get_json()['staff']['id']
+        east_id = signup.get_json()['accounts'][0]['id']
+        home = AccountGroup(name='Home Group', timezone='UTC')
+        db.session.add(home)
+        db.session.flush()
+        db.session.execute(insert(staff_account_association), [{'staff_id': staff_id, 'account_group_id': home.id}])
+        db.session.commit()
+        home_id = home.id
+        # The owner still belongs to Home Group, so a copy stays on the default shard too.
+        move_account(east_id, 'east', settle_seconds=0)
+        db.session.remove()
+
+        def roles(engine):
+            with engine.connect() as connection:
+                return connection.execute(select(StaffMember.role).where(StaffMember.id == staff_id)).scalars().all()
+
+        login = client.post('/api/auth/login', json=credentials).get_json()
+        assert sorted(account['id'] for account in login['accounts']) == sorted([east_id, home_id])
+        db.session.remove()
+
+        use_shard('east')
+        db.session.get(StaffMember, staff_id).role = 'Admin'
+        db.session.commit()
+        db.session.remove()
+        assert roles(db.engine) == roles(east) == ['Admin']
+
+        registered = client.post('/api/notifications/register', json={'staff_id': staff_id, 'token': 'device-1'})
+        assert registered.status_code == 201
+        db.session.remove()
+        with east.connect() as connection:
+            tokens = connection.execute(select(PushToken.token).where(PushToken.staff_id == staff_id)).scalars().all()
+        assert tokens == ['device-1']
+        east.dispose()
+
@@ -3,10 +3,12 @@ from __future__ import annotations
 from functools import wraps
 from typing import Callable, Optional
 
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 
-from ..models import StaffMember
+from ..database import current_shard, db
 from ..services.auth import decode_access_token
+from ..services.principals import load_principal, principal_cache
+from ..services.sharding import PINNED, locate, use_shard
 
 
 def _token_from_header() -> Optional[str]:
@@ -24,19 +26,27 @@ def require_auth(func: Callable) -> Callable:
         if not token:
             return jsonify({'error': 'Authorization token required'}), 401
 
-        payload = decode_access_token(token)
-        if not payload:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-
-        staff_id = payload.get('sub')
-        if not staff_id:
-            return jsonify({'error': 'Invalid token payload'}), 401
-
-        staff = StaffMember.query.get(staff_id)
-        if not staff:
-            return jsonify({'error': 'Staff member not found'}), 404
-
-        return func(*args, current_staff=staff, **kwargs)
+        cache = principal_cache(current_app._get_current_object())
+        pinned = db.session.info.get(PINNED)
+        key = f'{current_shard()}|{token}' if pinned else token
+        principal = cache.get(key)
+        if principal is not None and not pinned:
+            use_shard(principal.shard)
+        if principal is None:
+            payload = decode_access_token(token)
+            if not payload:
+                return jsonify({'error': 'Invalid or expired token'}), 401
+
+            staff_id = payload.get('sub')
+            if not staff_id:
+                return jsonify({'error': 'Invalid token payload'}), 401
+
+            principal = locate(lambda: load_principal(staff_id))
+            if not principal:
+                return jsonify({'error': 'Staff member not found'}), 404
+            cache.put(key, principal, payload.get('exp'))
+
+        return func(*args, current_staff=principal, **kwargs)
 
     return decorated
 
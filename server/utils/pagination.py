@@ -0,0 +1,46 @@
+"""Keyset pagination helpers for time-ordered listings."""
+from __future__ import annotations
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(start_time: datetime, row_id: str) -> str:
+    raw = f'{start_time.isoformat()}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        start_raw, row_id = raw.split('|', 1)
+        return datetime.fromisoformat(start_raw), row_id
+    except (binascii.Error, UnicodeError, ValueError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def parse_page_size(raw: Optional[str], default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    if raw is None or raw == '':
+        return default
+    try:
+        size = int(raw)
+    except ValueError as exc:
+        raise ValueError('limit must be an integer') from exc
+    if size < 1:
+        raise ValueError('limit must be positive')
+    return min(size, maximum)
+
+
+def parse_timestamp(raw: Optional[str], name: str) -> Optional[datetime]:
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError as exc:
+        raise ValueError(f'{name} must be an ISO-8601 timestamp') from exc
@@ -0,0 +1,24 @@
+"""Parsing for staff:kid ratio strings such as ``'1:3'``."""
+from __future__ import annotations
+
+from typing import Optional
+
+DEFAULT_RATIO = (1, 1)
+
+
+def parse_ratio(value: Optional[str]) -> tuple[int, int]:
+    """Return ``(staff, kids)`` for a ratio string.
+
+    Anything unparseable is treated as 1:1, the strictest supervision level,
+    so a typo can never make a shift look over-staffed.
+    """
+    if not value:
+        return DEFAULT_RATIO
+    staff_raw, _, kids_raw = value.partition(':')
+    try:
+        staff, kids = int(staff_raw), int(kids_raw)
+    except ValueError:
+        return DEFAULT_RATIO
+    if staff < 1 or kids < 1:
+        return DEFAULT_RATIO
+    return staff, kids
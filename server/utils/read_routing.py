@@ -0,0 +1,110 @@
+"""Route read-only handlers to the read replica, with read-your-writes stickiness.
+
+When ``SQLALCHEMY_REPLICA_URI`` is set, handlers decorated with
+:func:`replica_reads` run their SELECTs against the replica. A request whose
+session writes to the primary records its bearer token and the accounts it
+wrote to (the account it addressed plus those of the rows it flushed) in a
+per-process :class:`LastWriteMap`. For ``REPLICA_STICKY_SECONDS`` after that,
+reads by the same token or for the same account stay on the primary, so a
+client does not miss its own change while the replica catches up. Nothing
+depends on the client returning a cookie. Without a replica URL the decorator
+is a no-op.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from flask import Flask, current_app, request
+from sqlalchemy import event
+
+from ..database import USE_REPLICA, WROTE, db
+from ..services.sharding import addressed_account_id
+
+WRITTEN_ACCOUNTS = 'written_account_ids'
+MAX_TRACKED_WRITERS = 10000
+
+
+class LastWriteMap:
+    def __init__(self, ttl: float, max_entries: int = MAX_TRACKED_WRITERS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expires: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, keys: Iterable[str]) -> None:
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._expires[key] = expires_at
+            if len(self._expires) > self.max_entries:
+                now = time.monotonic()
+                self._expires = {key: until for key, until in self._expires.items() if until > now}
+
+    def recent(self, keys: Iterable[str]) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(self._expires.get(key, 0) > now for key in keys)
+
+
+def last_write_map(app: Flask) -> LastWriteMap:
+    writes = app.extensions.get('last_write_map')
+    if writes is None:
+        writes = app.extensions.setdefault(
+            'last_write_map', LastWriteMap(app.config.get('REPLICA_STICKY_SECONDS', 5))
+        )
+    return writes
+
+
+def _writer_keys(account_ids: Iterable[Optional[str]]) -> list[str]:
+    keys = [f'account:{account_id}' for account_id in account_ids if account_id]
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0].lower() == 'bearer':
+        keys.append(f'token:{header[1]}')
+    return keys
+
+
+def replica_reads(func: Callable) -> Callable:
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        app = current_app._get_current_object()
+        if app.config.get('SQLALCHEMY_REPLICA_URI') and not last_write_map(app).recent(
+            _writer_keys([addressed_account_id()])
+        ):
+            db.session.info[USE_REPLICA] = True
+        return func(*args, **kwargs)
+
+    return decorated
+
+
+def _mark_flush(session, flush_context) -> None:
+    session.info[WROTE] = True
+    written = session.info.setdefault(WRITTEN_ACCOUNTS, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        account_id = getattr(obj, 'account_group_id', None)
+        if isinstance(account_id, str):
+            written.add(account_id)
+
+
+def _mark_write(orm_execute_state) -> None:
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info[WROTE] = True
+
+
+def _record_last_write(response):
+    if db.session.info.get(WROTE):
+        account_ids = {addressed_account_id(), *db.session.info.pop(WRITTEN_ACCOUNTS, ())}
+        last_write_map(current_app._get_current_object()).record(_writer_keys(account_ids))
+    return response
+
+
+def register_read_routing(app: Flask) -> None:
+    if not app.config.get('SQLALCHEMY_REPLICA_URI'):
+        return
+    app.after_request(_record_last_write)
+    if event.contains(db.session, 'after_flush', _mark_flush):
+        return
+    event.listen(db.session, 'after_flush', _mark_flush)
+    event.listen(db.session, 'do_orm_execute', _mark_write)
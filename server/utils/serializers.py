@@ -1,6 +1,7 @@
 from typing import Optional
 
-from ..models import Assignment, Kid, Shift
+from ..models import Kid
+from ..services.shift_loader import ShiftBatch
 
 
 def kid_payload(kid: Kid) -> dict:
@@ -17,40 +18,38 @@ def kid_payload(kid: Kid) -> dict:
     }
 
 
-def assignment_payload(assignment: Assignment) -> dict:
-    kids = [kid_payload(kid) for kid in assignment.kids]
+def assignment_row_payload(assignment, site: Optional[str], kids: list) -> dict:
+    kid_items = [kid_payload(kid) for kid in kids]
     return {
         'id': assignment.id,
         'shift_id': assignment.shift_id,
         'staff_id': assignment.staff_id,
         'title': assignment.title,
-        'site': assignment.shift.site if assignment.shift else None,
+        'site': site,
         'difficulty': assignment.difficulty_rating,
         'instructions': assignment.instructions,
         'requiresOneOnOne': assignment.requires_one_on_one,
-        'kids': kids,
-        'kidsCount': len(kids),
-        'staff_role': assignment.staff.role if assignment.staff else None,
+        'kids': kid_items,
+        'kidsCount': len(kid_items),
+        'staff_role': assignment.staff_role,
     }
 
 
-def shift_role(shift: Shift) -> str:
-    for assignment in shift.assignments:
-        if assignment.staff and assignment.staff.role:
-            return assignment.staff.role
+def shift_role(assignments: list) -> str:
+    for assignment in assignments:
+        if assignment.staff_id and assignment.staff_role:
+            return assignment.staff_role
     return 'Staff'
 
 
-def pending_assignment_id(shift: Shift) -> Optional[str]:
-    for assignment in shift.assignments:
+def pending_assignment_id(assignments: list) -> Optional[str]:
+    for assignment in assignments:
         if assignment.staff_id is None:
             return assignment.id
     return None
 
 
-def shift_payload(shift: Shift) -> dict:
-    assignments = [assignment_payload(assignment) for assignment in shift.assignments]
-    kids = [kid_payload(kid) for kid in shift.kids]
+def shift_row_payload(shift, assignments: list, kids: list, kids_by_assignment: dict) -> dict:
     return {
         'id': shift.id,
         'account_group_id': shift.account_group_id,
@@ -60,11 +59,26 @@ def shift_payload(shift: Shift) -> dict:
         'ratio_min': shift.ratio_min,
         'leadsRequired': shift.leads_required,
         'difficulty': shift.difficulty,
-        'role': shift_role(shift),
+        'role': shift_role(assignments),
         'is_special': shift.is_special,
         'openShift': shift.open_shift,
-        'assignments': assignments,
-        'kids': kids,
-        'pendingAssignmentId': pending_assignment_id(shift),
-        'durationHours': shift.duration_hours,
+        'assignments': [
+            assignment_row_payload(assignment, shift.site, kids_by_assignment.get(assignment.id, []))
+            for assignment in assignments
+        ],
+        'kids': [kid_payload(kid) for kid in kids],
+        'pendingAssignmentId': pending_assignment_id(assignments),
+        'durationHours': (shift.end_time - shift.start_time).total_seconds() / 3600,
     }
+
+
+def shift_batch_payload(batch: ShiftBatch) -> list[dict]:
+    return [
+        shift_row_payload(
+            shift,
+            batch.assignments_by_shift.get(shift.id, []),
+            batch.kids_by_shift.get(shift.id, []),
+            batch.kids_by_assignment,
+        )
+        for shift in batch.shifts
+    ]